@@ -0,0 +1,188 @@
+from array import array
+from typing import List
+from equation_parser import AST, BinOp, Num, UnaryOp
+from lexer import Token, TokenType
+
+
+class ArenaException(Exception):
+    pass
+
+
+class Arena:
+    """Flat representation of an expression tree stored in parallel arrays
+
+    Node i is described by kind[i], token[i] (index into tokens), left[i],
+    right[i] and parent[i], missing links are set to NIL. UnaryOp nodes keep
+    their expression in left. Nodes are numbered in preorder, so leaves
+    appear in left-to-right order when scanning the arrays.
+    Traversals work on the arrays with explicit index stacks, they neither
+    recurse nor create per-node objects."""
+
+    NIL = -1
+    NUM = 0
+    UNARY = 1
+    BINARY = 2
+
+    def __init__(self):
+        self.kind = array('b')
+        self.token = array('l')
+        self.left = array('l')
+        self.right = array('l')
+        self.parent = array('l')
+        # Distinct tokens referenced by the token array
+        self.tokens: List[Token] = []
+        self._token_lookup = {}
+
+    def __len__(self) -> int:
+        return len(self.kind)
+
+    def _add_token(self, token: Token) -> int:
+        # 1 and 1.0 are equal dict keys but are traced differently
+        key = (token, type(token.value))
+        idx = self._token_lookup.get(key, None)
+        if idx == None:
+            idx = len(self.tokens)
+            self.tokens.append(token)
+            self._token_lookup[key] = idx
+        return idx
+
+    def _add_node(self, kind: int, token: Token, parent: int) -> int:
+        self.kind.append(kind)
+        self.token.append(self._add_token(token))
+        self.left.append(self.NIL)
+        self.right.append(self.NIL)
+        self.parent.append(parent)
+        return len(self.kind) - 1
+
+    @classmethod
+    def from_ast(cls, root: AST) -> "Arena":
+        """Converts tree of AST nodes into an arena, root gets index 0"""
+        arena = cls()
+        NIL = cls.NIL
+        # (node, parent index, True if node is the right child of the parent)
+        stack = [(root, NIL, False)]
+        while stack:
+            node, parent, is_right = stack.pop()
+            if isinstance(node, BinOp):
+                idx = arena._add_node(cls.BINARY, node.token, parent)
+                stack.append((node.right, idx, True))
+                stack.append((node.left, idx, False))
+            elif isinstance(node, UnaryOp):
+                idx = arena._add_node(cls.UNARY, node.token, parent)
+                stack.append((node.expr, idx, False))
+            elif isinstance(node, Num):
+                idx = arena._add_node(cls.NUM, node.token, parent)
+            else:
+                raise ArenaException(
+                    f"Cannot convert tree, node type: {type(node)} not supported")
+            if parent != NIL:
+                if is_right:
+                    arena.right[parent] = idx
+                else:
+                    arena.left[parent] = idx
+        return arena
+
+    def to_ast(self, idx: int = 0) -> AST:
+        """Converts the subtree rooted at idx back into AST nodes"""
+        tokens = self.tokens
+        stack = array('l', [idx])
+        built = {}
+        while stack:
+            i = stack.pop()
+            kind = self.kind[i]
+            if kind == self.NUM:
+                built[i] = Num(tokens[self.token[i]])
+            elif kind == self.UNARY:
+                expr = built.pop(self.left[i], None)
+                if expr == None:
+                    stack.append(i)
+                    stack.append(self.left[i])
+                else:
+                    built[i] = UnaryOp(expr, tokens[self.token[i]])
+            else:
+                left = self.left[i]
+                right = self.right[i]
+                if left in built and right in built:
+                    built[i] = BinOp(built.pop(left), tokens[self.token[i]], built.pop(right))
+                else:
+                    stack.append(i)
+                    stack.append(right)
+                    stack.append(left)
+        return built[idx]
+
+    def value(self, idx: int):
+        return self.tokens[self.token[idx]].value
+
+    def inorder(self, idx: int = 0) -> array:
+        """Returns indices of the subtree nodes in the same order as utils.inorder"""
+        result = array('l')
+        stack = array('l')
+        NIL = self.NIL
+        curr = idx
+        while curr != NIL or stack:
+            # Go down the left spine, UnaryOp expression acts as left child
+            while curr != NIL:
+                stack.append(curr)
+                curr = self.left[curr]
+            curr = stack.pop()
+            result.append(curr)
+            curr = self.right[curr]
+        return result
+
+    def dfs(self, symbol: str, idx: int = 0) -> array:
+        """Returns indices of symbol occurrences in the subtree rooted at idx,
+        in the same order as Solver.dfs"""
+        result = array('l')
+        NUM = self.NUM
+        kind = self.kind
+        values = [t.value for t in self.tokens]
+        token = self.token
+        # Preorder numbering makes every subtree a contiguous index range
+        end = self._subtree_end(idx)
+        for i in range(idx, end):
+            if kind[i] == NUM and values[token[i]] == symbol:
+                result.append(i)
+        return result
+
+    def _subtree_end(self, idx: int) -> int:
+        """Returns index one past the last node of the subtree rooted at idx"""
+        NIL = self.NIL
+        curr = idx
+        while True:
+            if self.right[curr] != NIL:
+                curr = self.right[curr]
+            elif self.left[curr] != NIL:
+                curr = self.left[curr]
+            else:
+                return curr + 1
+
+    def trace(self, idx: int = 0) -> str:
+        """Creates the same human readable equation as utils.trace"""
+        ENTER, OP, CLOSE = 0, 1, 2
+        tokens = self.tokens
+        result = []
+        # Entries are encoded as node index * 3 + action
+        stack = array('l', [idx * 3 + ENTER])
+        while stack:
+            i, action = divmod(stack.pop(), 3)
+            token = tokens[self.token[i]]
+            if action == OP:
+                result.append(token.value)
+            elif action == CLOSE:
+                result.append(')')
+            elif self.kind[i] == self.BINARY:
+                result.append('(')
+                stack.append(i * 3 + CLOSE)
+                stack.append(self.right[i] * 3 + ENTER)
+                stack.append(i * 3 + OP)
+                stack.append(self.left[i] * 3 + ENTER)
+            elif self.kind[i] == self.UNARY:
+                result.append(token.value)
+                if token.type == TokenType.FUNC:
+                    result.append('(')
+                    stack.append(i * 3 + CLOSE)
+                stack.append(self.left[i] * 3 + ENTER)
+            else:
+                result.append(str(token.value))
+        # HACK: Parenthesis removal, same as utils.trace
+        return ''.join(result)[1:-1]
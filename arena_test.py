@@ -0,0 +1,45 @@
+from arena import Arena
+from equation_parser import PrattParser, parse
+from isolation import Solver
+from utils import inorder, trace
+
+equations = ["a + b = a + c", "sin(x+2+y+x) = 1", "-x^2 = --y", "a/-c = b*(d-e)"]
+
+
+def test_arena_roundtrip():
+    for equation in equations:
+        tree = parse(equation)
+        arena = Arena.from_ast(tree)
+        assert len(arena) == len(inorder(tree))
+        assert trace(arena.to_ast()) == trace(tree)
+        assert arena.parent[0] == Arena.NIL
+
+
+def test_arena_trace():
+    for equation in equations:
+        assert Arena.from_ast(parse(equation)).trace() == trace(parse(equation))
+
+
+def test_arena_inorder():
+    for equation in equations:
+        tree = parse(equation)
+        arena = Arena.from_ast(tree)
+        expected = [n.token for n in inorder(tree)]
+        assert [arena.tokens[arena.token[i]] for i in arena.inorder()] == expected
+
+
+def test_arena_dfs():
+    s = Solver("a + b = a + c")
+    arena = Arena.from_ast(s.root)
+    assert len(arena.dfs("a")) == len(s.dfs("a")) == 2
+    # right side only
+    assert len(arena.dfs("a", arena.right[0])) == 1
+    assert len(arena.dfs("b", arena.right[0])) == 0
+
+
+def test_arena_deep_tree():
+    depth = 100_000
+    arena = Arena.from_ast(PrattParser("-(" * depth + "x" + ")" * depth + " = 1").parse())
+    assert arena.trace() == "-" * depth + "x=1"
+    assert len(arena.inorder()) == depth + 3
+    assert len(arena.dfs("x")) == 1
@@ -3,7 +3,29 @@ from equation_parser import AST, BinOp
 from lexer import TokenType, Token
 from utils import create_graphviz_graph, inorder, distance, swap, trace
 from itertools import combinations, groupby, pairwise, permutations
-from pattern_matcher import AnyOp, create_compound_binop, match
+from pattern_matcher import AnyOp, compile_pattern, create_compound_binop
+from rewrite import rewrite, stage_cache
+
+# Search patterns, compiled once
+left_sided_pattern = compile_pattern(
+    create_compound_binop({TokenType.PLUS, TokenType.MINUS},
+                          left=create_compound_binop(
+                              {TokenType.PLUS, TokenType.MINUS}, left=AnyOp(), right=AnyOp()),
+                          right=AnyOp()))
+right_sided_pattern = compile_pattern(
+    create_compound_binop({TokenType.PLUS, TokenType.MINUS},
+                          left=AnyOp(),
+                          right=create_compound_binop({TokenType.PLUS, TokenType.MINUS}, left=AnyOp(), right=AnyOp())))
+left_sided_pattern_mul = compile_pattern(
+    create_compound_binop({TokenType.MUL},
+                          left=create_compound_binop(
+                              {TokenType.MUL}, left=AnyOp(), right=AnyOp()),
+                          right=AnyOp()))
+right_sided_pattern_mul = compile_pattern(
+    create_compound_binop({TokenType.MUL},
+                          left=AnyOp(),
+                          right=create_compound_binop({TokenType.MUL}, left=AnyOp(), right=AnyOp())))
+
 
 # x+y+x -> x+x+y
 def attract_add_sub_mul(start_node: AST) -> bool:
@@ -20,37 +42,16 @@ def attract_add_sub_mul(start_node: AST) -> bool:
     #      *  c    OR    c    *
     #     / \                / \
     #    a   b              a   b
-    try:
-        # Search rule:
-        left_sided_pattern = create_compound_binop({TokenType.PLUS, TokenType.MINUS},
-                                                   left=create_compound_binop(
-                                                       {TokenType.PLUS, TokenType.MINUS}, left=AnyOp(), right=AnyOp()),
-                                                   right=AnyOp())
-        right_sided_pattern = create_compound_binop({TokenType.PLUS, TokenType.MINUS},
-                                                    left=AnyOp(),
-                                                    right=create_compound_binop({TokenType.PLUS, TokenType.MINUS}, left=AnyOp(), right=AnyOp()))
-
-        left_sided_pattern_mul = create_compound_binop({TokenType.MUL},
-                                                       left=create_compound_binop(
-                                                           {TokenType.MUL}, left=AnyOp(), right=AnyOp()),
-                                                       right=AnyOp())
-
-        right_sided_pattern_mul = create_compound_binop({TokenType.MUL},
-                                                        left=AnyOp(),
-                                                        right=create_compound_binop({TokenType.MUL}, left=AnyOp(), right=AnyOp()))
-
-        left_sided = match(start_node, left_sided_pattern)
-        right_sided = match(start_node, right_sided_pattern)
-
-        left_sided_mul = match(start_node, left_sided_pattern_mul)
-        right_sided_mul = match(start_node, right_sided_pattern_mul)
-
-        left_sided = left_sided or left_sided_mul
-        right_sided = right_sided or right_sided_mul
-
-        if (left_sided or right_sided) == False:
-            return False
-    except AttributeError:
+    left_sided = left_sided_pattern(start_node)
+    right_sided = right_sided_pattern(start_node)
+
+    left_sided_mul = left_sided_pattern_mul(start_node)
+    right_sided_mul = right_sided_pattern_mul(start_node)
+
+    left_sided = left_sided or left_sided_mul
+    right_sided = right_sided or right_sided_mul
+
+    if (left_sided or right_sided) == False:
         return False
 
     # Find unknowns in the subtrees of the start_node
@@ -117,10 +118,4 @@ def attract(root: AST):
     it will be applied otherwise skipped"""
 
     attraction_functions = [attract_add_sub_mul]
-    rerun = True
-    while rerun:
-        rerun = False
-        for f in attraction_functions:
-            tree_inord = inorder(root)
-            for node in tree_inord:
-                rerun |= f(node)
+    rewrite(root, attraction_functions, cache=stage_cache, name="attract")
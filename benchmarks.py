@@ -0,0 +1,410 @@
+"""Micro benchmarks for the solver pipeline
+
+Run with: python3 benchmarks.py [name ...]
+Without arguments every benchmark is executed.
+"""
+import contextlib
+import io
+import logging
+import subprocess
+import sys
+import tracemalloc
+from timeit import timeit
+
+import attraction
+import collection
+import compiler
+import postprocessing
+import preprocessing
+from equation_parser import Parser, PrattParser, parse
+import isolation
+from isolation import Solver
+from lexer import Lexer, RegexLexer, Token, TokenType
+from profiler import profile
+import numeric
+import polynomial
+import rewrite
+import utils
+from utils import copy_tree, inorder
+
+
+def generate_equation(length: int) -> str:
+    """Generates a long, valid equation string of roughly the given length"""
+    chunk = "x + 22*yy - (sin(z)^2) / 3 + "
+    terms = chunk * (length // len(chunk) + 1)
+    return terms[:length].rsplit("+", 1)[0] + "= 1"
+
+
+def bench_lexer():
+    """Compares per-character Lexer with the master regex RegexLexer"""
+    for length in [10_000, 100_000, 1_000_000]:
+        string = generate_equation(length)
+        number = max(1, 100_000 // length)
+        old = timeit(lambda: Lexer().lex(string), number=number) / number
+        new = timeit(lambda: RegexLexer().lex(string), number=number) / number
+        print(f"lexer {length:>9} chars: Lexer {old * 1000:9.2f} ms, "
+              f"RegexLexer {new * 1000:9.2f} ms, speedup {old / new:5.2f}x")
+
+
+def bench_parser():
+    """Compares recursive descent Parser with the explicit stack PrattParser"""
+    for length in [10_000, 100_000]:
+        string = generate_equation(length)
+        old = timeit(lambda: Parser(string).parse(), number=3) / 3
+        new = timeit(lambda: PrattParser(string).parse(), number=3) / 3
+        print(f"parser {length:>7} chars: Parser {old * 1000:8.2f} ms, "
+              f"PrattParser {new * 1000:8.2f} ms")
+
+    for depth in [100, 100_000]:
+        string = "-(" * depth + "x" + ")" * depth + " = 1"
+        try:
+            old = timeit(lambda: Parser(string).parse(), number=3) / 3
+            old = f"{old * 1000:8.2f} ms"
+        except RecursionError:
+            old = "RecursionError"
+        new = timeit(lambda: PrattParser(string).parse(), number=3) / 3
+        print(f"parser depth {depth:>7}: Parser {old}, "
+              f"PrattParser {new * 1000:8.2f} ms")
+
+
+# Equations and unknowns exercised by solver_test.py and system_solver_test.py
+solver_corpus = [
+    ("a + b = a + c", "b"), ("a+b=c", "a"), ("a+b=c", "b"), ("a-b=c", "a"),
+    ("a-b=c", "b"), ("a * b = c", "a"), ("a * b = c", "b"), ("a / b = c", "a"),
+    ("a / b = c", "b"), ("x+x+x=1", "x"), ("x-x-x=1", "x"), ("a/-c = b", "c"),
+    ("x = z + y", "x"), ("y = z", "y"), ("ek = (m*v^2) / 2", "v"),
+    ("p = m*v", "m"), ("r = 1/2 * a*t^2", "a"), ("sin(x) = 2+z", "x"),
+]
+
+
+@contextlib.contextmanager
+def cache_disabled():
+    """Turns off the stage cache, so that repeated runs do the same work"""
+    cache = rewrite.stage_cache
+    enabled = cache.enabled
+    cache.enabled = False
+    try:
+        yield
+    finally:
+        cache.enabled = enabled
+
+
+@contextlib.contextmanager
+def recursion_limit(limit: int):
+    previous = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(previous, limit))
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(previous)
+
+
+def solve_corpus(corpus=solver_corpus, repeat: int = 1):
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            for equation, symbol in corpus:
+                Solver(equation).solve(symbol)
+
+
+def bench_tokens():
+    """Reports memory allocated while solving the solver test corpus"""
+    solve_corpus()  # warm up caches so that they do not count to the peak
+    tracemalloc.start()
+    solve_corpus()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"tokens: solver corpus peak memory {peak / 1024:.1f} KiB")
+    seconds = timeit(lambda: solve_corpus(), number=20) / 20
+    print(f"tokens: solver corpus {seconds * 1000:.2f} ms per run")
+
+    token = Token("+", TokenType.PLUS)
+    size = sys.getsizeof(token)
+    if hasattr(token, "__dict__"):
+        size += sys.getsizeof(token.__dict__)
+    tree = parse(generate_equation(5_000))
+    tokens = [n.token for n in inorder(tree)]
+    distinct = len({id(t) for t in tokens})
+    print(f"tokens: {size} bytes per token, {distinct} distinct token objects "
+          f"for {len(tokens)} nodes")
+
+
+def bench_rewrite():
+    """Counts rule attempts of plain sweeps against incremental rewriting"""
+    # Scattered like terms need many attraction and collection passes
+    string = " + ".join(f"{i % 7}*x^2 + y*{i % 5} + z" for i in range(6)) + " = x"
+    for incremental, indexed in [(False, False), (True, False), (True, True)]:
+        totals = rewrite.RewriteStats()
+
+        # the stage cache is left out, every stage runs its rules
+        def counting_rewrite(root, rules, stats=None, incremental=incremental, index=None, cache=None, name=None):
+            stats = original(root, rules, totals, incremental,
+                             index if indexed else None)
+            return stats
+
+        original = rewrite.rewrite
+        for module in [attraction, collection, preprocessing, postprocessing]:
+            module.rewrite = counting_rewrite
+        try:
+            seconds = timeit(lambda: solve_corpus(), number=1)
+            start = totals.as_dict()
+            seconds += timeit(lambda: solve_corpus([(string, "x")]) , number=1)
+        finally:
+            for module in [attraction, collection, preprocessing, postprocessing]:
+                module.rewrite = original
+        print(f"rewrite incremental={incremental!s:5} indexed={indexed!s:5}: {totals.visits:8} node visits, "
+              f"{totals.attempts:8} rule attempts, {totals.fires:6} fires, "
+              f"{seconds * 1000:8.2f} ms")
+
+    # a single stage over a large tree, attraction dominates the solves above
+    tree = parse(" + ".join(f"x*{i % 7} + {i % 5}*2*3 + y^2" for i in range(200)) + " = 1")
+    preprocessing.preprocess(tree)
+    for incremental, indexed in [(False, False), (True, False), (True, True)]:
+        stats = rewrite.RewriteStats()
+
+        def collect_stage():
+            rewrite.rewrite(copy_tree(tree), collection.collection_functions, stats, incremental,
+                            collection.collection_index if indexed else None)
+
+        number = 3
+        seconds = timeit(collect_stage, number=number) / number
+        print(f"collect incremental={incremental!s:5} indexed={indexed!s:5}: {stats.visits // number:8} node visits, "
+              f"{stats.attempts // number:8} rule attempts, {seconds * 1000:8.2f} ms")
+
+
+def bench_nary():
+    """Compares like term collection by attraction and collection rule sweeps
+    with the stages of Solver(like_terms=True), which group like terms in the
+    n-ary normal form instead of attracting them"""
+    for terms in [4, 8, 16]:
+        string = " + ".join(f"{i % 7}*x + y*{i % 5} + z" for i in range(terms)) + " = 1"
+        tree = parse(string)
+
+        def sweeps():
+            root = copy_tree(tree)
+            attraction.attract(root)
+            preprocessing.preprocess(root)
+            collection.collect(root)
+
+        def grouped():
+            root = copy_tree(tree)
+            preprocessing.preprocess(root)
+            collection.collect(root, like_terms=True)
+
+        number = 3
+        with cache_disabled():
+            old = timeit(sweeps, number=number) / number
+            new = timeit(grouped, number=number) / number
+        print(f"like terms {terms * 3:>3} terms: rule sweeps {old * 1000:9.2f} ms, "
+              f"nary {new * 1000:7.2f} ms, speedup {old / new:7.2f}x")
+
+
+def bench_polynomial():
+    """Compares collection rule sweeps with the polynomial normal form on
+    polynomials with scattered like terms"""
+    for terms in [4, 8, 16]:
+        string = " + ".join(f"{i % 7}*x^2 - y*{i % 5} + x*y" for i in range(terms)) + " = 1"
+        tree = parse(string)
+
+        def sweeps():
+            root = copy_tree(tree)
+            attraction.attract(root)
+            preprocessing.preprocess(root)
+            collection.collect(root)
+
+        number = 3
+        with cache_disabled():
+            old = timeit(sweeps, number=number) / number
+        new = timeit(lambda: polynomial.collect_polynomials(copy_tree(tree)), number=number) / number
+        print(f"polynomial {terms * 3:>3} terms: rule sweeps {old * 1000:9.2f} ms, "
+              f"polynomial {new * 1000:7.2f} ms, speedup {old / new:7.2f}x")
+
+
+def bench_numeric():
+    """Compares number folding cost of the numeric backends on small ints"""
+    pairs = [(i % 97 + 1, i % 13 + 1) for i in range(10_000)]
+    for name, backend in numeric.backends.items():
+        values = [(backend.literal(str(a)), backend.literal(str(b))) for a, b in pairs]
+
+        def fold_all():
+            for a, b in values:
+                backend.fold("+", a, b)
+                backend.fold("*", a, b)
+                backend.fold("/", a, b)
+
+        seconds = timeit(fold_all, number=3) / 3
+        print(f"numeric {name:>8}: {seconds * 1000:7.2f} ms per {len(pairs) * 3} folds")
+
+
+def bench_cache():
+    """Compares repeated solving of the solver corpus with and without
+    the stage cache"""
+    cache = rewrite.stage_cache
+    with cache_disabled():
+        uncached = timeit(lambda: solve_corpus(), number=10) / 10
+    cache.clear()
+    cached = timeit(lambda: solve_corpus(), number=10) / 10
+    stats = cache.stats()
+    print(f"cache: uncached {uncached * 1000:7.2f} ms, cached {cached * 1000:7.2f} ms per corpus, "
+          f"hit rate {stats['hit_rate']:.2f}, {stats['entries']} entries, {stats['nodes']} nodes")
+
+
+def bench_profile():
+    """Prints the rule and stage profile of solving the solver corpus"""
+    with cache_disabled(), profile() as profiler:
+        solve_corpus()
+    print(profiler.to_json())
+
+
+def bench_tracing():
+    """Compares solve throughput with stage tracing off, logged at DEBUG
+    and printed for every stage like the solver used to"""
+    def printing_solve():
+        tracer = lambda stage, root: print(stage, utils.trace(root))
+        with contextlib.redirect_stdout(io.StringIO()):
+            for equation, symbol in solver_corpus:
+                Solver(equation, tracer).solve(symbol)
+
+    handler = logging.StreamHandler(io.StringIO())
+    number = 20
+    with cache_disabled():
+        off = timeit(lambda: solve_corpus(), number=number) / number
+        isolation.logger.addHandler(handler)
+        isolation.logger.setLevel(logging.DEBUG)
+        try:
+            logged = timeit(lambda: solve_corpus(), number=number) / number
+        finally:
+            isolation.logger.removeHandler(handler)
+            isolation.logger.setLevel(logging.NOTSET)
+        printed = timeit(printing_solve, number=number) / number
+    solves = len(solver_corpus)
+    for name, seconds in [("off", off), ("logged", logged), ("printed", printed)]:
+        print(f"tracing {name:>7}: {solves / seconds:9.0f} solves/s")
+
+
+def bench_isolation():
+    """Compares locating the searched symbol by searching both sides of the
+    equation with the symbol index kept current by the stages, which walks
+    the parent chain of every occurrence only"""
+    for terms in [100, 1_000, 5_000]:
+        # deep, left leaning right-hand side
+        s = Solver("sin(x) + 1 = " + " + ".join(f"y*{i}" for i in range(terms)))
+
+        def search():
+            s.dfs("x", s.root.left)
+            s.dfs("x", s.root.right)
+
+        def index():
+            s.index.update()
+            for snode in s.index.get("x"):
+                s.index.side(snode)
+
+        number = 5
+        with recursion_limit(4 * terms):
+            old = timeit(search, number=number) / number
+        new = timeit(index, number=number) / number
+        print(f"isolation rhs {terms:>5} terms: dfs {old * 1000:8.2f} ms, "
+              f"index {new * 1000:7.4f} ms, speedup {old / new:8.1f}x")
+
+
+def bench_compile():
+    """Compares solving the formula for every parameter set with calling
+    the compiled solution"""
+    equation, symbol = "ek = (m*v^2)/2", "v"
+    parameters = [{"ek": 1 + i % 100, "m": 1 + i % 7} for i in range(1_000)]
+
+    def solve():
+        # the values are substituted into the text and solved every time
+        for bindings in parameters:
+            Solver(f"{bindings['ek']} = ({bindings['m']}*v^2)/2").solve(symbol)
+
+    def compiled():
+        solution = Solver(equation).compile(symbol)
+        for bindings in parameters:
+            solution(bindings)
+
+    with cache_disabled():
+        old = timeit(solve, number=1)
+    compiler.solution_cache.clear()
+    new = timeit(compiled, number=1)
+    print(f"compile {len(parameters)} parameter sets: solve {old * 1000:8.2f} ms, "
+          f"compiled {new * 1000:7.2f} ms, speedup {old / new:7.1f}x")
+
+
+def bench_vectorize():
+    """Compares calling the compiled solution per row with the vectorized
+    solution over NumPy arrays"""
+    import numpy as np
+    equation, symbol = "ek = (m*v^2)/2", "v"
+    compiled = Solver(equation).compile(symbol)
+    vectorized = Solver(equation).vectorize(symbol)
+    for rows in [10_000, 1_000_000]:
+        ek = np.arange(1, rows + 1, dtype=np.float64)
+        m = np.full(rows, 3.0)
+        number = 3
+
+        def per_row():
+            for a, b in zip(ek.tolist(), m.tolist()):
+                compiled({"ek": a, "m": b})
+
+        old = timeit(per_row, number=number) / number
+        new = timeit(lambda: vectorized({"ek": ek, "m": m}), number=number) / number
+        print(f"vectorize {rows:>9} rows: per row {old * 1000:9.2f} ms, "
+              f"numpy {new * 1000:7.2f} ms, speedup {old / new:7.1f}x")
+
+
+def bench_cse():
+    """Compares evaluating an expression with repeated subexpressions with
+    and without common subexpression elimination"""
+    import numpy as np
+    tree = parse("(sin(a*b)+c)^2 + (sin(a*b)+c)*d - sin(a*b)/(sin(a*b)+c) = x")
+    with_cse = compiler.compile_expression(tree.left)
+    without_cse = compiler.compile_expression(tree.left, cse=False)
+    print(f"cse: {with_cse.report}")
+    values = {"a": 0.5, "b": 2.0, "c": 3.0, "d": 4.0}
+    arrays = {name: np.full(1_000_000, value) for name, value in values.items()}
+    vectorized = compiler.vectorize_expression(tree.left)
+    vectorized_plain = compiler.vectorize_expression(tree.left, cse=False)
+    for name, old, new, number in [
+            ("python", lambda: without_cse(values), lambda: with_cse(values), 100_000),
+            ("numpy", lambda: vectorized_plain(arrays), lambda: vectorized(arrays), 5)]:
+        old = timeit(old, number=number) / number
+        new = timeit(new, number=number) / number
+        print(f"cse {name:>6}: plain {old * 1e6:9.2f} us, shared {new * 1e6:9.2f} us, "
+              f"speedup {old / new:5.2f}x")
+
+
+def bench_import():
+    """Reports cumulative import time of the entry point modules, as measured
+    by python -X importtime"""
+    for module in ["main", "isolation", "system_solver"]:
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                capture_output=True, text=True, check=True)
+        for line in result.stderr.splitlines():
+            _, cumulative, name = line.split("|")
+            if name.strip() == module:
+                print(f"import {module:>13}: {int(cumulative) / 1000:7.2f} ms")
+
+
+benchmarks = {
+    "lexer": bench_lexer,
+    "parser": bench_parser,
+    "tokens": bench_tokens,
+    "import": bench_import,
+    "rewrite": bench_rewrite,
+    "nary": bench_nary,
+    "polynomial": bench_polynomial,
+    "numeric": bench_numeric,
+    "cache": bench_cache,
+    "profile": bench_profile,
+    "tracing": bench_tracing,
+    "isolation": bench_isolation,
+    "compile": bench_compile,
+    "vectorize": bench_vectorize,
+    "cse": bench_cse,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        benchmarks[name]()
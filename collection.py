@@ -1,34 +1,145 @@
 
 from math import acos, asin, atan, cos, sin, tan
-from equation_parser import AST, BinOp, UnaryOp
+from equation_parser import AST, BinOp, Num, UnaryOp
 from lexer import TokenType
-from pattern_matcher import AnyOp, create_compound_binop, match
+from pattern_matcher import AC_TOKEN_TYPES, AnyOp, DiscriminationNet, capture, chain_top, compile_pattern, create_ac_binop, create_compound_binop, create_compound_num
 from utils import create_func_unary, create_minus_unary, create_mul_op, create_num, create_plus_op, create_pow_op, create_sym, inorder, replace
+from rewrite import rewrite, stage_cache
+from nary import normalize
+from numeric import get_backend
 
 
 class CollectionException(Exception):
     pass
 
 
+# Concrete functions used for folding numbers, arithmetic comes from the
+# numeric backend
+function_table = {
+    "sin": sin,
+    "cos": cos,
+    "tan": tan,
+    "asin": asin,
+    "acos": acos,
+    "atan": atan,
+}
+
+# Patterns are compiled once, rules only run the matchers
+func_num_pattern = compile_pattern(
+    capture(create_func_unary(expr=capture(create_num(), "n"), func=""),
+            guard=lambda op: op.token.value in function_table))
+
+def _is_signed_number(node: AST) -> bool:
+    """Number, possibly negated by unary minus"""
+    if isinstance(node, UnaryOp) and node.token.type == TokenType.MINUS:
+        node = node.expr
+    return isinstance(node, Num) and node.token.type == TokenType.NUM
+
+
+def _signed_value(node: AST):
+    if isinstance(node, UnaryOp):
+        return -1 * node.expr.value
+    return node.value
+
+
+# n op m, where n and m may be negated. + and * chains fold any two of their
+# numbers: (2*x)*3 -> 6*x, the other operations only their own operands
+numbers_patterns = {
+    token_type: compile_pattern(capture(create_ac_binop(token_type, [capture(AnyOp(), "n", _is_signed_number),
+                                                                     capture(AnyOp(), "m", _is_signed_number)],
+                                                        rest="rest"),
+                                        guard=chain_top))
+    for token_type in AC_TOKEN_TYPES
+}
+numbers_pattern = compile_pattern(create_compound_binop({TokenType.MINUS, TokenType.DIV, TokenType.POW},
+                                                        left=capture(AnyOp(), "n", _is_signed_number),
+                                                        right=capture(AnyOp(), "m", _is_signed_number)))
+for token_type in [TokenType.MINUS, TokenType.DIV, TokenType.POW]:
+    numbers_patterns[token_type] = numbers_pattern
+
+#     +-
+#    /  \
+#  SYM  SYM
+add_sub_same_symbols_pattern = compile_pattern(
+    create_compound_binop({TokenType.PLUS, TokenType.MINUS},
+                          left=capture(create_sym(), "X"),
+                          right=capture(create_sym(), "X")))
+
+#          +-
+#       /     \
+#      */      */
+#     / \     / \
+#   SYM NUM SYM NUM (in any order)
+sym_num = {TokenType.SYM, TokenType.NUM}
+
+
+def _sym_and_num(op: BinOp) -> bool:
+    return op.left.token.type != op.right.token.type
+
+
+add_sub_same_symbols_mul_nums_pattern = compile_pattern(
+    create_compound_binop({TokenType.PLUS, TokenType.MINUS},
+                          left=capture(create_compound_binop({TokenType.MUL, TokenType.DIV},
+                                                             left=create_compound_num(sym_num),
+                                                             right=create_compound_num(sym_num)),
+                                       "l", _sym_and_num),
+                          right=capture(create_compound_binop({TokenType.MUL, TokenType.DIV},
+                                                              left=create_compound_num(sym_num),
+                                                              right=create_compound_num(sym_num)),
+                                        "r", _sym_and_num)))
+
+#          +-
+#       /      \
+#      *        *
+#     / \      / \
+#   NUM  ^   NUM  ^
+#       / \      / \
+#     SYM NUM  SYM NUM
+add_sub_pow_mul_nums_pattern = compile_pattern(
+    create_compound_binop({TokenType.PLUS, TokenType.MINUS},
+                          left=create_mul_op(
+                              left=capture(create_num(), "n"),
+                              right=create_pow_op(left=capture(create_sym(), "X"),
+                                                  right=capture(create_num(), "a"))),
+                          right=create_mul_op(
+                              left=capture(create_num(), "m"),
+                              right=create_pow_op(left=capture(create_sym(), "X"),
+                                                  right=capture(create_num(), "b")))))
+
+#     */
+#    /  \
+#  SYM  SYM
+mul_div_same_symbols_pattern = compile_pattern(
+    create_compound_binop({TokenType.MUL, TokenType.DIV},
+                          left=capture(create_sym("ANY"), "X"),
+                          right=capture(create_sym("ANY"), "X")))
+
+#          */
+#       /     \
+#      ^       ^
+#     / \     / \
+#   SYM NUM SYM NUM
+mul_same_symbols_with_pows_pattern = compile_pattern(
+    create_compound_binop({TokenType.MUL, TokenType.DIV},
+                          left=create_pow_op(left=capture(create_sym(), "X"),
+                                             right=capture(create_num(), "n")),
+                          right=create_pow_op(left=capture(create_sym(), "X"),
+                                              right=capture(create_num(), "m"))))
+
+
 def collect_functions(op: UnaryOp) -> bool:
     """Searches for the following pattern in the code and applies rule:
     func(NUM) -> num
     """
 
-    pattern = create_func_unary(expr = create_num(), func="")
-    if not match(op,pattern):
+    bindings = func_num_pattern.bind(op)
+    if bindings == None:
         return False
 
-    func_dict = {
-        "sin" : sin, 
-        "cos" : cos, 
-        "tan" : tan, 
-        "asin" : asin,
-        "acos" : acos,
-        "atan" : atan,
-    }
-
-    val = func_dict[op.token.value](op.expr.token.value)
+    try:
+        val = get_backend().function(function_table[op.token.value], bindings["n"].value)
+    except ValueError:
+        return False  # outside of the function domain, leave it as it is
     node = create_num(val)
     replace(op, node)
     return True
@@ -41,65 +152,24 @@ def collect_numbers(op: BinOp) -> bool:
         returns True if operation was executed
     """
 
-    try:
-        # Search rules:
-        pattern_normal = create_compound_binop({TokenType.PLUS, TokenType.MINUS, TokenType.MUL, TokenType.DIV, TokenType.POW},
-        left=create_num(),
-        right=create_num())
-
-        pattern_unary_num = create_compound_binop({TokenType.PLUS, TokenType.MINUS, TokenType.MUL, TokenType.DIV, TokenType.POW},
-        left=create_minus_unary(expr=create_num()),
-        right=create_num())
-
-        pattern_num_unary = create_compound_binop({TokenType.PLUS, TokenType.MINUS, TokenType.MUL, TokenType.DIV, TokenType.POW},
-        left=create_num(),
-        right=create_minus_unary(expr=create_num()))
-
-        pattern_unary_unary = create_compound_binop({TokenType.PLUS, TokenType.MINUS, TokenType.MUL, TokenType.DIV, TokenType.POW},
-        left=create_minus_unary(expr=create_num()),
-        right=create_minus_unary(expr=create_num()))
-
-        if not (match(op,pattern_normal) 
-        or match(op,pattern_num_unary) 
-        or match(op,pattern_unary_num)
-        or match(op,pattern_unary_unary)):
-            return False
-    except AttributeError:
+    pattern = numbers_patterns.get(op.token.type, None)
+    bindings = pattern.bind(op) if pattern != None else None
+    if bindings == None:
         return False
-
-
-    # define concrete operation dict
-    op_dict = {
-        TokenType.PLUS: lambda x, y: x + y,
-        TokenType.MINUS: lambda x, y: x - y,
-        TokenType.MUL: lambda x, y: x * y,
-        TokenType.DIV: lambda x, y: x / y,
-        TokenType.POW: lambda x, y: x ** y
-    }
-
-    l = op.left.token.value
-    r = op.right.token.value
-
-    #convert numbers with unary minuses into negative numbers
-    if isinstance(op.left, UnaryOp):
-        l = -1 * op.left.expr.value
-
-    if isinstance(op.right, UnaryOp):
-        r = -1 * op.right.expr.value
-
-    num = create_num(op_dict[op.token.type](l, r), op.parent)
-
-    # change references
-    if isinstance(op.parent, UnaryOp):
-        op.parent.expr = num
-    elif isinstance(op.parent, BinOp):
-        if op.isLeft():
-            op.parent.left = num
-        else:
-            op.parent.right = num
-    else:
-        raise CollectionException(
-            f"Tree in bad state, cannot reassign child references from type {type(op.parent)}")
+    n = bindings["n"]
+    # all numbers of a chain are folded at once
+    others = [bindings["m"]] + [r for r in bindings.get("rest", []) if _is_signed_number(r)]
+    backend = get_backend()
+    value = _signed_value(n)
+    for m in others:
+        value = backend.fold(op.token.value, value, _signed_value(m))
+
+    # the other numbers are dropped from their operations, then n is
+    # replaced with the result
+    for m in others:
+        parent = m.parent
+        replace(parent, parent.left if parent.right is m else parent.right)
+    replace(n, create_num(value))
     return True
 
 
@@ -111,33 +181,17 @@ def collect_add_sub_same_symbols(op: BinOp):
         returns True if operation was executed
     """
 
-    try:
-        # Search rule:
-        if not (op.token.type in {TokenType.PLUS, TokenType.MINUS}
-                and op.left.token.type == TokenType.SYM
-                and op.right.token.type == TokenType.SYM
-                and op.left.token.value == op.right.token.value):
-            return False
-    except AttributeError:
+    bindings = add_sub_same_symbols_pattern.bind(op)
+    if bindings == None:
         return False
 
     new_tok = None
     if op.token.type == TokenType.PLUS:
-        new_tok = create_mul_op(create_num(2), create_sym("x"), op.parent)
+        new_tok = create_mul_op(create_num(2), create_sym(bindings["X"].value), op.parent)
     else:
         new_tok = create_num(0, op.parent)
 
-    # change refrences to the new token
-    if isinstance(op.parent, UnaryOp):
-        op.parent.expr = new_tok
-    elif isinstance(op.parent, BinOp):
-        if op.isLeft():
-            op.parent.left = new_tok
-        else:
-            op.parent.right = new_tok
-    else:
-        raise CollectionException(
-            f"Tree in bad state, cannot reassign child references from type {type(op.parent)}")
+    replace(op, new_tok)
     return True
 
 
@@ -145,38 +199,20 @@ def collect_add_sub_same_symbols_pow_mul_nums(op: BinOp) -> bool:
     """Searches for the following pattern in code and applies rule:
         n*X^a +/- m*X^a --> (m+n)*X^a"""
 
-    pattern = create_compound_binop({TokenType.PLUS, TokenType.MINUS},
-                                    left=create_mul_op(
-        left=create_num(),
-        right=create_pow_op(
-            left=create_sym(),
-            right=create_num(),
-        )
-    ),
-        right=create_mul_op(
-            left=create_num(),
-            right=create_pow_op(
-                left=create_sym(),
-                right=create_num(),
-            )))
-
-    if not match(op, pattern):
+    bindings = add_sub_pow_mul_nums_pattern.bind(op)
+    if bindings == None:
         return False
 
     # See if powers are the same
-    if op.left.right.right.value != op.right.right.right.value:
+    if bindings["a"].value != bindings["b"].value:
         return False
 
-    # See if symbols are the same
-    if op.left.right.left.value != op.right.right.left.value:
-        return False
+    n = bindings["n"].value
+    m = bindings["m"].value
+    sym = bindings["X"].value
+    power = bindings["a"].value
 
-    n = op.left.left.value
-    m = op.right.left.value
-    sym = op.left.right.left.value
-    power = op.left.right.right.value
-
-    multiplier = n+m if op.token.type == TokenType.PLUS else n-m
+    multiplier = get_backend().fold(op.token.value, n, m)
 
     # create replacement
     if multiplier != 0:
@@ -204,70 +240,35 @@ def collect_add_sub_same_symbols_mul_nums(op: BinOp) -> bool:
         returns True if operation was executed
     """
 
-    # search rule:
-    try:
-        r = op.right
-        l = op.left
-        rr = op.right.right
-        rl = op.right.left
-        lr = op.left.right
-        ll = op.left.left
-
-        # Node type and existance check
-        if not (op.token.type in {TokenType.PLUS, TokenType.MINUS}
-                and l.token.type in {TokenType.MUL, TokenType.DIV}
-                and r.token.type in {TokenType.MUL, TokenType.DIV}
-                and lr.token.type in {TokenType.SYM, TokenType.NUM}
-                and ll.token.type in {TokenType.SYM, TokenType.NUM}
-                and rr.token.type in {TokenType.SYM, TokenType.NUM}
-                and rl.token.type in {TokenType.SYM, TokenType.NUM}
-                and rl.token.type != rr.token.type
-                and ll.token.type != lr.token.type):
-            return False
-
-        # Symbol equality check
-        symbol_right = rr if rr.token.type == TokenType.SYM else rl
-        symbol_left = ll if ll.token.type == TokenType.SYM else lr
-
-        if not symbol_left.value == symbol_right.value:
-            return False
-
-    except AttributeError:
-        # catch nodes that do not exists and therefore do not conform
-        # to search spec
+    bindings = add_sub_same_symbols_mul_nums_pattern.bind(op)
+    if bindings == None:
         return False
+    l = bindings["l"]
+    r = bindings["r"]
 
-    # Dictionary for concreate functions
-    op_dict = {
-        TokenType.PLUS: lambda x, y: x + y,
-        TokenType.MINUS: lambda x, y: x - y,
-    }
+    # determine where are the symbols and numbers
+    if l.left.token.type == TokenType.SYM:
+        symbol_left, left_num = l.left, l.right
+    else:
+        symbol_left, left_num = l.right, l.left
+    if r.left.token.type == TokenType.SYM:
+        symbol_right, right_num = r.left, r.right
+    else:
+        symbol_right, right_num = r.right, r.left
 
-    # determine where are the numbers
-    left_num = lr if symbol_left == ll else ll
-    right_num = rl if symbol_right == rr else rr
-    left_num = left_num.value
-    right_num = right_num.value
+    # Symbol equality check
+    if not symbol_left.value == symbol_right.value:
+        return False
 
     # apply rule
-    num = create_num(op_dict[op.token.type](left_num, right_num))
+    num = create_num(get_backend().fold(op.token.value, left_num.value, right_num.value))
     sym = create_sym(symbol_left.value)
     new_op = create_mul_op(
         left=num,
         right=sym,
         parent=op.parent)
 
-    # change references
-    if isinstance(op.parent, UnaryOp):
-        op.parent.expr = new_op
-    elif isinstance(op.parent, BinOp):
-        if op.isLeft():
-            op.parent.left = new_op
-        else:
-            op.parent.right = new_op
-    else:
-        raise CollectionException(
-            f"Tree in bad state, cannot reassign child references from type {type(op.parent)}")
+    replace(op, new_op)
     return True
 
 
@@ -280,22 +281,11 @@ def collect_mul_div_same_symbols(op: BinOp) -> bool:
         returns True if operation was executed
     """
 
-    # Search for the following patterns:
-    #     */
-    #    /  \
-    #  SYM  SYM
-
-    pattern = create_compound_binop({TokenType.MUL, TokenType.DIV},
-                                    left=create_sym("ANY"),
-                                    right=create_sym("ANY"))
-
-    if not match(op, pattern):
+    bindings = mul_div_same_symbols_pattern.bind(op)
+    if bindings == None:
         return False
 
-    if not op.left.value == op.right.value:
-        return False
-
-    symbol = op.left.value
+    symbol = bindings["X"].value
 
     if op.token.type == TokenType.DIV:
         new_op = create_num(1, op.parent)
@@ -307,17 +297,7 @@ def collect_mul_div_same_symbols(op: BinOp) -> bool:
             right=create_num(2)
         )
 
-    # Replace original op with POW op
-    if isinstance(op.parent, UnaryOp):
-        op.parent.expr = new_op
-    elif isinstance(op.parent, BinOp):
-        if op.isLeft():
-            op.parent.left = new_op
-        else:
-            op.parent.right = new_op
-    else:
-        raise CollectionException(
-            f"Tree in bad state, cannot reassign child references from type {type(op.parent)}")
+    replace(op, new_op)
     return True
 
 
@@ -329,70 +309,65 @@ def collect_mul_same_symbols_with_pows(op: BinOp) -> bool:
         returns True if operation was executed
     """
 
-    # Search for the following patterns:
-    #
-    #          */
-    #       /     \
-    #      ^       ^
-    #     / \     / \
-    #   SYM NUM SYM NUM
-
-    pattern = create_compound_binop({TokenType.MUL, TokenType.DIV},
-                                    left=create_pow_op(
-        left=create_sym(),
-        right=create_num()
-    ),
-        right=create_pow_op(
-        left=create_sym(),
-        right=create_num()
-    ))
-
-    if not match(op, pattern):
-        return False
-
-    # Symbol equality check
-    if not op.left.left.value == op.right.left.value:
+    bindings = mul_same_symbols_with_pows_pattern.bind(op)
+    if bindings == None:
         return False
 
-    symbol = op.left.left.value
+    symbol = bindings["X"].value
+    n = bindings["n"].value
+    m = bindings["m"].value
 
     if op.token.type == TokenType.MUL:
         # what about unary minus here????
         new_op = create_pow_op(
             parent=op.parent,
             left=create_sym(symbol),
-            right=create_num(op.left.right.value + op.right.right.value)
+            right=create_num(get_backend().add(n, m))
         )
     else:
         # what about unary minus here????
         new_op = create_pow_op(
             parent=op.parent,
             left=create_sym(symbol),
-            right=create_num(op.left.right.value - op.right.right.value)
+            right=create_num(get_backend().sub(n, m))
         )
 
-    # Replace original op with POW op
-    if isinstance(op.parent, UnaryOp):
-        op.parent.expr = new_op
-    elif isinstance(op.parent, BinOp):
-        if op.isLeft():
-            op.parent.left = new_op
-        else:
-            op.parent.right = new_op
-    else:
-        raise CollectionException(
-            f"Tree in bad state, cannot reassign child references from type {type(op.parent)}")
+    replace(op, new_op)
     return True
 
 
-def collect(root: AST):
-    """Applies collection rewrite rules to reduce count of variables and numbers"""
-    collection_functions = [collect_numbers, collect_mul_same_symbols_with_pows, collect_add_sub_same_symbols_mul_nums,
-                            collect_add_sub_same_symbols, collect_mul_div_same_symbols, collect_add_sub_same_symbols_pow_mul_nums, collect_functions]
-    rerun = True
-    while rerun:
-        rerun = False
-        for f in collection_functions:
-            tree_inord = inorder(root)
-            for node in tree_inord:
-                rerun |= f(node)
+collection_functions = [collect_numbers, collect_mul_same_symbols_with_pows, collect_add_sub_same_symbols_mul_nums,
+                        collect_add_sub_same_symbols, collect_mul_div_same_symbols, collect_add_sub_same_symbols_pow_mul_nums, collect_functions]
+
+# Index of the rules by their patterns, so that a node is matched against
+# all collection rules in a single walk
+collection_index = DiscriminationNet()
+for pattern in dict.fromkeys(numbers_patterns.values()):
+    collection_index.insert(pattern.pattern, collect_numbers)
+collection_index.insert(mul_same_symbols_with_pows_pattern.pattern,
+                        collect_mul_same_symbols_with_pows)
+collection_index.insert(mul_div_same_symbols_pattern.pattern,
+                        collect_mul_div_same_symbols)
+collection_index.insert(add_sub_pow_mul_nums_pattern.pattern,
+                        collect_add_sub_same_symbols_pow_mul_nums)
+collection_index.insert(func_num_pattern.pattern, collect_functions)
+collection_index.insert(add_sub_same_symbols_pattern.pattern,
+                        collect_add_sub_same_symbols)
+collection_index.insert(add_sub_same_symbols_mul_nums_pattern.pattern,
+                        collect_add_sub_same_symbols_mul_nums)
+
+
+def collect(root: AST, like_terms: bool = False):
+    """Applies collection rewrite rules to reduce count of variables and numbers.
+    With like_terms, the children of the root are first replaced with their
+    n-ary normal form, which groups like terms in a single pass"""
+    if like_terms:
+        if isinstance(root, BinOp):
+            children = [root.left, root.right]
+        elif isinstance(root, UnaryOp):
+            children = [root.expr]
+        else:
+            children = []  # a lone number or symbol is already normal
+        for child in children:
+            replace(child, normalize(child))
+    rewrite(root, collection_functions, index=collection_index, cache=stage_cache, name="collect")
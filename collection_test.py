@@ -13,3 +13,31 @@ def test_collect_div_pow():
     r = parse("x^2/x^3=1")
     collect(r)
     assert trace(r) == "(x^-1)=1"
+
+
+def test_collect_add_same_symbols():
+    r = parse("y+y=1")
+    collect(r)
+    assert trace(r) == "(2*y)=1"
+
+
+def test_collect_functions_outside_domain():
+    r = parse("x = sin(1) + asin(2)")
+    collect(r)
+    assert trace(r) == "x=(0.8414709848078965+asin(2))"
+
+
+def test_collect_like_terms():
+    r = parse("y+x+y-2=x*y/y+1")
+    collect(r, like_terms=True)
+    assert trace(r) == "((x+(2*y))-2)=(x+1)"
+    r = parse("x")
+    collect(r, like_terms=True)
+    assert r.value == "x"
+
+
+def test_collect_numbers_in_chains():
+    for string, expected in [("x=2*y*-3", "x=(-6*y)"), ("x=2+y+-3", "x=(-1+y)"), ("x=-2-3", "x=-5")]:
+        r = parse(string)
+        collect(r)
+        assert trace(r) == expected
@@ -0,0 +1,318 @@
+import keyword
+import math
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple
+from collection import function_table
+from cse import CSEReport, eliminate
+from equation_parser import AST, BinOp, Num
+from hashcons import Expr
+from lexer import TokenType
+from numeric import Backend, Number, backends, get_backend
+from parse_cache import normalize
+
+# Solved equations are turned into Python functions, so evaluating a solution
+# for new values of the other symbols does not repeat the symbolic work:
+#
+#   ek=(m*v^2)/2 solved for v  --->  def solution(bindings):
+#                                        ek = bindings['ek']
+#                                        m = bindings['m']
+#                                        return (((ek * 2) / m) ** 0.5)
+#
+# Subexpressions used more than once are computed into temporaries, see cse.py.
+#
+# The float backend matches Python operators, under the other backends the
+# operations of the backend are called, so 1/3 stays exact.
+
+binop_operators = {
+    TokenType.PLUS: "+",
+    TokenType.MINUS: "-",
+    TokenType.MUL: "*",
+    TokenType.DIV: "/",
+    TokenType.POW: "**",
+}
+
+# Deeper subexpressions are assigned to temporaries, Python refuses to
+# compile expressions nested too deeply
+MAX_NESTING = 32
+
+
+class CompilerException(Exception):
+    pass
+
+
+class CompiledSolution:
+    """Evaluates right-hand side of a solved equation
+
+    Called with a dict mapping the remaining symbols to their values,
+    returns value of the solved symbol"""
+
+    def __init__(self, symbol: str, parameters: List[str], source: str,
+                 function: Callable[[Dict[str, Number]], Number], report: CSEReport):
+        self.symbol = symbol
+        self.parameters = parameters  # symbols the solution depends on
+        self.source = source  # generated code, for inspection
+        self.function = function
+        self.report = report  # operations saved by common subexpression elimination
+
+    def __call__(self, bindings: Dict[str, Number]) -> Number:
+        try:
+            return self.function(bindings)
+        except KeyError as e:
+            raise CompilerException(
+                f"No value provided for symbol {e.args[0]}") from None
+
+    def __repr__(self) -> str:
+        return f"CompiledSolution({self.symbol} = f({', '.join(self.parameters)}))"
+
+
+class _Generator:
+    """Generates the body of a solution function from an expression tree"""
+
+    def __init__(self, functions: Dict[str, Callable], backend: Backend):
+        self.functions = functions
+        self.backend = backend
+        self.namespace: Dict[str, object] = {}
+        self.locals: Dict[str, str] = {}  # symbol -> local variable name
+        self.lines: List[str] = []
+        self.temporaries = 0
+
+    def local(self, symbol: str) -> str:
+        name = self.locals.get(symbol, None)
+        if name == None:
+            # symbols which are not valid or free Python names are renamed
+            if (symbol.isidentifier() and not keyword.iskeyword(symbol)
+                    and not symbol.startswith("_") and symbol not in self.functions
+                    and symbol != "bindings"):
+                name = symbol
+            else:
+                name = f"_s{len(self.locals)}"
+            self.locals[symbol] = name
+        return name
+
+    def constant(self, value: Number) -> str:
+        if (type(value) is int or type(value) is float) and math.isfinite(value):
+            # -3 ** y would be -(3 ** y)
+            text = repr(value)
+            return f"({text})" if text.startswith("-") else text
+        # Fractions and infinities have no literal, they are looked up
+        name = f"_c{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def temporary(self, text: str) -> str:
+        name = f"_t{self.temporaries}"
+        self.temporaries += 1
+        self.lines.append(f"    {name} = {text}")
+        return name
+
+    def leaf(self, node: Expr) -> str:
+        if node.token.type == TokenType.SYM:
+            return self.local(node.value)
+        return self.constant(node.value)
+
+    def expression(self, root: Expr, uses: Dict[Expr, int] | None = None) -> str:
+        """Returns expression text of the DAG, computed in a single postorder
+        pass. Subexpressions nested deeper than MAX_NESTING and, if uses are
+        given, the ones used more than once are assigned to temporaries"""
+        results: Dict[Expr, Tuple[str, int]] = {}  # node -> (text, nesting)
+        stack = [(root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if node in results:
+                continue
+            if node.kind is Num:
+                results[node] = (self.leaf(node), 0)
+                continue
+            if not visited:
+                stack.append((node, True))
+                for child in reversed(node.children):
+                    stack.append((child, False))
+                continue
+            texts = [results[child] for child in node.children]
+            nesting = max(n for _, n in texts) + 1
+            text = self.operation(node, [t for t, _ in texts])
+            if nesting > MAX_NESTING or (uses != None and uses[node] > 1):
+                text, nesting = self.temporary(text), 0
+            results[node] = (text, nesting)
+        return results[root][0]
+
+    def operation(self, node: Expr, operands: List[str]) -> str:
+        token = node.token
+        if node.kind is BinOp:
+            operator = binop_operators.get(token.type, None)
+            if operator == None:
+                raise CompilerException(f"Cannot compile operator {token.value}")
+            if type(self.backend) is Backend:
+                return f"({operands[0]} {operator} {operands[1]})"
+            name = f"_{token.type.name.lower()}"
+            self.namespace[name] = self.backend.operations[token.value]
+            return f"{name}({operands[0]}, {operands[1]})"
+        if token.type == TokenType.MINUS:
+            return f"(-{operands[0]})"
+        if token.type == TokenType.PLUS:
+            return operands[0]
+        if token.type == TokenType.FUNC and token.value in self.functions:
+            self.namespace[token.value] = self.functions[token.value]
+            return f"{token.value}({operands[0]})"
+        raise CompilerException(f"Cannot compile function {token.value}")
+
+
+def compile_expression(root: AST, symbol: str = "", functions: Dict[str, Callable] = function_table,
+                       backend: Backend | None = None, cse: bool = True) -> CompiledSolution:
+    """Compiles expression tree into a CompiledSolution computing its value
+    with the given numeric backend, the current one by default.
+    With cse, repeated subexpressions are computed once"""
+    if backend == None:
+        backend = get_backend()
+    dag, uses, report = eliminate(root)
+    if not cse:
+        uses = None
+        report = CSEReport(report.operations, report.operations, 0)
+    generator = _Generator(functions, backend)
+    result = generator.expression(dag, uses)
+    loads = [f"    {name} = bindings[{symbol_name!r}]"
+             for symbol_name, name in generator.locals.items()]
+    source = "\n".join(["def solution(bindings):", *loads, *generator.lines,
+                        f"    return {result}"]) + "\n"
+    namespace = dict(generator.namespace)
+    exec(compile(source, f"<solution {symbol}>", "exec"), namespace)
+    return CompiledSolution(symbol, list(generator.locals), source, namespace["solution"], report)
+
+
+def _solved_expression(root: AST, symbol: str) -> AST:
+    if (root.token.type != TokenType.EQ or not isinstance(root.left, Num)
+            or root.left.value != symbol):
+        raise CompilerException(f"Equation is not solved for {symbol}")
+    return root.right
+
+
+def compile_solution(root: AST, symbol: str) -> CompiledSolution:
+    """Compiles solved equation tree (symbol = expression)"""
+    return compile_expression(_solved_expression(root, symbol), symbol)
+
+
+# NumPy names of the functions which differ from collection.function_table
+numpy_names = {
+    "asin": "arcsin",
+    "acos": "arccos",
+    "atan": "arctan",
+}
+
+# Rows evaluated at once, every operation of the solution allocates
+# a temporary array of this size
+DEFAULT_CHUNKSIZE = 1 << 16
+
+
+def _numpy():
+    # NumPy is optional, only vectorized solutions need it
+    try:
+        import numpy
+    except ImportError:
+        raise CompilerException("Vectorized solutions require numpy") from None
+    return numpy
+
+
+class VectorizedSolution:
+    """Evaluates right-hand side of a solved equation over NumPy arrays
+
+    Called with a dict mapping the remaining symbols to arrays (or scalars)
+    of their values, returns float64 array of the solved symbol values.
+    Arrays are broadcast against each other and evaluated in chunks of
+    rows, so temporaries of the operations stay small"""
+
+    def __init__(self, solution: CompiledSolution):
+        self.solution = solution
+        self.symbol = solution.symbol
+        self.parameters = solution.parameters
+        self.source = solution.source
+        self.report = solution.report
+
+    def __call__(self, bindings: Dict[str, object], chunksize: int = DEFAULT_CHUNKSIZE):
+        np = _numpy()
+        if chunksize < 1:
+            raise CompilerException("Chunk size has to be positive")
+        try:
+            # converted to floats chunk by chunk, a float copy of a whole
+            # input would cost as much memory as the chunking saves
+            arrays = {name: np.asarray(bindings[name]) for name in self.parameters}
+        except KeyError as e:
+            raise CompilerException(
+                f"No value provided for symbol {e.args[0]}") from None
+        shape = np.broadcast_shapes(*(a.shape for a in arrays.values()))
+        function = self.solution.function
+        if len(shape) == 0 or shape[0] <= chunksize:
+            floats = {name: a.astype(np.float64, copy=False) for name, a in arrays.items()}
+            return np.broadcast_to(function(floats), shape).astype(np.float64)
+        arrays = {name: np.broadcast_to(a, shape) for name, a in arrays.items()}
+        result = np.empty(shape, dtype=np.float64)
+        for start in range(0, shape[0], chunksize):
+            stop = start + chunksize
+            result[start:stop] = function(
+                {name: a[start:stop].astype(np.float64, copy=False)
+                 for name, a in arrays.items()})
+        return result
+
+    def __repr__(self) -> str:
+        return f"VectorizedSolution({self.symbol} = f({', '.join(self.parameters)}))"
+
+
+def vectorize_expression(root: AST, symbol: str = "", cse: bool = True) -> VectorizedSolution:
+    """Compiles expression tree into a VectorizedSolution, operators become
+    NumPy ufuncs through the array operators, functions their NumPy versions"""
+    np = _numpy()
+    functions = {name: getattr(np, numpy_names.get(name, name)) for name in function_table}
+    # arrays are floats, so the operators follow the float backend
+    return VectorizedSolution(compile_expression(root, symbol, functions, backends["float"], cse))
+
+
+def vectorize_solution(root: AST, symbol: str) -> VectorizedSolution:
+    """Compiles solved equation tree (symbol = expression) for NumPy arrays"""
+    return vectorize_expression(_solved_expression(root, symbol), symbol)
+
+
+Solution = CompiledSolution | VectorizedSolution
+
+
+class SolutionCache:
+    """LRU cache of compiled solutions keyed by normalized equation text and
+    the solved symbol, separately for every numeric backend and for NumPy"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._solutions: OrderedDict[Tuple[str, str, str], Solution] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._solutions)
+
+    def key(self, string: str, symbol: str, evaluator: str | None) -> Tuple[str, str, str]:
+        if evaluator == None:
+            evaluator = get_backend().name
+        return (evaluator, normalize(string), symbol)
+
+    def get(self, string: str, symbol: str, evaluator: str | None = None) -> Solution | None:
+        """Evaluator is "numpy" for vectorized solutions, None stands for
+        the current numeric backend"""
+        key = self.key(string, symbol, evaluator)
+        solution = self._solutions.get(key, None)
+        if solution == None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._solutions.move_to_end(key)
+        return solution
+
+    def store(self, string: str, symbol: str, solution: Solution, evaluator: str | None = None):
+        self._solutions[self.key(string, symbol, evaluator)] = solution
+        while len(self._solutions) > self.maxsize:
+            self._solutions.popitem(last=False)
+
+    def clear(self):
+        self._solutions.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Process wide cache used by Solver.compile() and Solver.vectorize()
+solution_cache = SolutionCache()
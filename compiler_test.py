@@ -0,0 +1,109 @@
+from fractions import Fraction
+import math
+import pytest
+from compiler import CompilerException, MAX_NESTING, compile_expression, compile_solution, solution_cache
+from equation_parser import parse
+from isolation import Solver
+from numeric import use_backend
+
+
+def test_compile_solution():
+    c = Solver("ek = (m*v^2)/2").compile("v")
+    assert c.symbol == "v"
+    assert c.parameters == ["ek", "m"]
+    assert c({"ek": 8, "m": 4}) == 2.0
+    assert c({"ek": 50, "m": 1}) == 10.0
+
+
+def test_compile_functions_and_constants():
+    c = Solver("sin(x) = z*PI").compile("x")
+    assert c({"z": 0.1}) == math.asin(0.1 * math.pi)
+
+
+def test_compile_cached():
+    solution_cache.clear()
+    c = Solver("a*x+b=c").compile("x")
+    assert Solver("a*x + b = c").compile("x") is c
+    assert solution_cache.hits == 1
+    assert Solver("a*x+b=c").compile("a") is not c
+    with use_backend("exact"):
+        assert Solver("a*x+b=c").compile("x") is not c
+
+
+def test_compile_missing_binding():
+    c = Solver("a*x+b=c").compile("x")
+    with pytest.raises(CompilerException):
+        c({"a": 1, "b": 2})
+
+
+def test_compile_unsolved():
+    with pytest.raises(CompilerException):
+        compile_solution(parse("x+1=y"), "x")
+
+
+def test_compile_expression_renames_symbols():
+    c = compile_expression(parse("lambda*bindings+sin"))
+    assert c({"lambda": 2, "bindings": 3, "sin": 1}) == 7
+
+
+def test_compile_exact_backend():
+    with use_backend("exact"):
+        c = Solver("3*x/2=y").compile("x")
+        assert c({"y": 1}) == Fraction(2, 3)
+        assert type(c({"y": 3})) is int
+    with use_backend("fraction"):
+        c = compile_expression(parse("x/3+1"))
+        assert "_c" in c.source
+    assert c({"x": 1}) == Fraction(4, 3)
+
+
+def test_compile_expression_deep():
+    names = [a + b for a in "abcdefghij" for b in "abcdefghij"]
+    c = compile_expression(parse("+".join(names)))
+    assert "_t" in c.source
+    assert c({name: 1 for name in names}) == len(names) > MAX_NESTING
+
+
+def test_vectorize_solution():
+    np = pytest.importorskip("numpy")
+    v = Solver("sin(x) = z/y").vectorize("x")
+    z = np.linspace(0, 1, 1000)
+    expected = np.arcsin(z / 2)
+    assert np.allclose(v({"z": z, "y": 2}), expected)
+    assert np.allclose(v({"z": z, "y": np.full(1000, 2)}, chunksize=64), expected)
+    assert v({"z": 1, "y": 2}) == pytest.approx(math.asin(0.5))
+    assert Solver("sin(x) = z/y").vectorize("x") is v
+
+
+def test_vectorize_constant_and_missing():
+    np = pytest.importorskip("numpy")
+    assert Solver("x = 2^3").vectorize("x")({}) == 8.0
+    v = Solver("x = y^-1").vectorize("x")
+    assert np.array_equal(v({"y": np.array([1, 2, 4])}), [1.0, 0.5, 0.25])
+    # integer chunks are converted to floats, numpy rejects negative integer powers
+    assert np.array_equal(v({"y": np.array([1, 2, 4])}, chunksize=2), [1.0, 0.5, 0.25])
+    with pytest.raises(CompilerException):
+        v({"z": 1})
+
+
+def test_compile_shares_subexpressions():
+    values = {"x": 1, "y": 2, "a": 1, "b": 2}
+    c = compile_expression(parse("sin(y)*x+sin(y)^2-(a+b)/(a+b)"))
+    assert c.source.count("sin(") == 1
+    assert c.report.saved == 2
+    plain = compile_expression(parse("sin(y)*x+sin(y)^2-(a+b)/(a+b)"), cse=False)
+    assert plain.source.count("sin(") == 2
+    assert plain.report.saved == 0
+    assert c(values) == plain(values)
+
+
+def test_compile_negative_constant_power():
+    c = Solver("x = (1-4)^y").compile("x")
+    assert c({"y": 2}) == 9
+    assert c({"y": 3}) == -27
+
+
+def test_vectorize_negative_constant_power():
+    np = pytest.importorskip("numpy")
+    v = Solver("x = (1-4)^y").vectorize("x")
+    assert np.array_equal(v({"y": np.array([2, 3])}), [9.0, -27.0])
@@ -0,0 +1,74 @@
+from typing import Dict, Tuple
+from equation_parser import AST, Num
+from hashcons import Expr, from_ast
+
+# Common subexpression elimination. The expression tree is hash-consed into
+# a DAG, where structurally equal subtrees are the same node, e.g.
+# sin(y)*x + sin(y) has a single sin(y) node used twice. Evaluators compute
+# every node used more than once into a temporary.
+
+
+class CSEReport:
+    """Operation counts of an expression before and after the elimination"""
+
+    def __init__(self, operations: int, shared_operations: int, temporaries: int):
+        self.operations = operations  # operations of the tree
+        self.shared_operations = shared_operations  # distinct operations of the DAG
+        self.temporaries = temporaries  # operations used more than once
+
+    @property
+    def saved(self) -> int:
+        return self.operations - self.shared_operations
+
+    def as_dict(self) -> dict:
+        return {"operations": self.operations, "shared_operations": self.shared_operations,
+                "temporaries": self.temporaries, "saved": self.saved}
+
+    def __repr__(self) -> str:
+        return (f"CSEReport({self.operations} operations, {self.saved} saved, "
+                f"{self.temporaries} temporaries)")
+
+
+def count_uses(root: Expr) -> Dict[Expr, int]:
+    """Returns number of references to every node of the DAG, x*x uses x twice"""
+    uses = {root: 1}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        for child in node.children:
+            if child in uses:
+                uses[child] += 1
+            else:
+                uses[child] = 1
+                stack.append(child)
+    return uses
+
+
+def _tree_operations(root: Expr) -> int:
+    """Counts operations of the tree the DAG was made of, in a single
+    postorder pass over the distinct nodes"""
+    operations: Dict[Expr, int] = {}
+    stack = [(root, False)]
+    while stack:
+        node, visited = stack.pop()
+        if node in operations:
+            continue
+        if node.kind is Num:
+            operations[node] = 0
+        elif visited:
+            operations[node] = 1 + sum(operations[child] for child in node.children)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children)
+    return operations[root]
+
+
+def eliminate(root: AST) -> Tuple[Expr, Dict[Expr, int], CSEReport]:
+    """Converts expression tree into a DAG of shared subexpressions, returns
+    the DAG root, the uses of its nodes and the report of saved operations"""
+    dag = from_ast(root)
+    uses = count_uses(dag)
+    operations = [node for node in uses if node.kind is not Num]
+    temporaries = sum(1 for node in operations if uses[node] > 1)
+    report = CSEReport(_tree_operations(dag), len(operations), temporaries)
+    return dag, uses, report
@@ -0,0 +1,33 @@
+from cse import count_uses, eliminate
+from equation_parser import parse
+from hashcons import from_ast
+
+
+def test_count_uses():
+    dag = from_ast(parse("x*x+sin(x)"))
+    uses = count_uses(dag)
+    assert uses[dag] == 1
+    assert uses[dag.left] == 1
+    assert uses[dag.left.left] == 3
+
+
+def test_eliminate_report():
+    dag, uses, report = eliminate(parse("sin(y)*x+sin(y)^2-(a+b)/(a+b)"))
+    assert report.as_dict() == {"operations": 9, "shared_operations": 7,
+                                "temporaries": 2, "saved": 2}
+    assert uses[dag.left.left.left] == 2
+
+
+def test_eliminate_nested_repeats():
+    # the inner sum is shared inside the shared product, counted only once
+    _, _, report = eliminate(parse("((a+b)*(a+b))/((a+b)*(a+b))"))
+    assert report.operations == 7
+    assert report.shared_operations == 3
+    assert report.saved == 4
+    assert report.temporaries == 2
+
+
+def test_eliminate_no_repeats():
+    _, _, report = eliminate(parse("a+b*c"))
+    assert report.saved == 0
+    assert report.temporaries == 0
@@ -1,8 +1,12 @@
-from lexer import Lexer, TokenType, Token
+from typing import Iterable, List, NamedTuple
+from lexer import TokenType, Token, iter_tokens
 # nodes with no children are called leafs
 
 
 class AST:
+    # Cached structural hash of the subtree, see utils.structural_hash
+    _hash = None
+
     def __init__(self, parent):
         self.parent = parent
 
@@ -47,14 +51,19 @@ class ParserException(Exception):
 
 class Parser:
     def __init__(self, string):
-        self.tokens = Lexer().lex(string)
-        self.current_token = self.tokens[0]
+        self.reset(string)
+
+    def reset(self, string):
+        """Prepares the parser for a new string, so that one instance can parse many"""
+        # Tokens are pulled lazily, the parser only ever needs the current one
+        self.tokens = iter_tokens(string)
+        self.current_token = next(self.tokens)
         self.pos = 0
 
     def eat(self, type):
         if self.current_token.type == type:
             self.pos += 1
-            self.current_token = self.tokens[self.pos]
+            self.current_token = next(self.tokens)
         else:
             raise ParserException("Invalid syntax")
 
@@ -146,8 +155,164 @@ class Parser:
         return self.equation()
 
 
-def parse(string: str):
+class PrattParser(Parser):
+    """Operator precedence parser, builds the same trees as Parser
+
+    Instead of recursing once per nesting level, pending operators,
+    parenthesis and function calls are kept on an explicit stack, so the
+    nesting depth is limited only by memory and not by the recursion limit"""
+
+    # Binding power of binary operators, all of them are left associative
+    binding_powers = {
+        TokenType.EQ: 1,
+        TokenType.PLUS: 2,
+        TokenType.MINUS: 2,
+        TokenType.MUL: 3,
+        TokenType.DIV: 3,
+        TokenType.POW: 4,
+    }
+
+    # Kinds of operator stack entries
+    INFIX = 0
+    PREFIX = 1
+    PAREN = 2
+    FUNC = 3
+
+    def parse(self):
+        INFIX, PREFIX, PAREN, FUNC = self.INFIX, self.PREFIX, self.PAREN, self.FUNC
+        binding_powers = self.binding_powers
+        tokens = self.tokens
+        operands = []
+        operators = []  # (kind, token) pairs
+        depth = 0  # count of open parenthesis and function calls
+
+        token = self.current_token
+        while True:
+            # Expecting an operand (factor)
+            type = token.type
+            if type == TokenType.PLUS or type == TokenType.MINUS:
+                operators.append((PREFIX, token))
+                token = next(tokens)
+                continue
+            elif type == TokenType.LPAREN:
+                operators.append((PAREN, token))
+                depth += 1
+                token = next(tokens)
+                continue
+            elif type == TokenType.SYM:
+                token_sym = token
+                token = next(tokens)
+                if token.type == TokenType.LPAREN:
+                    operators.append(
+                        (FUNC, Token(token_sym.value, TokenType.FUNC)))
+                    depth += 1
+                    token = next(tokens)
+                    continue
+                operands.append(Num(token_sym))
+            elif type == TokenType.NUM:
+                operands.append(Num(token))
+                token = next(tokens)
+            else:
+                raise ParserException("Invalid syntax")
+
+            # Factor is complete, apply prefix operators to it and close
+            # groups that end right after it
+            while True:
+                while operators and operators[-1][0] == PREFIX:
+                    operands.append(UnaryOp(operands.pop(), operators.pop()[1]))
+                if token.type != TokenType.RPAREN or depth == 0:
+                    break
+                while operators[-1][0] == INFIX:
+                    self._reduce(operands, operators.pop()[1])
+                kind, group_token = operators.pop()
+                depth -= 1
+                if kind == FUNC:
+                    operands.append(UnaryOp(operands.pop(), group_token))
+                token = next(tokens)
+
+            # Expecting a binary operator
+            power = binding_powers.get(token.type, None)
+            if power == None:
+                break
+            if token.type == TokenType.EQ and depth > 0:
+                raise ParserException("Invalid syntax")
+            while (operators and operators[-1][0] == INFIX
+                   and binding_powers[operators[-1][1].type] >= power):
+                self._reduce(operands, operators.pop()[1])
+            operators.append((INFIX, token))
+            token = next(tokens)
+
+        self.current_token = token
+        if depth > 0:
+            raise ParserException("Invalid syntax")
+        while operators:
+            self._reduce(operands, operators.pop()[1])
+        return operands[0]
+
+    def _reduce(self, operands: List[AST], token: Token):
+        right = operands.pop()
+        left = operands.pop()
+        operands.append(BinOp(left=left, op=token, right=right))
+
+
+def parse(string: str, iterative: bool = False):
+    """Parses string into AST, iterative selects the non-recursive PrattParser"""
+    if iterative:
+        return PrattParser(string).parse()
     return Parser(string).parse()
 
 
-parse("x=sin(1+2)")
+class ParseResult(NamedTuple):
+    """Outcome of parsing a single equation in a batch, exactly one of root
+    and error is set"""
+    string: str
+    root: AST | None
+    error: Exception | None
+
+
+def _parse_batch(strings: List[str]) -> List[ParseResult]:
+    """Parses strings one by one, reusing a single parser and capturing errors"""
+    result = []
+    parser = None
+    for string in strings:
+        try:
+            if parser == None:
+                parser = Parser(string)
+            else:
+                parser.reset(string)
+            result.append(ParseResult(string, parser.parse(), None))
+        except Exception as e:
+            result.append(ParseResult(string, None, e))
+    return result
+
+
+def _parse_batch_flat(strings: List[str]) -> List[ParseResult]:
+    """Worker side of parse_many, trees are sent back as arenas, pickling
+    linked nodes recurses once per tree level and fails on long equations"""
+    from arena import Arena
+    return [r if r.root == None else r._replace(root=Arena.from_ast(r.root))
+            for r in _parse_batch(strings)]
+
+
+def parse_many(strings: Iterable[str], workers: int | None = None, chunksize: int = 256) -> List[ParseResult]:
+    """Parses many equations in one call, results are returned in input order
+
+    An equation that fails to parse does not abort the batch, its error is
+    stored in the corresponding ParseResult instead. If workers is given,
+    the batch is split into chunks of chunksize equations, which are parsed
+    in a process pool with that many worker processes."""
+    strings = list(strings)
+    if workers == None or len(strings) <= chunksize:
+        return _parse_batch(strings)
+
+    # Imported here, multiprocessing is expensive to import and only
+    # needed for large batches
+    from concurrent.futures import ProcessPoolExecutor
+    chunks = [strings[i:i + chunksize]
+              for i in range(0, len(strings), chunksize)]
+    result = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_result in executor.map(_parse_batch_flat, chunks):
+            result.extend(r if r.root == None else r._replace(root=r.root.to_ast())
+                          for r in chunk_result)
+    return result
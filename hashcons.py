@@ -0,0 +1,131 @@
+from typing import Tuple
+from weakref import WeakValueDictionary
+from equation_parser import AST, BinOp, Num, UnaryOp
+from lexer import Token
+
+
+class HashConsException(Exception):
+    pass
+
+
+class Expr:
+    """Immutable expression node, structurally equal expressions are the
+    same object (hash-consing)
+
+    Never instantiate directly, use make(), num(), unary() or binary().
+    Since equal subtrees are shared, comparing and hashing expressions is an
+    O(1) identity operation and copying is free."""
+
+    __slots__ = ("kind", "token", "children", "__weakref__")
+
+    kind: type
+    token: Token
+    children: Tuple["Expr", ...]
+
+    def __setattr__(self, name, value):
+        raise HashConsException("Expr nodes are immutable")
+
+    def __repr__(self) -> str:
+        return f"Expr({self.kind.__name__}, {self.token.value!r}, {len(self.children)} children)"
+
+    @property
+    def value(self):
+        return self.token.value
+
+    @property
+    def left(self) -> "Expr":
+        return self.children[0]
+
+    @property
+    def right(self) -> "Expr":
+        return self.children[1]
+
+    @property
+    def expr(self) -> "Expr":
+        return self.children[0]
+
+
+# Table of all live expressions, entries vanish with their expressions
+_table: WeakValueDictionary = WeakValueDictionary()
+
+
+def make(kind: type, token: Token, children: Tuple[Expr, ...] = ()) -> Expr:
+    """Returns the unique expression with given kind, token and children"""
+    # type of value is part of the key: 1 and 1.0 are equal, but traced differently
+    key = (kind, token.type, type(token.value), token.value, children)
+    expr = _table.get(key, None)
+    if expr == None:
+        expr = object.__new__(Expr)
+        object.__setattr__(expr, "kind", kind)
+        object.__setattr__(expr, "token", token)
+        object.__setattr__(expr, "children", children)
+        _table[key] = expr
+    return expr
+
+
+def num(token: Token) -> Expr:
+    return make(Num, token)
+
+
+def unary(expr: Expr, token: Token) -> Expr:
+    return make(UnaryOp, token, (expr,))
+
+
+def binary(left: Expr, token: Token, right: Expr) -> Expr:
+    return make(BinOp, token, (left, right))
+
+
+def table_size() -> int:
+    """Returns the number of distinct live expressions"""
+    return len(_table)
+
+
+def from_ast(root: AST) -> Expr:
+    """Converts mutable AST into hash-consed expression"""
+    stack = [(root, False)]
+    converted = []
+    while stack:
+        node, children_converted = stack.pop()
+        if isinstance(node, BinOp):
+            if children_converted:
+                right = converted.pop()
+                left = converted.pop()
+                converted.append(binary(left, node.token, right))
+            else:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+        elif isinstance(node, UnaryOp):
+            if children_converted:
+                converted.append(unary(converted.pop(), node.token))
+            else:
+                stack.append((node, True))
+                stack.append((node.expr, False))
+        elif isinstance(node, Num):
+            converted.append(num(node.token))
+        else:
+            raise HashConsException(
+                f"Cannot convert tree, node type: {type(node)} not supported")
+    return converted[0]
+
+
+def to_ast(root: Expr) -> AST:
+    """Converts expression into a fresh mutable AST, shared subexpressions
+    become separate subtrees"""
+    stack = [(root, False)]
+    converted = []
+    while stack:
+        expr, children_converted = stack.pop()
+        if not expr.children:
+            converted.append(Num(expr.token))
+        elif not children_converted:
+            stack.append((expr, True))
+            for child in reversed(expr.children):
+                stack.append((child, False))
+        elif expr.kind is BinOp:
+            right = converted.pop()
+            left = converted.pop()
+            converted.append(BinOp(left, expr.token, right))
+        else:
+            converted.append(UnaryOp(converted.pop(), expr.token))
+    return converted[0]
@@ -0,0 +1,34 @@
+import pytest
+import hashcons
+from equation_parser import parse
+from utils import trace
+
+
+def test_structural_sharing():
+    e = hashcons.from_ast(parse("x^1 + x^1 = 1*x"))
+    assert e.left.left is e.left.right
+    assert e.left.left is not e.right
+    assert e is hashcons.from_ast(parse("x^1+x^1=1*x"))
+    assert e is not hashcons.from_ast(parse("x^1+x^1=1*y"))
+
+
+def test_value_types_are_kept_apart():
+    one = hashcons.num(parse("1").token)
+    one_float = hashcons.num(parse("1").token._replace(value=1.0))
+    assert one is not one_float
+
+
+def test_roundtrip():
+    for equation in ["a + b = a + c", "sin(x+2+y+x) = 1", "-x^2 = --y"]:
+        tree = parse(equation)
+        result = hashcons.to_ast(hashcons.from_ast(tree))
+        assert trace(result) == trace(tree)
+        assert result.left.parent is result
+
+
+def test_immutable():
+    e = hashcons.from_ast(parse("x = 1"))
+    with pytest.raises(hashcons.HashConsException):
+        e.token = None
+    d = {e: "solution"}
+    assert d[hashcons.from_ast(parse("x=1"))] == "solution"
@@ -1,13 +1,21 @@
-from typing import List
+import logging
+from typing import Callable, Dict, List, Set
 from attraction import attract
-from equation_parser import AST, BinOp, Num, Parser, UnaryOp
-from lexer import Lexer, TokenType, Token
+from equation_parser import AST, BinOp, Num, UnaryOp
+from lexer import MINUS_TOKEN, MUL_TOKEN, DIV_TOKEN, PLUS_TOKEN, TokenType, Token
 from postprocessing import postprocess
 from preprocessing import preprocess
-from utils import add_unary_minus, create_div_op, create_graphviz_graph, create_mul_op, create_num, create_plus_op, create_sym, trace, inorder
+from parse_cache import parse_cached
+from utils import add_unary_minus, create_div_op, create_graphviz_graph, create_mul_op, create_num, create_plus_op, create_sym, invalidate_hash, trace, track_changes, inorder
 from collection import collect
+from compiler import CompiledSolution, VectorizedSolution, compile_solution, solution_cache, vectorize_solution
 import math
 
+logger = logging.getLogger(__name__)
+
+# Called with the stage name and the equation tree after every solving stage
+Tracer = Callable[[str, AST], None]
+
 
 # TODO: improve doc strings because they are misleading
 # TODO: build in move operation and add checks against
@@ -42,22 +50,19 @@ def div_inv(n: BinOp, wasTargetLeft: bool):
         n.right, n.left = n.left, n.right
     else:
         # change the op to multiplication
-        n.op.type = TokenType.MUL
-        n.op.value = "*"
+        n.token = n.op = MUL_TOKEN
 
 
 def mul_inv(n: BinOp, wasTargetLeft: bool):
     """Target - A: A * B = C ---> A = C / B
     Target - B: A * B = C ---> B = C / A"""
-    n.op.type = TokenType.DIV
-    n.op.value = "/"
+    n.token = n.op = DIV_TOKEN
 
 
 def add_inv(n: BinOp, wasTargetLeft: bool):
     """Target - A: A + B = C ---> A = C - B
     Target - B: A + B = C ---> B =  C - A"""
-    n.op.type = TokenType.MINUS
-    n.op.value = "-"
+    n.token = n.op = MINUS_TOKEN
 
 
 def sub_inv(n: BinOp, wasTargetLeft: bool):
@@ -67,47 +72,158 @@ def sub_inv(n: BinOp, wasTargetLeft: bool):
     if not wasTargetLeft:
         # if target was left this means that C is on the left side
         # Add unary to the left side
-        min_tok = Token("-", TokenType.MINUS)
-        min_uop = UnaryOp(n.left, min_tok, n)
+        min_uop = UnaryOp(n.left, MINUS_TOKEN, n)
         n.left = min_uop
 
-    n.op.type = TokenType.PLUS
-    n.op.value = "+"
+    n.token = n.op = PLUS_TOKEN
 
 
 def sin_inv(n: UnaryOp):
-    n.op.value = "asin"
+    n.token = n.op = Token("asin", TokenType.FUNC)
 
 
 def cos_inv(n: UnaryOp):
-    n.op.value = "acos"
+    n.token = n.op = Token("acos", TokenType.FUNC)
 
 
 def tan_inv(n: UnaryOp):
-    n.op.value = "atan"
+    n.token = n.op = Token("atan", TokenType.FUNC)
 
 
 def asin_inv(n: UnaryOp):
-    n.op.value = "sin"
+    n.token = n.op = Token("sin", TokenType.FUNC)
 
 
 def acos_inv(n: UnaryOp):
-    n.op.value = "cos"
+    n.token = n.op = Token("cos", TokenType.FUNC)
 
 
 def atan_inv(n: UnaryOp):
-    n.op.value = "tan"
+    n.token = n.op = Token("tan", TokenType.FUNC)
 
 
 class SolverException(Exception):
     pass
 
 
+def _links(parent: AST, node: AST) -> bool:
+    """Checks if parent still has node as its child"""
+    if isinstance(parent, BinOp):
+        return parent.left is node or parent.right is node
+    if isinstance(parent, UnaryOp):
+        return parent.expr is node
+    return False
+
+
+class SymbolIndex:
+    """Symbol occurrences of a tree, kept current while the tree is rewritten
+
+    The tree is traversed once, when the index is built. Nodes changed
+    later are recorded into changes through utils.track_changes(), update()
+    only indexes the new nodes below them. Occurrences cut off the tree by
+    rewrites stay listed, side() tells them apart by walking the parent
+    chain of the occurrence, so locating the searched symbol costs
+    O(depth) per occurrence and does not grow with the rest of the tree."""
+
+    def __init__(self, root: AST):
+        self.root = root
+        # symbol -> occurrences, dict keeps them ordered without duplicates
+        self.occurrences: Dict[str, Dict[Num, None]] = {}
+        self.indexed: Set[AST] = set()
+        # nodes passed to invalidate_hash() since the last update()
+        self.changes: List[AST] = []
+        self._index(root)
+
+    def _index(self, start: AST):
+        """Indexes start and the nodes below it, stops at indexed nodes"""
+        occurrences, indexed = self.occurrences, self.indexed
+        stack = [start]
+        pop, push = stack.pop, stack.append
+        while stack:
+            node = pop()
+            if node in indexed:
+                continue
+            indexed.add(node)
+            node_type = type(node)
+            if node_type is BinOp:
+                push(node.right)
+                push(node.left)
+            elif node_type is UnaryOp:
+                push(node.expr)
+            elif node.token.type == TokenType.SYM:
+                occurrences.setdefault(node.value, {})[node] = None
+
+    def update(self):
+        """Indexes the nodes attached below the changed nodes"""
+        for node in self.changes:
+            if node not in self.indexed:
+                self._index(node)
+            elif isinstance(node, BinOp):
+                self._index(node.left)
+                self._index(node.right)
+            elif isinstance(node, UnaryOp):
+                self._index(node.expr)
+            elif node.token.type == TokenType.SYM:
+                # leaf turned into a symbol in place
+                self.occurrences.setdefault(node.value, {})[node] = None
+        self.changes.clear()
+
+    def get(self, symbol: str) -> List[Num]:
+        """Returns occurrences of the symbol in indexing order, including
+        the ones no longer in the tree"""
+        return list(self.occurrences.get(symbol, ()))
+
+    def side(self, node: AST) -> AST | None:
+        """Returns the child of the root which holds node, None if node is
+        no longer in the tree"""
+        root = self.root
+        parent = node.parent
+        while parent is not root:
+            if parent == None or not _links(parent, node):
+                return None
+            node, parent = parent, parent.parent
+        return node if _links(root, node) else None
+
+
 class Solver:
-    def __init__(self, string: str):
-        self.root = Parser(string).parse()
+    def __init__(self, string: str, tracer: Tracer | None = None, like_terms: bool = False):
+        self.string = string
+        self.root = parse_cached(string)
+        self.tracer = tracer
+        # the only full traversal for locating symbols, the stages keep
+        # the index current, see solve()
+        self.index = SymbolIndex(self.root)
+        # group like terms in the n-ary normal form instead of attracting them
+        self.like_terms = like_terms
+
+    def _trace(self, stage: str):
+        """Reports the tree after a stage to the tracer and to the logger at
+        DEBUG level, the tree is only turned into text if somebody listens"""
+        if self.tracer != None:
+            self.tracer(stage, self.root)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s %s", stage, trace(self.root))
+
+    def _simplify(self):
+        """Runs the simplification stages, attraction is skipped when like
+        terms are grouped by collect()"""
+        if not self.like_terms:
+            attract(self.root)
+            self._trace("attract")
+        preprocess(self.root)
+        self._trace("preprocess")
+        collect(self.root, self.like_terms)
+        self._trace("collect")
+        postprocess(self.root)
+        self._trace("postprocess")
 
     def solve(self, symbol: str) -> AST:
+        """Solves for given _searched symbol_, see _solve()"""
+        # changes made by the stages are recorded for the symbol index
+        with track_changes(self.index.changes):
+            return self._solve(symbol)
+
+    def _solve(self, symbol: str) -> AST:
         """Solves for given _searched symbol_
         Solving is essentialy a process of moving all non _searched symbol_ nodes to the right side of the tree
         while having all _searched symbol_ nodes on the left side. This needs to be done with rules of algebra"""
@@ -116,30 +232,34 @@ class Solver:
         if self.root.op.type != TokenType.EQ:
             raise SolverException(
                 "Provided expression tree does not contain '=' at root element")
-        print("input", trace(self.root))
-        attract(self.root)
-        print("attract", trace(self.root))
-        preprocess(self.root)
-        print("preprocess", trace(self.root))
-        collect(self.root)
-        print("collect", trace(self.root))
-        postprocess(self.root)
-        print("postprocess", trace(self.root))
-        # perform DFS to find requested symbol occurences
+        self._trace("input")
+        self._simplify()
+        # the index was kept current by the stages, every occurence is
+        # assigned to its side by a single walk up its parent chain
         # TODO: make sure that left and right subtree are NOT None!!
-        left_subtree_snodes = self.dfs(symbol, self.root.left)
-        right_subtree_snodes = self.dfs(symbol, self.root.right)
+        self.index.update()
+        left_occurences = []
+        right_occurences = []
+        for snode in self.index.get(symbol):
+            side = self.index.side(snode)
+            if side == None or snode.token.type != TokenType.SYM or snode.value != symbol:
+                continue  # rewritten by the stages
+            if side is self.root.left:
+                left_occurences.append(snode)
+            else:
+                right_occurences.append(snode)
 
         # swap left with right if there are more searched symbols on the right side
-        if len(right_subtree_snodes) > len(left_subtree_snodes):
+        if len(right_occurences) > len(left_occurences):
+            invalidate_hash(self.root)
             self.root.left, self.root.right = self.root.right, self.root.left
-            left_subtree_snodes, right_subtree_snodes = right_subtree_snodes, left_subtree_snodes
+            left_occurences, right_occurences = right_occurences, left_occurences
 
-        if len(right_subtree_snodes) == 0 and len(left_subtree_snodes) == 0:
+        if len(right_occurences) == 0 and len(left_occurences) == 0:
             raise SolverException(
                 "Searched symbol was not found in the provided equation")
 
-        if len(left_subtree_snodes) > 1:
+        if len(left_occurences) > 1:
             raise SolverException(
                 "Multiple unknown occurences after initial collection, solving not supported")
 
@@ -178,8 +298,10 @@ class Solver:
 
         # go through all searched nodes
         # Move everything that is not an snode
-        for snode in left_subtree_snodes:
-            path = list(reversed(self.path(snode)))
+        # only the isolated occurence needs its path, from the root down
+        for snode in left_occurences:
+            path = self.path(snode)
+            path.reverse()
             for n, n2 in zip(path, path[1:]):
                 if n.token.type == TokenType.EQ:  # skip equals
                     continue
@@ -188,6 +310,9 @@ class Solver:
                 # node of the parent
                 isLeft = n.isLeft()
 
+                # n and its ancestors are about to change
+                invalidate_hash(n)
+
                 if isinstance(n, UnaryOp):
                     # move symbol and the subtree that
                     # does not have snode in it to the right
@@ -224,7 +349,8 @@ class Solver:
 
                         # move op to the right of the root
                         n.parent = self.root
-                        n.expr = self.root.right
+                        n.expr = root_right
+                        root_right.parent = n
                         self.root.right = n
 
                     else:
@@ -280,18 +406,34 @@ class Solver:
                             f"Could not find inverse operation for: {n.op.type}")
                     inv_op(n, isTargetLeft)
 
-        print("isolate", trace(self.root))
+        left = self.root.left
+        if not (isinstance(left, Num) and left.token.type == TokenType.SYM and left.value == symbol):
+            raise SolverException(
+                f"Could not isolate {symbol}, left side is {trace(left)}")
+        self._trace("isolate")
         # Postprocessing
-        attract(self.root)
-        print("attract", trace(self.root))
-        preprocess(self.root)
-        print("preprocess", trace(self.root))
-        collect(self.root)
-        print("collect", trace(self.root))
-        postprocess(self.root)
-        print("postprocess", trace(self.root))
+        self._simplify()
         return self.root
 
+    def compile(self, symbol: str) -> CompiledSolution:
+        """Solves for given _searched symbol_ and compiles the right-hand side
+        into a function of the remaining symbols. Solutions are cached per
+        equation and symbol, so only the first call does the symbolic work"""
+        solution = solution_cache.get(self.string, symbol)
+        if solution == None:
+            solution = compile_solution(self.solve(symbol), symbol)
+            solution_cache.store(self.string, symbol, solution)
+        return solution
+
+    def vectorize(self, symbol: str) -> VectorizedSolution:
+        """Like compile(), the solution is evaluated over NumPy arrays of
+        values of the remaining symbols"""
+        solution = solution_cache.get(self.string, symbol, "numpy")
+        if solution == None:
+            solution = vectorize_solution(self.solve(symbol), symbol)
+            solution_cache.store(self.string, symbol, solution, "numpy")
+        return solution
+
     def dfs(self, symbol: str, start_point: AST = None) -> List[AST]:
         """Searches the ast tree
         Function assumes binary tree and no loops,
@@ -1,7 +1,9 @@
+import re
 from enum import Enum
-from typing import List
+from typing import Any, Iterator, List, NamedTuple
 
 from math import pi
+from numeric import get_backend
 
 class TokenType(Enum):
     BEGIN = -1
@@ -19,10 +21,27 @@ class TokenType(Enum):
     EOF = 999
 
 
-class Token:
-    def __init__(self, value, type):
-        self.value = value
-        self.type = type
+class Token(NamedTuple):
+    """Immutable (value, type) pair
+
+    Tokens are shared between nodes and trees (see the interned operator
+    tokens below), so they must never be modified in place - assign a new
+    token to the node instead."""
+    value: Any
+    type: Any
+
+
+# Interned tokens, every operator node of a given kind shares one token
+PLUS_TOKEN = Token('+', TokenType.PLUS)
+MINUS_TOKEN = Token('-', TokenType.MINUS)
+MUL_TOKEN = Token('*', TokenType.MUL)
+DIV_TOKEN = Token('/', TokenType.DIV)
+POW_TOKEN = Token('^', TokenType.POW)
+EQ_TOKEN = Token('=', TokenType.EQ)
+LPAREN_TOKEN = Token('(', TokenType.LPAREN)
+RPAREN_TOKEN = Token(')', TokenType.RPAREN)
+EOF_TOKEN = Token("\0", TokenType.EOF)
+PI_TOKEN = Token(pi, TokenType.NUM)
 
 
 class LexerException(Exception):
@@ -32,7 +51,8 @@ class LexerException(Exception):
 class Lexer:
     """Converts string input into tokens
 
-    - Consecutive numbers like 3, 2313 or 3.14 are converted into NUM
+    - Consecutive numbers like 3, 2313 or 3.14 are converted into NUM,
+      with values created by the numeric backend (see numeric.py)
     - Symbols -, +, *, /, ^ are converted, respectively, into MINUS, PLUS, MUL, DIV, POW
     - Parenthesis (, ) are converted, respectively, into LPAREN, RPAREN
     - Words: a, ab, haha are converted into SYM
@@ -50,6 +70,17 @@ class Lexer:
         ')': TokenType.RPAREN
     }
 
+    operator_tokens = {
+        '+': PLUS_TOKEN,
+        '-': MINUS_TOKEN,
+        '*': MUL_TOKEN,
+        '/': DIV_TOKEN,
+        '^': POW_TOKEN,
+        '=': EQ_TOKEN,
+        '(': LPAREN_TOKEN,
+        ')': RPAREN_TOKEN
+    }
+
     def __init__(self):
         self.current_char = None
         self.current_token = Token("", TokenType.BEGIN)
@@ -65,6 +96,9 @@ class Lexer:
             self.current_char = "\0"
 
     def lex(self, string: str) -> List[Token]:
+        # Reset state left over from the previous call, so that the same
+        # instance can lex many strings
+        self.__init__()
         result = []
         self.string = string
         self.max_pos = len(string)
@@ -85,7 +119,7 @@ class Lexer:
                 self._next_char()
 
         if self.current_pos >= len(self.string):
-            return Token("\0", TokenType.EOF)
+            return EOF_TOKEN
 
         # Number tokens
         if self.current_char.isdigit():
@@ -103,7 +137,7 @@ class Lexer:
                     break
             self.current_pos = pos
             self.current_char = curr_char
-            return Token(int(tok), TokenType.NUM)
+            return Token(get_backend().literal(tok), TokenType.NUM)
 
         #Symbol and tokens
         if self.current_char.isalpha():
@@ -121,15 +155,72 @@ class Lexer:
             self.current_pos = pos
             self.current_char = curr_char
             if tok == "PI":
-                return Token(pi, TokenType.NUM)
+                return PI_TOKEN
             return Token(tok, TokenType.SYM)
 
         # 1-char tokens/operators
         if len(self.current_char) == 1:
-            op = self.operators.get(self.current_char, None)
+            op = self.operator_tokens.get(self.current_char, None)
             if op == None:
                 raise LexerException(
                     f"Invalid operator: {repr(self.current_char)}")
-            char_op = self.current_char
             self._next_char()  # Advance character pointer
-            return Token(char_op, op)
+            return op
+
+
+class RegexLexer:
+    """Converts string input into tokens using a single compiled master regex
+
+    Produces the same token stream as Lexer, but every lexeme is sliced out of
+    the input by one regex scan instead of being grown character by character.
+    Leading spaces are consumed together with the lexeme, any character not
+    covered by the other groups ends up in the last (invalid) group.
+    """
+
+    master_pattern = re.compile(
+        r" *(?:(\d+)|([^\W\d_]+)|([-+*/^=()])|([^ ]))")
+
+    def lex(self, string: str) -> List[Token]:
+        result = []
+        append = result.append
+        operators = Lexer.operator_tokens
+        literal = get_backend().literal
+        for num, sym, op, invalid in self.master_pattern.findall(string):
+            if op:
+                append(operators[op])
+            elif num:
+                append(Token(literal(num), TokenType.NUM))
+            elif sym:
+                if sym == "PI":
+                    append(PI_TOKEN)
+                else:
+                    append(Token(sym, TokenType.SYM))
+            else:
+                raise LexerException(f"Invalid operator: {repr(invalid)}")
+        append(EOF_TOKEN)
+        return result
+
+
+def iter_tokens(string: str) -> Iterator[Token]:
+    """Lazily yields the same tokens as RegexLexer.lex, ending with EOF
+
+    The generator keeps no state outside of itself, so it can be used
+    concurrently for many strings and lets consumers like Parser work
+    without materialising the whole token list.
+    """
+    operators = Lexer.operator_tokens
+    literal = get_backend().literal
+    for m in RegexLexer.master_pattern.finditer(string):
+        num, sym, op, invalid = m.groups()
+        if op:
+            yield operators[op]
+        elif num:
+            yield Token(literal(num), TokenType.NUM)
+        elif sym:
+            if sym == "PI":
+                yield PI_TOKEN
+            else:
+                yield Token(sym, TokenType.SYM)
+        else:
+            raise LexerException(f"Invalid operator: {repr(invalid)}")
+    yield EOF_TOKEN
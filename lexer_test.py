@@ -1,4 +1,5 @@
-from lexer import Lexer, TokenType
+import pytest
+from lexer import PLUS_TOKEN, Lexer, LexerException, RegexLexer, TokenType, iter_tokens
 
 
 def test_lexer_simple_num():
@@ -51,3 +52,41 @@ def test_lexer_expression_whitespace_skips():
             and r[3].type == TokenType.SYM
             and r[4].type == TokenType.RPAREN
             and r[5].type == TokenType.EOF)
+
+
+def test_regex_lexer_matches_lexer():
+    inputs = ["1", "ab", "   (  a  +   b)   ", "x+1*5-sin(2) = 1",
+              "ek = (m*v^2) / 2", "2*PI*r=c", "x1+22y"]
+    for input in inputs:
+        expected = Lexer().lex(input)
+        result = RegexLexer().lex(input)
+        assert ([(t.value, t.type) for t in result]
+                == [(t.value, t.type) for t in expected])
+
+
+def test_regex_lexer_invalid_operator():
+    with pytest.raises(LexerException):
+        RegexLexer().lex("a % b")
+
+
+def test_lexer_reuse():
+    l = Lexer()
+    l.lex("a + b")
+    r = l.lex("12")
+    assert r[0].type == TokenType.NUM and r[0].value == 12
+    assert r[1].type == TokenType.EOF
+
+
+def test_iter_tokens():
+    tokens = iter_tokens("sin(x) = 2")
+    assert next(tokens).value == "sin"
+    assert [t.type for t in tokens] == [TokenType.LPAREN, TokenType.SYM, TokenType.RPAREN,
+                                        TokenType.EQ, TokenType.NUM, TokenType.EOF]
+
+
+def test_operator_tokens_are_interned():
+    first = RegexLexer().lex("a+b")
+    second = Lexer().lex("c+d")
+    assert first[1] is second[1] is PLUS_TOKEN
+    with pytest.raises(AttributeError):
+        PLUS_TOKEN.value = "-"
@@ -1,3 +1,4 @@
+import logging
 import sys
 from isolation import Solver
 from lexer import Lexer
@@ -15,6 +16,9 @@ if __name__ == "__main__":
 
     equation_string = sys.argv[1]
     solve_for = sys.argv[2]
+    if "-v" in sys.argv[3:]:
+        # print the equation after every solving stage
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
 
     s = Solver(equation_string)
     r = s.solve(solve_for)
@@ -0,0 +1,350 @@
+from typing import Callable, Dict, List, Tuple
+from equation_parser import AST, BinOp, Num, UnaryOp
+from lexer import MUL_TOKEN, PLUS_TOKEN, TokenType
+from numeric import get_backend
+from utils import create_div_op, create_minus_op, create_minus_unary, create_mul_op, create_num, create_plus_op, create_pow_op
+
+# N-ary view of the expression tree. +- chains become Sum nodes and */
+# chains become Product nodes with their operands in canonical order, which
+# brings like terms next to each other. Other modules only understand
+# binary trees, convert back with to_binop() before handing the tree over.
+# Trees can be deeper than the recursion limit, so they are walked with
+# explicit stacks.
+
+ADD_TYPES = {TokenType.PLUS, TokenType.MINUS}
+MUL_TYPES = {TokenType.MUL, TokenType.DIV}
+
+# (sign, operand), sign is 1 or -1
+Operand = Tuple[int, AST]
+
+
+class NaryException(Exception):
+    pass
+
+
+class Sum(AST):
+    """N-ary addition, terms with sign -1 are subtracted"""
+
+    def __init__(self, terms: List[Operand], parent: AST | None = None):
+        super().__init__(parent)
+        self.token = self.op = PLUS_TOKEN
+        self.terms = terms
+        for _, term in terms:
+            term.parent = self
+
+
+class Product(AST):
+    """N-ary multiplication, factors with sign -1 are divided by"""
+
+    def __init__(self, factors: List[Operand], parent: AST | None = None):
+        super().__init__(parent)
+        self.token = self.op = MUL_TOKEN
+        self.factors = factors
+        for _, factor in factors:
+            factor.parent = self
+
+
+def _children(node: AST) -> List[AST]:
+    if isinstance(node, BinOp):
+        return [node.left, node.right]
+    elif isinstance(node, UnaryOp):
+        return [node.expr]
+    elif isinstance(node, Sum):
+        return [t for _, t in node.terms]
+    elif isinstance(node, Product):
+        return [f for _, f in node.factors]
+    elif isinstance(node, Num):
+        return []
+    raise NaryException(f"Invalid node type {type(node)}")
+
+
+def _postorder(root: AST, children: Callable[[AST], List[AST]] = _children,
+               skip: Callable[[AST], bool] | None = None) -> List[AST]:
+    """Nodes of the subtree, children before their parents. Subtrees of
+    nodes for which skip returns True are left out"""
+    order = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if skip != None and skip(node):
+            continue
+        order.append(node)
+        stack.extend(children(node))
+    order.reverse()
+    return order
+
+
+def _rebuild(root: AST, build: Callable[[AST, Callable[[AST], AST]], AST],
+             children: Callable[[AST], List[AST]] = _children) -> AST:
+    """Builds a new tree from the leaves up, build(node, new) receives the
+    function returning the already built replacement of a child"""
+    built: Dict[int, AST] = {}
+    new = lambda child: built[id(child)]
+    for node in _postorder(root, children):
+        built[id(node)] = build(node, new)
+    return built[id(root)]
+
+
+def _render(node: AST, text_of: Callable[[AST], str]) -> str:
+    if isinstance(node, Num):
+        return str(node.value)
+    elif isinstance(node, BinOp):
+        return f"({text_of(node.left)}{node.token.value}{text_of(node.right)})"
+    elif isinstance(node, UnaryOp):
+        return f"{node.token.value}({text_of(node.expr)})"
+    elif isinstance(node, Sum):
+        return "+(" + ",".join(("" if s == 1 else "-") + text_of(t) for s, t in node.terms) + ")"
+    elif isinstance(node, Product):
+        return "*(" + ",".join(("" if s == 1 else "/") + text_of(f) for s, f in node.factors) + ")"
+    raise NaryException(f"Invalid node type {type(node)}")
+
+
+def text(node: AST) -> str:
+    """Deterministic textual form of the subtree, used as a grouping and sorting key"""
+    texts: Dict[int, str] = {}
+    text_of = lambda child: texts[id(child)]
+    for n in _postorder(node):
+        texts[id(n)] = _render(n, text_of)
+    return texts[id(node)]
+
+
+def _has_key(node: AST) -> bool:
+    return "_text" in node.__dict__
+
+
+def _key(node: AST) -> str:
+    """text() of a node built here, cached on the node. Nodes of the n-ary
+    trees are never modified once built, so the cached keys stay valid and
+    every node is rendered once however often it is sorted or grouped"""
+    if not _has_key(node):
+        for n in _postorder(node, skip=_has_key):
+            n._text = _render(n, _key_of)
+    return node._text
+
+
+def _key_of(node: AST) -> str:
+    return node._text
+
+
+def _is_number(node: AST) -> bool:
+    return isinstance(node, Num) and node.token.type == TokenType.NUM
+
+
+def canonical_key(node: AST) -> Tuple[int, str]:
+    """Sort key of an operand: numbers first, then symbols, then compound nodes"""
+    if _is_number(node):
+        return (0, _key(node))
+    if isinstance(node, Num):
+        return (1, _key(node))
+    return (2, _key(node))
+
+
+def _term_key(operand: Operand) -> Tuple[bool, Tuple[int, str]]:
+    # constants go last in sums: x+2
+    return (_is_number(operand[1]), canonical_key(operand[1]))
+
+
+def _factor_key(operand: Operand) -> Tuple[int, str]:
+    return canonical_key(operand[1])
+
+
+def _chain_types(node: AST) -> set | None:
+    if isinstance(node, BinOp):
+        if node.token.type in ADD_TYPES:
+            return ADD_TYPES
+        if node.token.type in MUL_TYPES:
+            return MUL_TYPES
+    return None
+
+
+def _chain(node: AST, types: set) -> List[Operand]:
+    """Collects signed operands of the +- or */ chain starting at node"""
+    subtract = TokenType.MINUS if types == ADD_TYPES else TokenType.DIV
+    result = []
+    stack = [(1, node)]
+    while stack:
+        sign, n = stack.pop()
+        if isinstance(n, BinOp) and n.token.type in types:
+            stack.append((-sign if n.token.type == subtract else sign, n.right))
+            stack.append((sign, n.left))
+        elif (types == ADD_TYPES and isinstance(n, UnaryOp)
+              and n.token.type == TokenType.MINUS):
+            stack.append((-sign, n.expr))
+        else:
+            result.append((sign, n))
+    return result
+
+
+def flatten(node: AST) -> AST:
+    """Returns a copy of the tree with +- chains turned into Sum nodes and
+    */ chains into Product nodes, operands are sorted canonically"""
+    # operands of the chains, by id of the chain's top node
+    chains: Dict[int, List[Operand]] = {}
+
+    def operands(n: AST) -> List[AST]:
+        types = _chain_types(n)
+        if types == None:
+            return _children(n)
+        chains[id(n)] = _chain(n, types)
+        return [o for _, o in chains[id(n)]]
+
+    def build(n: AST, new: Callable[[AST], AST]) -> AST:
+        types = _chain_types(n)
+        if types == ADD_TYPES:
+            return Sum(sorted(((s, new(t)) for s, t in chains[id(n)]), key=_term_key))
+        elif types == MUL_TYPES:
+            return Product(sorted(((s, new(f)) for s, f in chains[id(n)]), key=_factor_key))
+        elif isinstance(n, BinOp):
+            return BinOp(new(n.left), n.token, new(n.right))
+        elif isinstance(n, UnaryOp):
+            return UnaryOp(new(n.expr), n.token)
+        return Num(n.token)
+
+    return _rebuild(node, build, operands)
+
+
+def _product(factors: List[Operand]) -> AST:
+    if len(factors) == 1 and factors[0][0] == 1:
+        return factors[0][1]
+    return Product(factors)
+
+
+def _collect_product(node: Product) -> AST:
+    backend = get_backend()
+    coefficient = 1
+    # text of the base -> [base, exponent]
+    groups = {}
+    rest = []
+    for sign, factor in node.factors:
+        if _is_number(factor) and (sign == 1 or factor.value != 0):
+            coefficient = (backend.mul if sign == 1 else backend.div)(coefficient, factor.value)
+            continue
+        if (isinstance(factor, BinOp) and factor.token.type == TokenType.POW
+                and _is_number(factor.right)):
+            base, exponent = factor.left, factor.right.value
+        elif isinstance(factor, Num):
+            base, exponent = factor, 1
+        else:
+            # only symbols and their powers are grouped
+            rest.append((sign, factor))
+            continue
+        group = groups.setdefault(_key(base), [base, 0])
+        group[1] = (backend.add if sign == 1 else backend.sub)(group[1], exponent)
+
+    if coefficient == 0:
+        return create_num(0)
+    factors = []
+    for base, exponent in groups.values():
+        if exponent == 0:
+            continue
+        sign = 1 if exponent > 0 else -1
+        factors.append((sign, base if abs(exponent) == 1 else create_pow_op(base, create_num(abs(exponent)))))
+    factors.extend(rest)
+    factors.sort(key=_factor_key)
+    if coefficient != 1 or len(factors) == 0:
+        factors.insert(0, (1, create_num(coefficient)))
+    return _product(factors)
+
+
+def _collect_sum(node: Sum) -> AST:
+    backend = get_backend()
+    constant = 0
+    # text of the monomial -> [monomial factors, coefficient]
+    groups = {}
+    for sign, term in node.terms:
+        if _is_number(term):
+            constant = (backend.add if sign == 1 else backend.sub)(constant, term.value)
+            continue
+        coefficient = 1
+        factors = [(1, term)]
+        if isinstance(term, Product):
+            factors = term.factors
+            if _is_number(factors[0][1]) and factors[0][0] == 1:
+                coefficient = factors[0][1].value
+                factors = factors[1:]
+        key = ",".join(("" if s == 1 else "/") + _key(f) for s, f in factors)
+        group = groups.setdefault(key, [factors, 0])
+        group[1] = (backend.add if sign == 1 else backend.sub)(group[1], coefficient)
+
+    terms = []
+    for factors, coefficient in groups.values():
+        if coefficient == 0:
+            continue
+        sign = 1 if coefficient > 0 else -1
+        if abs(coefficient) != 1:
+            factors = [(1, create_num(abs(coefficient)))] + factors
+        terms.append((sign, _product(factors)))
+    terms.sort(key=_term_key)
+    if constant != 0 or len(terms) == 0:
+        terms.append((1 if constant >= 0 else -1, create_num(abs(constant))))
+    if len(terms) == 1 and terms[0][0] == 1:
+        return terms[0][1]
+    return Sum(terms)
+
+
+def _merge(operands: List[Operand], node_type: type) -> List[Operand]:
+    # collected operands may turn into nodes of the parent type, e.g. (x+y)*1
+    result = []
+    for sign, operand in operands:
+        if isinstance(operand, node_type):
+            inner = operand.terms if node_type == Sum else operand.factors
+            result.extend((sign * s, o) for s, o in inner)
+        else:
+            result.append((sign, operand))
+    return result
+
+
+def collect_like_terms(node: AST) -> AST:
+    """Groups like terms of Sum nodes and like factors of Product nodes,
+    in a single bottom-up pass over the flattened tree. Returns the new subtree"""
+    def build(n: AST, new: Callable[[AST], AST]) -> AST:
+        if isinstance(n, Sum):
+            return _collect_sum(Sum(_merge([(s, new(t)) for s, t in n.terms], Sum)))
+        elif isinstance(n, Product):
+            return _collect_product(Product(_merge([(s, new(f)) for s, f in n.factors], Product)))
+        elif isinstance(n, BinOp):
+            return BinOp(new(n.left), n.token, new(n.right))
+        elif isinstance(n, UnaryOp):
+            return UnaryOp(new(n.expr), n.token)
+        return n
+
+    return _rebuild(node, build)
+
+
+def _to_chain(operands: List[Operand], new: Callable[[AST], AST], invert: Callable[[AST], AST],
+              combine: Callable[[AST, AST], AST], uncombine: Callable[[AST, AST], AST]) -> AST:
+    result = None
+    for sign, operand in sorted(operands, key=lambda operand: -operand[0]):
+        operand = new(operand)
+        if result == None:
+            result = operand if sign == 1 else invert(operand)
+        else:
+            result = combine(result, operand) if sign == 1 else uncombine(result, operand)
+    return result
+
+
+def _reciprocal(node: AST) -> AST:
+    return create_div_op(create_num(1), node)
+
+
+def to_binop(node: AST) -> AST:
+    """Converts Sum and Product nodes back into left leaning BinOp chains,
+    subtracted terms and divisors follow the others: y-x rather than -x+y"""
+    def build(n: AST, new: Callable[[AST], AST]) -> AST:
+        if isinstance(n, Sum):
+            return _to_chain(n.terms, new, create_minus_unary, create_plus_op, create_minus_op)
+        elif isinstance(n, Product):
+            return _to_chain(n.factors, new, _reciprocal, create_mul_op, create_div_op)
+        elif isinstance(n, BinOp):
+            return BinOp(new(n.left), n.token, new(n.right))
+        elif isinstance(n, UnaryOp):
+            return UnaryOp(new(n.expr), n.token)
+        return Num(n.token)
+
+    return _rebuild(node, build)
+
+
+def normalize(root: AST) -> AST:
+    """Returns a copy of the tree with operands in canonical order and like
+    terms collected, as a binary tree"""
+    return to_binop(collect_like_terms(flatten(root)))
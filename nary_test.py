@@ -0,0 +1,48 @@
+from equation_parser import parse
+from numeric import use_backend
+from nary import Product, Sum, flatten, normalize, to_binop
+from utils import create_func_unary, create_mul_op, create_num, create_plus_op, create_sym, trace
+
+
+def test_flatten_sum():
+    r = flatten(parse("a-(b-c)+-d"))
+    assert isinstance(r, Sum)
+    assert [(s, t.value) for s, t in r.terms] == [(1, "a"), (-1, "b"), (1, "c"), (-1, "d")]
+
+
+def test_flatten_product_canonical_order():
+    r = flatten(parse("y*x/z*2"))
+    assert isinstance(r, Product)
+    assert [(s, f.value) for s, f in r.factors] == [(1, 2), (1, "x"), (1, "y"), (-1, "z")]
+
+
+def test_to_binop():
+    assert trace(to_binop(flatten(parse("b+a-c=1")))) == "((a+b)-c)=1"
+    assert trace(to_binop(flatten(parse("-b+a=1")))) == "(a-b)=1"
+    assert trace(to_binop(flatten(parse("x/y*z=1")))) == "((x*z)/y)=1"
+
+
+def test_normalize_like_terms():
+    assert trace(normalize(parse("x+2+x=1"))) == "((2*x)+2)=1"
+    assert trace(normalize(parse("x^2*x^3+3*x-x*2=1"))) == "(x+(x^5))=1"
+    assert trace(normalize(parse("x*y+y*x-3=1"))) == "(((2*x)*y)-3)=1"
+    assert trace(normalize(parse("2*y*3/y=x"))) == "6=x"
+    assert trace(normalize(parse("sin(x+1+x)=x-x"))) == "sin(((2*x)+1))=0"
+
+
+def test_normalize_numeric_backend():
+    with use_backend("exact"):
+        assert trace(normalize(parse("y=x/3+x/6"))) == "y=(1/2*x)"
+        assert type(normalize(parse("y=2*x/3*3")).right.left.value) is int
+
+
+def test_normalize_deep_tree():
+    # alternating sums and products nest deeper than the recursion limit
+    node = create_sym("x")
+    for i in range(3000):
+        node = create_func_unary(create_plus_op(create_mul_op(create_num(2), node), create_sym("y")), "sin")
+    r = normalize(node)
+    for i in range(3000):
+        assert r.token.value == "sin"
+        r = r.expr.right.right
+    assert r.value == "x"
@@ -0,0 +1,160 @@
+from contextlib import contextmanager
+from fractions import Fraction
+from typing import Callable, Dict, Iterator
+
+# Numeric backends decide how numbers of the equations are represented and
+# folded. The backend is process wide, switch it with set_backend() or
+# temporarily with use_backend().
+#
+# float    - Python numbers, 1/3 becomes 0.333.. (default)
+# fraction - every number is a Fraction, 1/3 stays 1/3
+# exact    - integers stay ints, inexact divisions become Fractions,
+#            ints are folded without Fraction overhead
+
+Number = int | float | Fraction
+
+
+class NumericException(Exception):
+    pass
+
+
+class Backend:
+    """Python number semantics, results of / and irrational powers are floats"""
+    name = "float"
+
+    def __init__(self):
+        # operator token value -> operation
+        self.operations: Dict[str, Callable[[Number, Number], Number]] = {
+            "+": self.add,
+            "-": self.sub,
+            "*": self.mul,
+            "/": self.div,
+            "^": self.pow,
+        }
+
+    def literal(self, text: str) -> Number:
+        """Converts NUM lexeme into a number"""
+        return int(text)
+
+    def add(self, a: Number, b: Number) -> Number:
+        return a + b
+
+    def sub(self, a: Number, b: Number) -> Number:
+        return a - b
+
+    def mul(self, a: Number, b: Number) -> Number:
+        return a * b
+
+    def div(self, a: Number, b: Number) -> Number:
+        return a / b
+
+    def pow(self, a: Number, b: Number) -> Number:
+        return a ** b
+
+    def function(self, function: Callable[[float], float], value: Number) -> Number:
+        """Applies math function (sin, cos, ...), their results are irrational
+        in general so they are always floats"""
+        return function(value)
+
+    def fold(self, operator: str, a: Number, b: Number) -> Number:
+        """Applies binary operator (+, -, *, / or ^)"""
+        operation = self.operations.get(operator, None)
+        if operation == None:
+            raise NumericException(f"Cannot fold operator {operator!r}")
+        return operation(a, b)
+
+
+def _is_rational(value: Number) -> bool:
+    return type(value) is int or type(value) is Fraction
+
+
+def _exact(value: Number) -> Number:
+    # Fractions with denominator 1 are folded back into ints
+    if type(value) is Fraction and value.denominator == 1:
+        return value.numerator
+    return value
+
+
+class FractionBackend(Backend):
+    """Every rational number is a Fraction"""
+    name = "fraction"
+
+    def literal(self, text: str) -> Number:
+        return Fraction(int(text))
+
+    def div(self, a: Number, b: Number) -> Number:
+        if _is_rational(a) and _is_rational(b):
+            return Fraction(a) / b
+        return a / b
+
+    def pow(self, a: Number, b: Number) -> Number:
+        if _is_rational(a) and _is_rational(b) and Fraction(b).denominator == 1:
+            return Fraction(a) ** int(b)
+        return float(a) ** float(b)
+
+
+class ExactBackend(Backend):
+    """Integers stay ints as long as the results are integral, other rational
+    results are Fractions. Floats are only produced by floats and functions"""
+    name = "exact"
+
+    def add(self, a: Number, b: Number) -> Number:
+        if type(a) is int and type(b) is int:
+            return a + b
+        return _exact(a + b)
+
+    def sub(self, a: Number, b: Number) -> Number:
+        if type(a) is int and type(b) is int:
+            return a - b
+        return _exact(a - b)
+
+    def mul(self, a: Number, b: Number) -> Number:
+        if type(a) is int and type(b) is int:
+            return a * b
+        return _exact(a * b)
+
+    def div(self, a: Number, b: Number) -> Number:
+        if type(a) is int and type(b) is int:
+            if b != 0 and a % b == 0:
+                return a // b
+            return _exact(Fraction(a, b))
+        if _is_rational(a) and _is_rational(b):
+            return _exact(Fraction(a) / b)
+        return a / b
+
+    def pow(self, a: Number, b: Number) -> Number:
+        if type(a) is int and type(b) is int and b >= 0:
+            return a ** b
+        if _is_rational(a) and _is_rational(b) and Fraction(b).denominator == 1:
+            return _exact(Fraction(a) ** int(b))
+        return float(a) ** float(b)
+
+
+backends: Dict[str, Backend] = {
+    backend.name: backend for backend in [Backend(), FractionBackend(), ExactBackend()]
+}
+
+_backend = backends["float"]
+
+
+def get_backend() -> Backend:
+    return _backend
+
+
+def set_backend(name: str):
+    global _backend
+    if name not in backends:
+        raise NumericException(
+            f"Unknown numeric backend {name}, available: {', '.join(backends)}")
+    _backend = backends[name]
+
+
+@contextmanager
+def use_backend(name: str) -> Iterator[Backend]:
+    """Switches numeric backend for the duration of the with block"""
+    previous = _backend.name
+    set_backend(name)
+    try:
+        yield _backend
+    finally:
+        set_backend(previous)
@@ -0,0 +1,49 @@
+from fractions import Fraction
+import pytest
+from collection import collect
+from equation_parser import parse
+from numeric import NumericException, get_backend, set_backend, use_backend
+from parse_cache import ParseCache
+from utils import trace
+
+
+def test_float_backend_is_default():
+    assert get_backend().name == "float"
+    assert get_backend().fold("/", 1, 3) == 1 / 3
+
+
+def test_exact_backend():
+    with use_backend("exact") as backend:
+        assert type(backend.fold("/", 6, 3)) is int
+        assert backend.fold("/", 1, 3) == Fraction(1, 3)
+        assert type(backend.fold("*", Fraction(1, 3), 3)) is int
+        assert backend.fold("^", 2, -2) == Fraction(1, 4)
+        assert type(backend.fold("+", 1.5, 1)) is float
+    assert get_backend().name == "float"
+
+
+def test_fraction_backend():
+    with use_backend("fraction") as backend:
+        assert type(backend.literal("2")) is Fraction
+        assert backend.fold("/", 1, 3) == Fraction(1, 3)
+
+
+def test_unknown_backend():
+    with pytest.raises(NumericException):
+        set_backend("decimal")
+
+
+def test_collect_numbers_exact():
+    for backend, expected in [("float", "x=0.5"), ("exact", "x=1/2"), ("fraction", "x=1/2")]:
+        with use_backend(backend):
+            r = parse("x=1/3+1/6")
+            collect(r)
+            assert trace(r) == expected
+
+
+def test_parse_cache_per_backend():
+    cache = ParseCache()
+    assert type(cache.get("x=1").right.value) is int
+    with use_backend("fraction"):
+        assert type(cache.get("x=1").right.value) is Fraction
+    assert cache.misses == 2
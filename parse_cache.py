@@ -0,0 +1,63 @@
+import re
+from collections import OrderedDict
+from typing import Tuple
+from equation_parser import AST, Parser
+from numeric import get_backend
+from utils import copy_tree
+
+# Spaces next to operators and parenthesis do not change the token stream,
+# spaces between two words or numbers do, so those are only collapsed
+_operator_spaces = re.compile(r" *([^\w ]) *")
+_repeated_spaces = re.compile(r" {2,}")
+
+
+def normalize(string: str) -> str:
+    """Returns equation text with insignificant spaces removed, strings that
+    normalize to the same text always produce the same tree"""
+    string = _operator_spaces.sub(r"\1", string)
+    return _repeated_spaces.sub(" ", string).strip(" ")
+
+
+class ParseCache:
+    """LRU cache mapping normalized equation text to a parsed tree template,
+    separately for every numeric backend, as they produce different NUM values
+
+    Templates are never handed out, every get() returns a fresh copy of the
+    template, which the caller is free to mutate"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._templates: OrderedDict[Tuple[str, str], AST] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def get(self, string: str) -> AST:
+        text = normalize(string)
+        key = (get_backend().name, text)
+        template = self._templates.get(key, None)
+        if template != None:
+            self.hits += 1
+            self._templates.move_to_end(key)
+        else:
+            self.misses += 1
+            template = Parser(text).parse()
+            self._templates[key] = template
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        return copy_tree(template)
+
+    def clear(self):
+        self._templates.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Process wide cache used by the solvers
+parse_cache = ParseCache()
+
+
+def parse_cached(string: str) -> AST:
+    return parse_cache.get(string)
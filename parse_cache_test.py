@@ -0,0 +1,37 @@
+from parse_cache import ParseCache, normalize
+from utils import trace
+
+
+def test_normalize():
+    assert normalize("  a +  b = sin( c ) ") == "a+b=sin(c)"
+    # spaces between words are significant for the lexer
+    assert normalize("a   b") == "a b"
+
+
+def test_cache_hits_and_misses():
+    cache = ParseCache()
+    first = cache.get("a + b = c")
+    second = cache.get("a+b=c")
+    assert cache.misses == 1 and cache.hits == 1
+    assert first is not second
+    assert trace(first) == trace(second) == "(a+b)=c"
+
+
+def test_cache_returns_independent_copies():
+    cache = ParseCache()
+    first = cache.get("a + b = c")
+    first.left.left = first.right
+    assert trace(cache.get("a + b = c")) == "(a+b)=c"
+
+
+def test_cache_eviction():
+    cache = ParseCache(maxsize=2)
+    cache.get("a = 1")
+    cache.get("b = 2")
+    cache.get("a = 1")
+    cache.get("c = 3")
+    assert len(cache) == 2
+    cache.get("a = 1")
+    assert cache.hits == 2
+    cache.get("b = 2")
+    assert cache.misses == 4
@@ -1,5 +1,7 @@
-from equation_parser import Parser
-from lexer import TokenType
+import pytest
+from equation_parser import BinOp, Num, Parser, ParserException, PrattParser, UnaryOp, parse, parse_many
+from lexer import LexerException, TokenType
+from utils import structurally_equal, trace
 
 
 def test_parser():
@@ -52,3 +54,54 @@ def test_parser_parent_assignment():
     assert r.right.parent == r
     assert r.left.left.parent == r.left
     assert r.left.right.parent == r.left
+
+
+def test_parse_many():
+    equations = ["a + b = c", "x = sin(y)", "a % b", "(a + b", "ek = (m*v^2) / 2"]
+    results = parse_many(equations)
+    assert [r.string for r in results] == equations
+    assert trace(results[0].root) == trace(parse("a + b = c"))
+    assert trace(results[1].root) == trace(parse("x = sin(y)"))
+    assert trace(results[4].root) == trace(parse("ek = (m*v^2) / 2"))
+    assert results[2].root == None and isinstance(results[2].error, LexerException)
+    assert results[3].root == None and isinstance(results[3].error, ParserException)
+
+
+def test_parse_many_workers():
+    equations = [f"x = {i} * y + z" for i in range(20)]
+    results = parse_many(equations, workers=2, chunksize=4)
+    assert [trace(r.root) for r in results] == [trace(parse(e)) for e in equations]
+
+
+def test_parse_many_workers_long_chain():
+    equations = ["+".join(["a"] * 5000) + "=1", "a % b", "x = y"]
+    results = parse_many(equations, workers=2, chunksize=1)
+    assert results[0].error == None
+    assert structurally_equal(results[0].root, parse(equations[0]))
+    assert results[0].root.left.left.parent is results[0].root.left
+    assert isinstance(results[1].error, LexerException)
+    assert trace(results[2].root) == "x=y"
+
+
+def test_pratt_parser_same_trees():
+    equations = ["a + b = c", "(a + b) * c", "a-b-c*d/e^f^g = 1", "-x^2 = --y",
+                 "sin(x+2+y+x) = 1", "2^-3*(a-(b+c)) = +d", "x = y = z", "a + b c"]
+    for equation in equations:
+        assert trace(PrattParser(equation).parse()) == trace(Parser(equation).parse())
+
+
+def test_pratt_parser_invalid_syntax():
+    for equation in ["(a + b", "a + ", "sin()", "(a = b)"]:
+        with pytest.raises(ParserException):
+            PrattParser(equation).parse()
+
+
+def test_pratt_parser_deep_nesting():
+    depth = 100_000
+    node = PrattParser("-(" * depth + "x" + ")" * depth + " = 1").parse()
+    assert isinstance(node, BinOp) and node.parent == None
+    node = node.left
+    for _ in range(depth):
+        assert isinstance(node, UnaryOp) and node.op.type == TokenType.MINUS
+        node = node.expr
+    assert isinstance(node, Num) and node.value == "x"
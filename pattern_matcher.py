@@ -1,7 +1,9 @@
-from typing import Set
+from itertools import product
+from typing import Any, Callable, Dict, Hashable, List, Set
 from equation_parser import AST, BinOp, Num, UnaryOp, BinOp, Num, UnaryOp
 from lexer import Token, TokenType
-from utils import create_sym, inorder
+from profiler import profiler
+from utils import create_sym, inorder, structurally_equal
 
 
 class AnyOp(AST):
@@ -11,7 +13,7 @@ class AnyOp(AST):
     This is due to the fact that AnyOp could represent Num node, which does not have any children"""
 
     def __init__(self):
-        self.token = Token("ANY", MatcherWildcardTokenType)
+        self.token = ANY_TOKEN
         pass
 
 
@@ -19,6 +21,28 @@ class MatcherWildcardTokenType():
     pass
 
 
+class ACOp(AST):
+    """Pattern node matching a chain of commutative and associative binary
+    operations (+ or *) modulo operand order and grouping.
+    The chain is flattened into its operands (frontier), every operand
+    pattern has to match a different operand. Remaining operands are
+    captured as a list under rest name, without rest name there must be none.
+    Only supported by compiled patterns"""
+
+    def __init__(self, token_type: TokenType, operands: List[AST], rest: str | None = None, parent: AST | None = None):
+        super().__init__(parent)
+        if token_type not in AC_TOKEN_TYPES:
+            raise PatternMatcherException(
+                f"Token type {token_type} is not commutative and associative")
+        self.token = Token("AC", token_type)
+        self.operands = operands
+        self.rest = rest
+
+
+ANY_TOKEN = Token("ANY", MatcherWildcardTokenType)
+AC_TOKEN_TYPES = {TokenType.PLUS, TokenType.MUL}
+
+
 class PatternMatcherException(Exception):
     pass
 
@@ -26,15 +50,15 @@ class PatternMatcherException(Exception):
 
 
 def create_wildcard_num(parent: AST | None = None) -> Num:
-    return Num(Token("ANY", MatcherWildcardTokenType), parent)
+    return Num(ANY_TOKEN, parent)
 
 
 def create_wildcard_binop(parent: AST | None = None) -> BinOp:
-    return BinOp(None, Token("ANY", MatcherWildcardTokenType), None, parent)
+    return BinOp(None, ANY_TOKEN, None, parent)
 
 
 def create_wildcard_unary(parent: AST | None = None) -> UnaryOp:
-    return UnaryOp(None, Token("ANY", MatcherWildcardTokenType), parent)
+    return UnaryOp(None, ANY_TOKEN, parent)
 
 
 def create_compound_binop(compound_token_type: Set[TokenType], left: AST | None = None, right: AST | None = None, parent: AST | None = None) -> BinOp:
@@ -47,6 +71,16 @@ def create_compound_unary(compound_token_type: Set[TokenType], expr: AST | None
     return UnaryOp(expr, Token("COMP", compound_token_type), parent=parent)
 
 
+def create_ac_binop(token_type: TokenType, operands: List[AST], rest: str | None = None, parent: AST | None = None) -> ACOp:
+    """Creates pattern node matching + or * chains modulo operand order and grouping, see ACOp"""
+    return ACOp(token_type, operands, rest, parent)
+
+
+def create_compound_num(compound_token_type: Set[TokenType], parent: AST | None = None) -> Num:
+    """Creates compound-token-type num node, used to match multiple selected token types with match() function"""
+    return Num(Token("COMP", compound_token_type), parent)
+
+
 def match(start: AST | None, pattern: AST | None) -> bool:
     """Returns true if the pattern is matched against the start tree
     Note: this will only match types of the tokens not the values!
@@ -85,3 +119,319 @@ def match(start: AST | None, pattern: AST | None) -> bool:
 
     # base case
     return result
+
+
+# Compiled matcher, returns True if the pattern matches the node.
+# matcher.bind(node) returns the captured nodes or None if there is no match
+Matcher = Callable[[AST | None], bool]
+# Predicate on a matched node, see capture()
+Guard = Callable[[AST], bool]
+# Named captures of a single match, ACOp rest captures are lists of nodes
+Bindings = Dict[str, AST | List[AST]]
+
+
+def capture(pattern: AST, name: str | None = None, guard: Guard | None = None) -> AST:
+    """Marks the pattern node as a named capture and/or attaches a guard to it,
+    returns the pattern node.
+    Matched node is stored in the bindings under name, nodes captured
+    under the same name must be structurally equal. Guard is called with
+    the matched node and has to return True for the pattern to match.
+    Captures and guards are only honoured by compiled patterns"""
+    pattern.capture_name = name
+    pattern.guard = guard
+    return pattern
+
+
+def value_is(value: Any) -> Guard:
+    """Guard matching nodes with given token value"""
+    return lambda node: node.token.value == value
+
+
+def chain_top(node: AST) -> bool:
+    """Guard matching operations which are not operands of the same
+    operation, ACOp patterns with it only match whole chains, not each of
+    their subchains again"""
+    parent = node.parent
+    return not (isinstance(parent, BinOp) and parent.token.type == node.token.type)
+
+
+def _compile_token_check(pattern: AST) -> Callable[[AST, Bindings], bool] | None:
+    token_type = pattern.token.type
+    if token_type == MatcherWildcardTokenType:
+        return None
+    elif isinstance(token_type, set):
+        token_types = frozenset(token_type)
+        return lambda node, bindings: node.token.type in token_types
+    elif isinstance(token_type, TokenType):
+        return lambda node, bindings: node.token.type == token_type
+    raise PatternMatcherException(
+        f"Invalid pattern token type {type(token_type)}")
+
+
+def _compile_capture_check(pattern: AST) -> Callable[[AST, Bindings], bool] | None:
+    name = getattr(pattern, "capture_name", None)
+    if name == None:
+        return None
+
+    def check(node: AST, bindings: Bindings) -> bool:
+        captured = bindings.get(name, None)
+        if captured == None:
+            bindings[name] = node
+            return True
+        return structurally_equal(captured, node)
+    return check
+
+
+def frontier(node: AST) -> List[AST]:
+    """Returns operands of the chain of same binary operations starting at node,
+    in inorder. For (a+b)+(c-d) that is a, b, c-d"""
+    token_type = node.token.type
+    result = []
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if isinstance(n, BinOp) and n.token.type == token_type:
+            stack.append(n.right)
+            stack.append(n.left)
+        else:
+            result.append(n)
+    return result
+
+
+def _compile_ac(pattern: ACOp) -> Callable[[AST | None, Bindings], bool]:
+    token_type = pattern.token.type
+    operands = tuple(_compile(operand) for operand in pattern.operands)
+    rest = pattern.rest
+    count = len(operands)
+    capture_check = _compile_capture_check(pattern)
+    guard = getattr(pattern, "guard", None)
+
+    def match_node(node: AST | None, bindings: Bindings) -> bool:
+        if not isinstance(node, BinOp) or node.token.type != token_type:
+            return False
+        # guard only sees the node, it is checked before the chain is walked
+        if guard != None and not guard(node):
+            return False
+        nodes = frontier(node)
+        if len(nodes) < count or (rest == None and len(nodes) != count):
+            return False
+        used = [False] * len(nodes)
+        # Backtracking over assignments of operand patterns to chain operands,
+        # stack holds (operand index, next candidate, bindings before operand)
+        stack = [(0, 0, bindings)]
+        while stack:
+            i, start, before = stack.pop()
+            if i == count:
+                if rest != None:
+                    before[rest] = [n for n, u in zip(nodes, used) if not u]
+                if capture_check != None and not capture_check(node, before):
+                    continue
+                if before is not bindings:
+                    bindings.clear()
+                    bindings.update(before)
+                return True
+            if start > 0:
+                used[start - 1] = False  # backtrack previous candidate
+            for j in range(start, len(nodes)):
+                if used[j]:
+                    continue
+                attempt = dict(before)
+                if operands[i](nodes[j], attempt):
+                    used[j] = True
+                    stack.append((i, j + 1, before))
+                    stack.append((i + 1, 0, attempt))
+                    break
+        return False
+    return match_node
+
+
+def _compile(pattern: AST) -> Callable[[AST | None, Bindings], bool]:
+    if isinstance(pattern, ACOp):
+        return _compile_ac(pattern)
+    checks = []
+    if isinstance(pattern, AnyOp):
+        node_type = AST  # only checks the node existance
+    elif isinstance(pattern, BinOp):
+        node_type = BinOp
+    elif isinstance(pattern, UnaryOp):
+        node_type = UnaryOp
+    elif isinstance(pattern, Num):
+        node_type = Num
+    else:
+        raise PatternMatcherException(
+            f"Invalid pattern node type {type(pattern)}")
+
+    if not isinstance(pattern, AnyOp):
+        check_token = _compile_token_check(pattern)
+        if check_token != None:
+            checks.append(check_token)
+    if isinstance(pattern, BinOp):
+        if pattern.left != None:  # if none -> dont care about left subtree
+            left = _compile(pattern.left)
+            checks.append(lambda node, bindings: left(node.left, bindings))
+        if pattern.right != None:  # if none -> dont care about right subtree
+            right = _compile(pattern.right)
+            checks.append(lambda node, bindings: right(node.right, bindings))
+    elif isinstance(pattern, UnaryOp):
+        if pattern.expr != None:
+            expr = _compile(pattern.expr)
+            checks.append(lambda node, bindings: expr(node.expr, bindings))
+
+    guard = getattr(pattern, "guard", None)
+    if guard != None:
+        checks.append(lambda node, bindings: guard(node))
+    check_capture = _compile_capture_check(pattern)
+    if check_capture != None:
+        checks.append(check_capture)
+
+    checks = tuple(checks)
+
+    def match_node(node: AST | None, bindings: Bindings) -> bool:
+        if not isinstance(node, node_type):
+            return False
+        for check in checks:
+            if not check(node, bindings):
+                return False
+        return True
+    return match_node
+
+
+def compile_pattern(pattern: AST) -> Matcher:
+    """Turns pattern tree into a reusable matcher function, equivalent to
+    calling match(node, pattern), but without walking the pattern tree and
+    dispatching on its node types on every call.
+    Compile patterns once (at import time) and reuse the matchers.
+    Captures of an attempt go into one dict per matcher, emptied again before
+    the call returns, bind() hands out a copy of it. A matcher is therefore
+    not reentrant: do not call it from its own guards, nor from several
+    threads at once (the solver runs on a single thread)"""
+    match_node = _compile(pattern)
+    scratch: Bindings = {}
+    clear = scratch.clear
+
+    # matches are reported to the profiler, to tell them apart from fires
+    def matcher(node: AST | None) -> bool:
+        try:
+            matched = match_node(node, scratch)
+        finally:
+            clear()
+        if matched and profiler.enabled:
+            profiler.matched = True
+        return matched
+
+    def bind(node: AST | None) -> Bindings | None:
+        try:
+            if not match_node(node, scratch):
+                return None
+            bindings = dict(scratch)
+        finally:
+            clear()
+        if profiler.enabled:
+            profiler.matched = True
+        return bindings
+
+    matcher.pattern = pattern
+    matcher.bind = bind
+    return matcher
+
+
+class DiscriminationNet:
+    """Index of rule patterns, which returns the rules that can possibly
+    fire on a node with a single walk over the node's neighbourhood
+
+    Patterns are stored in a trie keyed by their preorder sequence of
+    (node class, token type) pairs. Wildcards (AnyOp and missing children)
+    become STAR edges, which skip a whole subtree of the queried node.
+    Candidates are a superset of the rules whose patterns match, the rules
+    still have to run their own checks."""
+
+    STAR = "*"
+    WILDCARD_TYPE = MatcherWildcardTokenType
+    RULES = None  # key holding the rules of a completed pattern
+
+    def __init__(self):
+        self.trie = {}
+        # rules without a pattern are candidates for every node
+        self.unindexed = []
+
+    def _keys(self, pattern: AST | None) -> List[List[Hashable]]:
+        """Returns all preorder key sequences described by the pattern,
+        compound token types produce one sequence per member"""
+        if pattern == None or isinstance(pattern, AnyOp):
+            return [[self.STAR]]
+        token_type = pattern.token.type
+        if isinstance(token_type, set):
+            token_types = sorted(token_type, key=lambda t: t.value)
+        else:
+            token_types = [token_type]
+        if isinstance(pattern, ACOp):
+            # operands may be anywhere in the chain
+            node_type = BinOp
+            children = [[[self.STAR]], [[self.STAR]]]
+        elif isinstance(pattern, BinOp):
+            node_type = BinOp
+            children = [self._keys(pattern.left), self._keys(pattern.right)]
+        elif isinstance(pattern, UnaryOp):
+            node_type = UnaryOp
+            children = [self._keys(pattern.expr)]
+        elif isinstance(pattern, Num):
+            node_type = Num
+            children = []
+        else:
+            raise PatternMatcherException(
+                f"Invalid pattern node type {type(pattern)}")
+        result = []
+        for token_type in token_types:
+            for child_keys in product(*children):
+                keys = [(node_type, token_type)]
+                for k in child_keys:
+                    keys.extend(k)
+                result.append(keys)
+        return result
+
+    def insert(self, pattern: AST | None, rule: Callable):
+        """Registers rule under pattern, rule may be registered with many patterns.
+        Registering with None pattern makes the rule a candidate for all nodes"""
+        if pattern == None:
+            self.unindexed.append(rule)
+            return
+        for keys in self._keys(pattern):
+            trie = self.trie
+            for key in keys:
+                trie = trie.setdefault(key, {})
+            rules = trie.setdefault(self.RULES, [])
+            if rule not in rules:
+                rules.append(rule)
+
+    def candidates(self, node: AST) -> Set[Callable]:
+        """Returns rules whose patterns may match the node"""
+        STAR, RULES, WILDCARD_TYPE = self.STAR, self.RULES, self.WILDCARD_TYPE
+        result = set(self.unindexed)
+        # (trie node, pending subtrees of the queried node as a linked list)
+        stack = [(self.trie, (node, None))]
+        while stack:
+            trie, pending = stack.pop()
+            if pending == None:
+                result.update(trie[RULES])
+                continue
+            term, rest = pending
+            if STAR in trie:
+                stack.append((trie[STAR], rest))
+            if isinstance(term, BinOp):
+                node_type = BinOp
+                pending = (term.left, (term.right, rest))
+            elif isinstance(term, UnaryOp):
+                node_type = UnaryOp
+                pending = (term.expr, rest)
+            elif isinstance(term, Num):
+                node_type = Num
+                pending = rest
+            else:
+                continue
+            child = trie.get((node_type, term.token.type), None)
+            if child != None:
+                stack.append((child, pending))
+            child = trie.get((node_type, WILDCARD_TYPE), None)
+            if child != None:
+                stack.append((child, pending))
+        return result
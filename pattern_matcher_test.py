@@ -1,5 +1,6 @@
 from lexer import TokenType
-from pattern_matcher import AnyOp, create_compound_binop, match
+from pattern_matcher import AnyOp, DiscriminationNet, capture, chain_top, compile_pattern, create_ac_binop, create_compound_binop, frontier, match, value_is
+from utils import create_func_unary, create_minus_unary, create_mul_op, create_num, create_sym
 from equation_parser import Parser
 
 
@@ -26,3 +27,122 @@ def test_non_trivial_match():
     #Matches: U +- V +- Z
     tree = Parser("(x+1)+1-x").parse()
     assert True == match(tree, pattern)
+
+
+def test_compiled_pattern_matches_like_match():
+    patterns = [
+        Parser("x=1").parse(),
+        create_compound_binop({TokenType.PLUS, TokenType.MINUS}, left=AnyOp(), right=AnyOp()),
+        create_compound_binop({TokenType.PLUS, TokenType.MINUS},
+                              left=create_compound_binop(
+                                  {TokenType.PLUS, TokenType.MINUS}, left=AnyOp(), right=AnyOp()),
+                              right=AnyOp()),
+        create_compound_binop({TokenType.MUL}, left=create_num(), right=create_minus_unary(AnyOp())),
+        create_func_unary(create_num(), "sin"),
+        create_sym(),
+    ]
+    trees = ["x=1", "x+1", "x-1", "(x+1)+1-x", "2*-x", "2*x", "sin(2)", "sin(x)", "x", "1"]
+    for pattern in patterns:
+        matcher = compile_pattern(pattern)
+        for tree in trees:
+            node = Parser(tree).parse()
+            assert matcher(node) == match(node, pattern)
+    assert compile_pattern(AnyOp())(None) == False
+
+
+def test_discrimination_net_candidates():
+    patterns = {
+        "add_any": create_compound_binop({TokenType.PLUS, TokenType.MINUS}, left=AnyOp(), right=AnyOp()),
+        "mul_neg": create_compound_binop({TokenType.MUL}, left=create_num(), right=create_minus_unary(AnyOp())),
+        "sin_num": create_func_unary(create_num(), "sin"),
+        "sym": create_sym(),
+    }
+    net = DiscriminationNet()
+    for name, pattern in patterns.items():
+        net.insert(pattern, name)
+    net.insert(None, "always")
+    trees = ["x=1", "x+1", "x-1", "(x+1)+1-x", "2*-x", "-2*x", "2*x", "sin(2)", "sin(x)", "x", "1"]
+    for tree in trees:
+        node = Parser(tree).parse()
+        expected = {name for name, pattern in patterns.items() if match(node, pattern)}
+        assert net.candidates(node) == expected | {"always"}
+
+
+def test_compiled_pattern_bindings():
+    pattern = compile_pattern(create_compound_binop({TokenType.PLUS, TokenType.MINUS},
+                                                    left=capture(create_sym(), "X"),
+                                                    right=create_mul_op(left=capture(create_num(), "n"),
+                                                                        right=capture(create_sym(), "X"))))
+    bindings = pattern.bind(Parser("y+2*y").parse())
+    assert bindings["X"].value == "y"
+    assert bindings["n"].value == 2
+    # same name captures must be equal
+    assert pattern.bind(Parser("y+2*x").parse()) == None
+    assert pattern(Parser("y-2*y").parse()) == True
+    assert pattern(Parser("y-2*x").parse()) == False
+
+
+def test_compiled_pattern_guards():
+    pattern = compile_pattern(create_mul_op(left=capture(create_num(), guard=value_is(1)),
+                                            right=capture(AnyOp(), "x")))
+    tree = Parser("1*(x+y)").parse()
+    assert pattern.bind(tree) == {"x": tree.right}
+    assert pattern.bind(Parser("2*(x+y)").parse()) == None
+
+
+def test_frontier():
+    tree = Parser("(a+b)+(c-d)+e*f").parse()
+    assert [n.token.value for n in frontier(tree)] == ["a", "b", "-", "*"]
+
+
+def test_ac_pattern_order_and_grouping():
+    pattern = compile_pattern(create_ac_binop(TokenType.PLUS, [capture(create_num(), "n"),
+                                                               capture(create_sym(), "X"),
+                                                               capture(create_sym(), "X")]))
+    for tree in ["x+x+2", "2+x+x", "x+(2+x)", "(x+2)+x"]:
+        bindings = pattern.bind(Parser(tree).parse())
+        assert bindings["n"].value == 2
+        assert bindings["X"].value == "x"
+    assert pattern(Parser("x+y+2").parse()) == False
+    assert pattern(Parser("x+x+2+3").parse()) == False  # no rest capture
+    assert pattern(Parser("x*x*2").parse()) == False
+
+
+def test_ac_pattern_rest():
+    pattern = compile_pattern(create_ac_binop(TokenType.MUL, [capture(create_num(), "one", value_is(1))],
+                                              rest="rest"))
+    bindings = pattern.bind(Parser("x*(2*1)*y").parse())
+    assert bindings["one"].value == 1
+    assert [n.value for n in bindings["rest"]] == ["x", 2, "y"]
+    assert pattern(Parser("x*2").parse()) == False
+
+    net = DiscriminationNet()
+    net.insert(pattern.pattern, "one")
+    assert net.candidates(Parser("x*(2*1)").parse()) == {"one"}
+    assert net.candidates(Parser("x+1").parse()) == set()
+
+
+def test_bind_returns_own_bindings():
+    pattern = compile_pattern(create_mul_op(capture(create_num(), "n"), capture(create_sym(), "X")))
+    first = pattern.bind(Parser("2*x").parse())
+    assert pattern.bind(Parser("x*2").parse()) == None
+    second = pattern.bind(Parser("3*y").parse())
+    assert first["n"].value == 2 and first["X"].value == "x"
+    assert second["n"].value == 3 and second["X"].value == "y"
+
+
+def test_ac_pattern_chain_top():
+    pattern = compile_pattern(capture(create_ac_binop(TokenType.MUL, [capture(create_num(), "n")], rest="rest"),
+                                      guard=chain_top))
+    tree = Parser("x*2*y").parse()
+    assert pattern(tree) == True
+    assert pattern(tree.left) == False  # x*2 is inside the chain
+
+
+def test_compiled_matcher_leaves_no_bindings_behind():
+    pattern = compile_pattern(create_compound_binop(TokenType.PLUS, capture(AnyOp(), "a"), capture(AnyOp(), "a")))
+    x_plus_x = Parser("x+x").parse()
+    assert pattern.bind(x_plus_x) == {"a": x_plus_x.left}
+    # a stale "a" would make the second call compare against the first x
+    assert pattern.bind(Parser("y+y").parse()) != None
+    assert pattern(Parser("x+y").parse()) == False
@@ -0,0 +1,213 @@
+from typing import Dict, List, Tuple
+from equation_parser import AST, BinOp, Num, UnaryOp
+from lexer import TokenType
+from numeric import get_backend
+from utils import create_minus_op, create_minus_unary, create_mul_op, create_num, create_plus_op, create_pow_op, create_sym, replace, structurally_equal
+
+# Sparse multivariate polynomials. A monomial is a tuple of (symbol, exponent)
+# pairs sorted by symbol, the polynomial maps monomials to coefficients:
+# 3*x^2*y - 1 is {(("x", 2), ("y", 1)): 3, (): -1}
+Monomial = Tuple[Tuple[str, int], ...]
+Polynomial = Dict[Monomial, int | float]
+
+# Larger powers of sums are not expanded, (x+1)^20 would blow up the tree
+MAX_EXPANDED_POWER = 8
+# Larger powers of coefficients are not folded, 3^1000000000 has too many digits
+MAX_FOLDED_POWER = 256
+
+
+class PolynomialException(Exception):
+    pass
+
+
+def constant(value: int | float) -> Polynomial:
+    return {(): value} if value != 0 else {}
+
+
+def symbol(name: str) -> Polynomial:
+    return {((name, 1),): 1}
+
+
+def add(p: Polynomial, q: Polynomial, sign: int = 1) -> Polynomial:
+    """Returns p + sign * q"""
+    backend = get_backend()
+    combine = backend.add if sign > 0 else backend.sub
+    result = dict(p)
+    for monomial, coefficient in q.items():
+        value = combine(result.get(monomial, 0), coefficient)
+        if value == 0:
+            result.pop(monomial, None)
+        else:
+            result[monomial] = value
+    return result
+
+
+def _mul_monomials(a: Monomial, b: Monomial) -> Monomial:
+    exponents = dict(a)
+    for name, exponent in b:
+        exponents[name] = exponents.get(name, 0) + exponent
+    return tuple(sorted(exponents.items()))
+
+
+def mul(p: Polynomial, q: Polynomial) -> Polynomial:
+    backend = get_backend()
+    result = {}
+    for a, x in p.items():
+        for b, y in q.items():
+            monomial = _mul_monomials(a, b)
+            value = backend.add(result.get(monomial, 0), backend.mul(x, y))
+            if value == 0:
+                result.pop(monomial, None)
+            else:
+                result[monomial] = value
+    return result
+
+
+def power(p: Polynomial, exponent: int) -> Polynomial:
+    if exponent == 0:
+        return constant(1)
+    if len(p) <= 1:
+        # zero or a single term: symbol exponents are multiplied and the
+        # coefficient folded once, instead of multiplying exponent times
+        return {tuple((name, e * exponent) for name, e in monomial): get_backend().pow(coefficient, exponent)
+                for monomial, coefficient in p.items()}
+    result = constant(1)
+    for _ in range(exponent):
+        result = mul(result, p)
+    return result
+
+
+def _constant_value(p: Polynomial) -> int | float | None:
+    """Returns value of a constant polynomial, None if it is not constant"""
+    if len(p) == 0:
+        return 0
+    if len(p) == 1 and () in p:
+        return p[()]
+    return None
+
+
+def _from_node(node: AST, children: List[Polynomial | None]) -> Polynomial | None:
+    """Polynomial of a node given the polynomials of its children, None if
+    the node is not a polynomial"""
+    if isinstance(node, Num):
+        if node.token.type == TokenType.NUM:
+            return constant(node.value)
+        if node.token.type == TokenType.SYM:
+            return symbol(node.value)
+        return None
+    if None in children:
+        return None
+    if isinstance(node, UnaryOp):
+        if node.token.type == TokenType.MINUS:
+            return add({}, children[0], -1)
+        return None  # functions
+    left, right = children
+    token_type = node.token.type
+    if token_type == TokenType.PLUS:
+        return add(left, right)
+    elif token_type == TokenType.MINUS:
+        return add(left, right, -1)
+    elif token_type == TokenType.MUL:
+        return mul(left, right)
+    elif token_type == TokenType.DIV:
+        divisor = _constant_value(right)
+        if divisor == None or divisor == 0:
+            return None
+        div = get_backend().div
+        return {m: div(c, divisor) for m, c in left.items()}
+    elif token_type == TokenType.POW:
+        exponent = _constant_value(right)
+        if (exponent == None or exponent < 0 or exponent != int(exponent)
+                or (len(left) > 1 and exponent > MAX_EXPANDED_POWER)
+                or (exponent > MAX_FOLDED_POWER and any(abs(c) != 1 for c in left.values()))):
+            return None
+        return power(left, int(exponent))
+    return None
+
+
+def _polynomials(root: AST) -> Dict[AST, Polynomial | None]:
+    """Computes polynomials of all subtrees in a single postorder pass"""
+    result = {}
+    stack = [(root, False)]
+    while stack:
+        node, visited = stack.pop()
+        if isinstance(node, BinOp):
+            children = [node.left, node.right]
+        elif isinstance(node, UnaryOp):
+            children = [node.expr]
+        else:
+            children = []
+        if visited or len(children) == 0:
+            result[node] = _from_node(node, [result[c] for c in children])
+            continue
+        stack.append((node, True))
+        for child in reversed(children):
+            stack.append((child, False))
+    return result
+
+
+def from_ast(root: AST) -> Polynomial:
+    """Converts expression tree into a polynomial, raises PolynomialException
+    if the expression is not a polynomial"""
+    result = _polynomials(root)[root]
+    if result == None:
+        raise PolynomialException("Expression is not a polynomial")
+    return result
+
+
+def _monomial_key(item: Tuple[Monomial, int | float]):
+    # higher degree first, then by symbols: x^2+x*y+y+1
+    monomial, _ = item
+    return (-sum(e for _, e in monomial), [(name, -e) for name, e in monomial])
+
+
+def to_ast(p: Polynomial) -> AST:
+    """Converts polynomial into expression tree: sum of coefficient*x^a*y^b... terms"""
+    result = None
+    for monomial, coefficient in sorted(p.items(), key=_monomial_key):
+        term = None
+        for name, exponent in monomial:
+            factor = create_sym(name)
+            if exponent != 1:
+                factor = create_pow_op(factor, create_num(exponent))
+            term = factor if term == None else create_mul_op(term, factor)
+        magnitude = abs(coefficient)
+        if term == None:
+            term = create_num(magnitude)
+        elif magnitude != 1:
+            term = create_mul_op(create_num(magnitude), term)
+        if result == None:
+            result = term if coefficient > 0 else create_minus_unary(term)
+        elif coefficient > 0:
+            result = create_plus_op(result, term)
+        else:
+            result = create_minus_op(result, term)
+    if result == None:
+        return create_num(0)
+    return result
+
+
+def collect_polynomials(root: AST) -> bool:
+    """Replaces every maximal polynomial subexpression with its collected
+    form, returns True if the tree changed.
+    All subtrees are converted in one pass, instead of sweeping local
+    collection rules until nothing changes"""
+    polynomials = _polynomials(root)
+    changed = False
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        p = polynomials[node]
+        # the root has no parent to be replaced in
+        if p != None and node.parent != None:
+            collected = to_ast(p)
+            if not structurally_equal(collected, node):
+                replace(node, collected)
+                changed = True
+            continue
+        if isinstance(node, BinOp):
+            stack.append(node.right)
+            stack.append(node.left)
+        elif isinstance(node, UnaryOp):
+            stack.append(node.expr)
+    return changed
@@ -0,0 +1,52 @@
+import pytest
+from equation_parser import parse
+from numeric import use_backend
+from polynomial import PolynomialException, collect_polynomials, from_ast, to_ast
+from utils import trace
+
+
+def test_from_ast():
+    assert from_ast(parse("3*x^2*y - 1 + y*x^2")) == {(("x", 2), ("y", 1)): 4, (): -1}
+    assert from_ast(parse("(x+1)^2")) == {(("x", 2),): 1, (("x", 1),): 2, (): 1}
+    assert from_ast(parse("x-x")) == {}
+
+
+def test_from_ast_not_polynomial():
+    for expression in ["sin(x)", "1/x", "x^y", "x^-1"]:
+        with pytest.raises(PolynomialException):
+            from_ast(parse(expression))
+
+
+def test_to_ast():
+    assert trace(to_ast(from_ast(parse("1 + y + x*y + x^2")))) == "(((x^2)+(x*y))+y)+1"
+    assert trace(to_ast(from_ast(parse("-x-x"))).expr) == "2*x"
+    assert to_ast({}).value == 0
+
+
+def test_collect_polynomials():
+    r = parse("x+2+x = y*3*y")
+    assert collect_polynomials(r) == True
+    assert trace(r) == "((2*x)+2)=(3*(y^2))"
+
+    r = parse("sin(x^2*x^3+3*x-x*2) = 1/(y-y+x)")
+    collect_polynomials(r)
+    assert trace(r) == "sin(((x^5)+x))=(1/x)"
+
+    r = parse("a+b=c")
+    assert collect_polynomials(r) == False
+
+
+def test_from_ast_large_powers():
+    # single terms are raised without repeated multiplication
+    assert from_ast(parse("x^1000000000*y")) == {(("x", 1000000000), ("y", 1)): 1}
+    assert from_ast(parse("(2*x)^3")) == {(("x", 3),): 8}
+    assert from_ast(parse("(x-x)^0")) == {(): 1}
+    with pytest.raises(PolynomialException):
+        from_ast(parse("3^1000000000"))
+
+
+def test_from_ast_backend_division():
+    with use_backend("exact"):
+        p = from_ast(parse("x/3 + x/3*2"))
+    assert p == {(("x", 1),): 1}
+    assert type(p[(("x", 1),)]) is int
@@ -1,52 +1,44 @@
 from copy import copy
 from equation_parser import AST, BinOp, UnaryOp, parse
 from lexer import TokenType
-from pattern_matcher import AnyOp, create_compound_unary, match
+from pattern_matcher import AnyOp, capture, chain_top, compile_pattern, create_ac_binop, create_compound_unary, value_is
 from utils import create_minus_op, create_minus_unary, create_mul_op, create_num, create_plus_op, create_pow_op, create_sym, inorder, replace, trace
+from rewrite import rewrite, stage_cache
 
 
 class PreprocessingException(Exception):
     pass
 
 
+# Search patterns, compiled once
+# 1 anywhere in a chain of multiplications
+one_mul_pattern = compile_pattern(capture(create_ac_binop(
+    TokenType.MUL, [capture(create_num(1), "one", value_is(1))], rest="rest"), guard=chain_top))
+pow_one_pattern = compile_pattern(create_pow_op(
+    left=capture(AnyOp(), "x"),
+    right=capture(create_num(1), guard=value_is(1))))
+
+
 def postprocess_trivial_mul(start_node: AST):
-    if not isinstance(start_node, BinOp):
-        return False  # there is no unary or num mul
-
-    pattern_right = create_mul_op(left=create_num(1), right=AnyOp())
-    pattern_left = create_mul_op(left=AnyOp(), right=create_num(1))
-    replacement = None
-
-    if match(start_node, pattern_right):
-        replacement = start_node.right
-        if start_node.left.value != 1:
-            return False
-    elif match(start_node, pattern_left):
-        replacement = start_node.left
-        if start_node.right.value != 1:
-            return False
-    else:
+    """1*x -> x, x*1 -> x, also for 1 nested in a chain of multiplications"""
+    bindings = one_mul_pattern.bind(start_node)
+    if bindings == None:
         return False
 
-    replace(start_node, replacement)
+    # drop the multiplication which has the 1 as operand
+    one = bindings["one"]
+    op = one.parent
+    replace(op, op.right if op.left == one else op.left)
     return True
 
 
 def postprocess_trivial_power(start_node: AST):
-    if not isinstance(start_node, BinOp):
-        return False  # there is no unary or num mul
-
-    pattern = create_pow_op(left=AnyOp(), right=create_num(1))
-    replacement = None
-
-    if match(start_node, pattern):
-        replacement = start_node.left
-        if start_node.right.value != 1:
-            return False
-    else:
+    """x^1 -> x"""
+    bindings = pow_one_pattern.bind(start_node)
+    if bindings == None:
         return False
 
-    replace(start_node, replacement)
+    replace(start_node, bindings["x"])
     return True
 
 
@@ -54,10 +46,4 @@ def postprocess(root: AST):
     """Applies post processing of the expression tree, things like 1*, ^1 excessive - signs will be removed since they do not affect the 
     overall equation"""
     collection_functions = [postprocess_trivial_mul, postprocess_trivial_power]
-    rerun = True
-    while rerun:
-        rerun = False
-        for f in collection_functions:
-            tree_inord = inorder(root)
-            for node in tree_inord:
-                rerun |= f(node)
+    rewrite(root, collection_functions, cache=stage_cache, name="postprocess")
@@ -1,8 +1,8 @@
-from copy import copy
 from equation_parser import AST, BinOp, UnaryOp, parse
 from lexer import TokenType
-from pattern_matcher import AnyOp, create_compound_unary, match
-from utils import create_minus_op, create_minus_unary, create_mul_op, create_num, create_plus_op, create_pow_op, create_sym, inorder, replace, trace
+from pattern_matcher import AnyOp, capture, compile_pattern, create_compound_unary
+from utils import copy_tree, create_minus_op, create_minus_unary, create_mul_op, create_num, create_plus_op, create_pow_op, create_sym, inorder, replace, trace
+from rewrite import rewrite, stage_cache
 
 # Each found symbol must adhere to the following structure
 #     *
@@ -16,20 +16,33 @@ class PreprocessingException(Exception):
     pass
 
 
+# Search patterns, compiled once
+plus_unary_minus_pattern = compile_pattern(create_plus_op(
+    left=capture(AnyOp(), "a"),
+    right=create_minus_unary(expr=capture(AnyOp(), "b"))))
+unary_minus_plus_pattern = compile_pattern(create_plus_op(
+    left=create_minus_unary(expr=capture(AnyOp(), "a")),
+    right=capture(AnyOp(), "b")))
+minus_unary_minus_pattern = compile_pattern(create_minus_op(
+    left=capture(AnyOp(), "a"),
+    right=create_minus_unary(expr=capture(AnyOp(), "b"))))
+sym_pow_num_pattern = compile_pattern(create_pow_op(
+    left=create_sym(),
+    right=create_num()))
+sym_pattern = compile_pattern(create_sym())
+
+
 def preprocess_plus_unary_minus(start_node: AST):
     """Changes occurences of unary minus and plus into binary minus"""
     # Find any +-
-    pattern = create_plus_op(
-        left=AnyOp(),
-        right=create_minus_unary(expr=AnyOp()))
-
-    if not match(start_node, pattern):
+    bindings = plus_unary_minus_pattern.bind(start_node)
+    if bindings == None:
         return False
 
     # Turn +- into binary -
     new_op = create_minus_op(
-        left=start_node.left,
-        right=start_node.right.expr,
+        left=bindings["a"],
+        right=bindings["b"],
         parent=start_node.parent)
     # Replace OP
     replace(start_node, new_op)
@@ -37,19 +50,16 @@ def preprocess_plus_unary_minus(start_node: AST):
 
 def preprocess_unary_minus_plus(start_node: AST):
     """Changes occurences of unary minus and plus into binary minus"""
-    # Find any +-
-    pattern = create_plus_op(
-        left=create_minus_unary(expr=AnyOp()),
-        right=AnyOp())
-
-    if not match(start_node, pattern):
+    # Find any -+
+    bindings = unary_minus_plus_pattern.bind(start_node)
+    if bindings == None:
         return False
 
     # Turn +- into binary -
     # and switch sides
     new_op = create_minus_op(
-        left=start_node.right,
-        right=start_node.left.expr,
+        left=bindings["b"],
+        right=bindings["a"],
         parent=start_node.parent)
     # Replace OP
     replace(start_node, new_op)
@@ -59,18 +69,14 @@ def preprocess_unary_minus_plus(start_node: AST):
 
 def preprocess_minus_unary_minus(start_node: AST):
     """Changes occurences of unary minus and plus into binary minus"""
-    pattern = create_minus_op(
-        left=AnyOp(),
-        right=create_minus_unary(expr=AnyOp())
-    )
-
-    if not match(start_node, pattern):
+    bindings = minus_unary_minus_pattern.bind(start_node)
+    if bindings == None:
         return False
 
     #turn -- into binary + 
     new_op = create_plus_op(
-        left=start_node.left,
-        right=start_node.right.expr,
+        left=bindings["a"],
+        right=bindings["b"],
         parent=start_node.parent)
     # Replace OP
     replace(start_node, new_op)
@@ -80,11 +86,7 @@ def preprocess_symbols_without_multiplication(start_node: AST):
     """Preprocesses symbol nodes that are not being multiplied
     so that they will be transformed into 1*x"""
 
-    pattern = create_pow_op(
-        left=create_sym(),
-        right=create_num())
-
-    if not match(start_node, pattern):
+    if not sym_pow_num_pattern(start_node):
         return False
 
     if start_node.parent == None:
@@ -96,7 +98,7 @@ def preprocess_symbols_without_multiplication(start_node: AST):
     # inject 1* op
     new_op = create_mul_op(
         left=create_num(1),
-        right=copy(start_node),
+        right=copy_tree(start_node),
         parent=start_node.parent)
 
     replace(start_node, new_op)
@@ -104,9 +106,7 @@ def preprocess_symbols_without_multiplication(start_node: AST):
 
 
 def preprocess_symbols_without_power(start_node: AST):
-    pattern = create_sym()
-
-    if not match(start_node, pattern):
+    if not sym_pattern(start_node):
         return False
 
     if start_node.parent == None:
@@ -117,7 +117,7 @@ def preprocess_symbols_without_power(start_node: AST):
 
     # inject ^1 op
     new_op = create_pow_op(
-        left=copy(start_node),
+        left=copy_tree(start_node),
         right=create_num(1),
         parent=start_node.parent)
 
@@ -131,10 +131,4 @@ def preprocess(root: AST):
     collection_functions = [preprocess_plus_unary_minus,
                             preprocess_symbols_without_power, preprocess_symbols_without_multiplication, preprocess_minus_unary_minus,preprocess_unary_minus_plus]
                         
-    rerun = True
-    while rerun:
-        rerun = False
-        for f in collection_functions:
-            tree_inord = inorder(root)
-            for node in tree_inord:
-                rerun |= f(node)
+    rewrite(root, collection_functions, cache=stage_cache, name="preprocess")
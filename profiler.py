@@ -0,0 +1,106 @@
+import json
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Iterator
+
+
+class RuleProfile:
+    """Counters of a single rewrite rule"""
+
+    def __init__(self):
+        self.attempts = 0  # rule calls
+        self.matches = 0  # calls in which a pattern of the rule matched
+        self.fires = 0  # calls that changed the tree
+        self.seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {"attempts": self.attempts, "matches": self.matches,
+                "fires": self.fires, "seconds": self.seconds}
+
+
+class StageProfile:
+    """Counters of a named rewrite stage (attract, preprocess, ...)"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.passes = 0  # fixpoint passes
+        self.visits = 0
+        self.nodes_in = 0  # tree sizes before and after the stage
+        self.nodes_out = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {"calls": self.calls, "cache_hits": self.cache_hits, "passes": self.passes,
+                "visits": self.visits, "nodes_in": self.nodes_in,
+                "nodes_out": self.nodes_out, "seconds": self.seconds}
+
+
+class Profiler:
+    """Opt-in instrumentation of the rewrite stages
+
+    While disabled, rewrite() checks a single flag per call and rules run
+    unwrapped. Enabled, every rule call is timed and counted, compiled
+    patterns report their matches to the rule being run."""
+
+    def __init__(self):
+        self.enabled = False
+        self.matched = False  # set by compiled patterns during a rule call
+        self.rules: Dict[str, RuleProfile] = {}
+        self.stages: Dict[str, StageProfile] = {}
+
+    def reset(self):
+        self.rules.clear()
+        self.stages.clear()
+
+    def rule(self, rule: Callable) -> RuleProfile:
+        name = f"{rule.__module__}.{rule.__name__}"
+        entry = self.rules.get(name, None)
+        if entry == None:
+            entry = self.rules[name] = RuleProfile()
+        return entry
+
+    def stage(self, name: str) -> StageProfile:
+        entry = self.stages.get(name, None)
+        if entry == None:
+            entry = self.stages[name] = StageProfile()
+        return entry
+
+    def wrap(self, rule: Callable) -> Callable:
+        """Returns rule which records its calls"""
+        entry = self.rule(rule)
+
+        def profiled(node) -> bool:
+            self.matched = False
+            start = perf_counter()
+            fired = rule(node)
+            entry.seconds += perf_counter() - start
+            entry.attempts += 1
+            if fired:
+                entry.fires += 1
+            if fired or self.matched:
+                entry.matches += 1
+            return fired
+        return profiled
+
+    def report(self) -> dict:
+        return {"rules": {name: entry.as_dict() for name, entry in self.rules.items()},
+                "stages": {name: entry.as_dict() for name, entry in self.stages.items()}}
+
+    def to_json(self, indent: int | None = 2) -> str:
+        return json.dumps(self.report(), indent=indent)
+
+
+# Process wide profiler used by rewrite() and compiled patterns
+profiler = Profiler()
+
+
+@contextmanager
+def profile() -> Iterator[Profiler]:
+    """Enables the profiler with fresh counters for the duration of the with block"""
+    profiler.reset()
+    profiler.enabled = True
+    try:
+        yield profiler
+    finally:
+        profiler.enabled = False
@@ -0,0 +1,28 @@
+import json
+from equation_parser import parse
+from postprocessing import postprocess_trivial_mul, postprocess_trivial_power
+from profiler import profile, profiler
+from rewrite import rewrite
+
+
+def test_profile_rules_and_stages():
+    with profile() as p:
+        rewrite(parse("1*(1*x^1)^1 = y"), [postprocess_trivial_mul, postprocess_trivial_power], name="post")
+    report = p.report()
+    mul = report["rules"]["postprocessing.postprocess_trivial_mul"]
+    assert mul["fires"] == 2
+    assert mul["matches"] >= mul["fires"]
+    assert mul["attempts"] > mul["matches"]
+    stage = report["stages"]["post"]
+    assert stage["calls"] == 1
+    assert stage["passes"] == 2
+    assert stage["nodes_in"] == 11
+    assert stage["nodes_out"] == 3
+    assert json.loads(p.to_json()) == json.loads(json.dumps(report))
+
+
+def test_profiler_disabled():
+    profiler.reset()
+    rewrite(parse("1*x = y"), [postprocess_trivial_mul], name="post")
+    assert profiler.enabled == False
+    assert profiler.report() == {"rules": {}, "stages": {}}
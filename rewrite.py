@@ -0,0 +1,302 @@
+from collections import OrderedDict
+from time import perf_counter
+from typing import Callable, List, Tuple
+from equation_parser import AST, BinOp, UnaryOp
+from numeric import get_backend
+from pattern_matcher import DiscriminationNet
+from profiler import profiler
+from utils import copy_tree, inorder, invalidate_hash, structural_hash, structurally_equal, track_changes
+
+# Rewrite rule, returns True if it changed the tree at given node
+Rule = Callable[[AST], bool]
+
+
+class RewriteStats:
+    """Work counters collected by rewrite()"""
+
+    def __init__(self):
+        self.passes = 0
+        self.visits = 0  # nodes considered by rules
+        self.attempts = 0  # rule calls
+        self.fires = 0
+        self.cache_hits = 0  # rewrites answered by the stage cache
+
+    def as_dict(self) -> dict:
+        return {"passes": self.passes, "visits": self.visits,
+                "attempts": self.attempts, "fires": self.fires,
+                "cache_hits": self.cache_hits}
+
+
+def _count_nodes(tree: AST) -> int:
+    return sum(1 for _ in inorder(tree))
+
+
+class StageCache:
+    """LRU cache of whole stage results: maps a rewrite input (rules,
+    numeric backend, parent context and the tree structure) to the
+    rewritten tree
+
+    The stages rewrite whole equations, so an entry only hits when the
+    same stage runs again on the same equation, e.g. solving it for
+    another symbol or the solver repeating its stages. Equations which
+    merely share subtrees do not hit. The parent context only matters for
+    rewrites of subtrees, the stages pass roots without a parent.
+    Entries keep copies of the input, to rule out hash collisions, and of
+    the result, which is copied again into the rewritten tree."""
+
+    def __init__(self, maxsize: int = 512, enabled: bool = True):
+        self.maxsize = maxsize
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.nodes = 0  # nodes held by the cached trees
+        self._entries: OrderedDict[tuple, Tuple[AST, AST, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, root: AST, rules: List[Rule]) -> tuple:
+        parent = root.parent
+        parent_type = parent.token.type if parent != None else None
+        return (tuple(rules), get_backend().name, parent_type, structural_hash(root))
+
+    def lookup(self, root: AST, rules: List[Rule]) -> bool:
+        """Rewrites root in place with the cached result, returns False on a miss"""
+        key = self._key(root, rules)
+        entry = self._entries.get(key, None)
+        if entry == None or not structurally_equal(entry[0], root):
+            self.misses += 1
+            return False
+        self.hits += 1
+        self._entries.move_to_end(key)
+        _graft(root, copy_tree(entry[1]))
+        return True
+
+    def store(self, key: tuple, original: AST, result: AST):
+        """Stores result of rewriting original, key has to be computed before rewriting"""
+        nodes = _count_nodes(original) + _count_nodes(result)
+        previous = self._entries.pop(key, None)
+        if previous != None:
+            self.nodes -= previous[2]
+        self._entries[key] = (original, copy_tree(result), nodes)
+        self.nodes += nodes
+        while len(self._entries) > self.maxsize:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self.nodes -= evicted
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries), "nodes": self.nodes}
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.nodes = 0
+
+
+def _graft(root: AST, tree: AST):
+    """Makes root look like tree, root keeps its identity and parent"""
+    invalidate_hash(root)
+    root.token = tree.token
+    if isinstance(root, BinOp):
+        root.op = tree.token
+        root.left = tree.left
+        root.right = tree.right
+        root.left.parent = root
+        root.right.parent = root
+    elif isinstance(root, UnaryOp):
+        root.op = tree.token
+        root.expr = tree.expr
+        root.expr.parent = root
+    else:
+        root.value = tree.token.value
+
+
+# Process wide cache of the simplification stage results
+stage_cache = StageCache()
+
+
+def rewrite(root: AST, rules: List[Rule], stats: RewriteStats | None = None, incremental: bool = True,
+            index: DiscriminationNet | None = None, cache: StageCache | None = None,
+            name: str | None = None):
+    """Applies rules to the tree nodes until none of them fires anymore
+
+    Without incremental and index, rules are tried in plain sweeps: rule by
+    rule, every rule over all nodes in inorder, sweeping again after any
+    change.
+
+    Otherwise nodes are visited one by one in inorder and every node is
+    tried with its rules, in rule order. With incremental set, only the
+    first sweep visits all nodes. Later sweeps visit the nodes the rules
+    changed (recorded by invalidate_hash(), which replace() and swap()
+    call), the new nodes below them, their children, whose parent changed,
+    and their ancestors, whose subtree changed. Unchanged neighbourhoods
+    are not visited again.
+
+    With index set, a node is only tried with the rules the index lists as
+    its candidates, looked up once per visit, so the cost of a visit does
+    not grow with the number of rules.
+
+    With cache set (and enabled), a tree that was rewritten with the same
+    rules before is replaced with the cached result without running any
+    rule. The cache works on the whole root only, see StageCache.
+
+    While the profiler is enabled, rule calls and the work of the stage
+    (reported under name) are recorded, see profiler.py."""
+    if stats == None:
+        stats = RewriteStats()
+    if profiler.enabled:
+        return _profiled_rewrite(root, rules, stats, incremental, index, cache, name)
+    return _rewrite(root, rules, rules, stats, incremental, index, cache)
+
+
+def _profiled_rewrite(root: AST, rules: List[Rule], stats: RewriteStats, incremental: bool,
+                      index: DiscriminationNet | None, cache: StageCache | None,
+                      name: str | None) -> RewriteStats:
+    stage = profiler.stage(name if name != None else "rewrite")
+    before = stats.as_dict()
+    stage.calls += 1
+    stage.nodes_in += _count_nodes(root)
+    start = perf_counter()
+    _rewrite(root, rules, [profiler.wrap(rule) for rule in rules],
+             stats, incremental, index, cache)
+    stage.seconds += perf_counter() - start
+    stage.nodes_out += _count_nodes(root)
+    stage.passes += stats.passes - before["passes"]
+    stage.visits += stats.visits - before["visits"]
+    stage.cache_hits += stats.cache_hits - before["cache_hits"]
+    return stats
+
+
+def _rewrite(root: AST, rules: List[Rule], calls: List[Rule], stats: RewriteStats, incremental: bool,
+             index: DiscriminationNet | None, cache: StageCache | None) -> RewriteStats:
+    # calls are the functions run for the rules, rules themselves are
+    # used as the cache and index keys
+    if cache != None and cache.enabled:
+        if cache.lookup(root, rules):
+            stats.cache_hits += 1
+            return stats
+        key = cache._key(root, rules)
+        original = copy_tree(root)
+    if incremental or index != None:
+        _rewrite_nodes(root, rules, calls, stats, incremental, index)
+    else:
+        _sweep(root, calls, stats)
+    if cache != None and cache.enabled:
+        cache.store(key, original, root)
+    return stats
+
+
+def _sweep(root: AST, calls: List[Rule], stats: RewriteStats):
+    rerun = True
+    while rerun:
+        rerun = False
+        stats.passes += 1
+        for call in calls:
+            for node in inorder(root):
+                stats.visits += 1
+                stats.attempts += 1
+                if call(node):
+                    stats.fires += 1
+                    rerun = True
+
+
+def _children(node: AST) -> Tuple[AST, ...]:
+    if isinstance(node, BinOp):
+        return (node.left, node.right)
+    if isinstance(node, UnaryOp):
+        return (node.expr,)
+    return ()
+
+
+def _attached(node: AST, root: AST) -> bool:
+    """Checks if the parent still links to node, nodes replaced earlier in
+    the sweep are skipped"""
+    parent = node.parent
+    if parent == None:
+        return node is root
+    if isinstance(parent, BinOp):
+        return parent.left is node or parent.right is node
+    if isinstance(parent, UnaryOp):
+        return parent.expr is node
+    return False
+
+
+def _inorder(root: AST, keep: set | None = None) -> List[AST]:
+    """Iterative inorder, with keep set only the kept nodes are listed and
+    descended into"""
+    result = []
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            result.append(node)
+        elif keep == None or node in keep:
+            if isinstance(node, BinOp):
+                stack.append((node.right, False))
+                stack.append((node, True))
+                stack.append((node.left, False))
+            elif isinstance(node, UnaryOp):
+                stack.append((node, True))
+                stack.append((node.expr, False))
+            else:
+                result.append(node)
+    return result
+
+
+def _dirty_nodes(changes: List[AST], seen: set) -> set:
+    """Returns the changed nodes with their ancestors, children and the new
+    nodes below them, closed under ancestors"""
+    dirty = set()
+    for changed in changes:
+        node = changed
+        while node != None and node not in dirty:
+            dirty.add(node)
+            node = node.parent
+        stack = list(_children(changed))
+        while stack:
+            node = stack.pop()
+            dirty.add(node)
+            if node not in seen:
+                stack.extend(_children(node))
+    return dirty
+
+
+def _rewrite_nodes(root: AST, rules: List[Rule], calls: List[Rule], stats: RewriteStats,
+                   incremental: bool, index: DiscriminationNet | None):
+    order = {rule: position for position, rule in enumerate(rules)}
+    call_of = dict(zip(rules, calls))
+    changes = []
+    with track_changes(changes):
+        pending = _inorder(root)
+        seen = set()
+        while pending:
+            stats.passes += 1
+            seen.update(pending)
+            fired = False
+            for node in pending:
+                if fired and not _attached(node, root):
+                    continue
+                stats.visits += 1
+                if index != None:
+                    node_rules = sorted((rule for rule in index.candidates(node) if rule in order),
+                                        key=order.__getitem__)
+                else:
+                    node_rules = rules
+                for rule in node_rules:
+                    stats.attempts += 1
+                    if call_of[rule](node):
+                        stats.fires += 1
+                        fired = True
+                        if not _attached(node, root):
+                            break
+            if not fired:
+                break
+            if incremental:
+                pending = _inorder(root, _dirty_nodes(changes, seen))
+            else:
+                pending = _inorder(root)
+            changes.clear()
@@ -0,0 +1,92 @@
+from collection import collect, collection_functions, collection_index
+from equation_parser import parse
+from numeric import use_backend
+from postprocessing import postprocess_trivial_mul, postprocess_trivial_power
+from preprocessing import preprocess
+from rewrite import StageCache, rewrite
+from utils import inorder, trace
+
+
+def test_rewrite_fixpoint():
+    tree = parse("1*(1*x^1)^1 = y")
+    stats = rewrite(tree, [postprocess_trivial_mul, postprocess_trivial_power])
+    assert trace(tree) == "x=y"
+    assert stats.fires == 4
+
+
+def test_rewrite_incremental_same_result():
+    for equation in ["x+2+x=1", "x^2*x^3+3*x-x*2=1", "sin(1+2)*y-y=x/x"]:
+        plain = parse(equation)
+        incremental = parse(equation)
+        for stage in [preprocess, collect]:
+            stage(plain)
+            stage(incremental)
+        rules = [postprocess_trivial_mul, postprocess_trivial_power]
+        plain_stats = rewrite(plain, rules, incremental=False)
+        incremental_stats = rewrite(incremental, rules)
+        assert trace(plain) == trace(incremental)
+        assert incremental_stats.fires == plain_stats.fires
+        assert incremental_stats.visits < plain_stats.visits
+
+
+def test_rewrite_skips_unchanged_nodes():
+    tree = parse("1*x + y*z*w = 2")
+    first_sweep = len(inorder(tree))
+    stats = rewrite(tree, [postprocess_trivial_mul])
+    # second pass only visits the changed node's ancestors and children
+    assert stats.passes == 2
+    assert stats.visits - first_sweep == 4
+
+
+def test_rewrite_index_same_result():
+    for equation in ["x+2+x=1", "x^2*x^3+3*x-x*2=1", "sin(1+2)*y-y=x/x"]:
+        plain = parse(equation)
+        indexed = parse(equation)
+        preprocess(plain)
+        preprocess(indexed)
+        plain_stats = rewrite(plain, collection_functions)
+        indexed_stats = rewrite(indexed, collection_functions, index=collection_index)
+        assert trace(plain) == trace(indexed)
+        assert indexed_stats.fires == plain_stats.fires
+        assert indexed_stats.attempts < plain_stats.attempts
+
+
+def test_rewrite_cache():
+    cache = StageCache()
+    rules = [postprocess_trivial_mul, postprocess_trivial_power]
+    first = parse("1*(1*x^1)^1 = y")
+    rewrite(first, rules, cache=cache)
+    second = parse("1*(1*x^1)^1 = y")
+    stats = rewrite(second, rules, cache=cache)
+    assert stats.cache_hits == 1
+    assert stats.attempts == 0
+    assert trace(second) == trace(first) == "x=y"
+    assert second.left != first.left  # results are copies
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["nodes"] > 0
+
+    # other rules, numeric backend or a disabled cache do not hit
+    rewrite(parse("1*(1*x^1)^1 = y"), rules[:1], cache=cache)
+    with use_backend("exact"):
+        rewrite(parse("1*(1*x^1)^1 = y"), rules, cache=cache)
+    cache.enabled = False
+    assert rewrite(parse("1*(1*x^1)^1 = y"), rules, cache=cache).cache_hits == 0
+    assert cache.stats()["hits"] == 1
+    assert len(cache) == 3
+
+
+def test_rewrite_index_node_major():
+    looked_up = []
+
+    class CountingIndex:
+        def candidates(self, node):
+            looked_up.append(node)
+            return collection_index.candidates(node)
+
+    tree = parse("x*2*3 + 4*5 = y")
+    preprocess(tree)
+    stats = rewrite(tree, collection_functions, index=CountingIndex())
+    assert trace(tree) == "(((x^1)*6)+20)=(1*(y^1))"
+    # candidates are looked up once per node visit, not per rule and node
+    assert len(looked_up) == stats.visits
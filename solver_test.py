@@ -1,7 +1,8 @@
-from equation_parser import AST, UnaryOp
-from isolation import Solver
+import pytest
+from equation_parser import AST, Num, UnaryOp, parse
+from isolation import Solver, SolverException, SymbolIndex
 from lexer import TokenType
-from utils import trace
+from utils import create_mul_op, create_num, create_sym, replace, trace, track_changes
 
 #Tests entire solving process 
 
@@ -251,3 +252,76 @@ def test_solver_unary_op():
     assert r.right.expr.left.value == "a"
     assert r.right.expr.right.value == "b"
     assert r.left.value == "c"
+
+
+def test_solver_is_quiet(capsys):
+    Solver("a+b=c").solve("a")
+    assert capsys.readouterr().out == ""
+
+
+def test_solver_tracer():
+    stages = []
+    Solver("a+b=c", lambda stage, root: stages.append((stage, trace(root)))).solve("a")
+    assert [stage for stage, _ in stages] == ["input", "attract", "preprocess", "collect", "postprocess",
+                                              "isolate", "attract", "preprocess", "collect", "postprocess"]
+    assert stages[0][1] == "(a+b)=c"
+
+
+def test_solver_unary_function():
+    assert trace(Solver("sin(x)=z").solve("x")) == "x=asin(z)"
+    assert trace(Solver("z=cos(y^3*x)").solve("x")) == "x=(acos(z)/(y^3))"
+
+
+def test_symbol_index():
+    s = Solver("a + b = a + c")
+    index = SymbolIndex(s.root)
+    assert index.get("a") == s.dfs("a")
+    assert index.get("c") == s.dfs("c")
+    assert index.get("d") == []
+
+
+def test_symbol_index_tracks_changes():
+    root = parse("a + b = c")
+    index = SymbolIndex(root)
+    b = index.get("b")[0]
+    with track_changes(index.changes):
+        replace(b, create_mul_op(create_num(2), create_sym("a")))
+    index.update()
+    assert [index.side(a) for a in index.get("a")] == [root.left, root.left]
+    assert index.side(b) == None
+    assert index.side(index.get("c")[0]) is root.right
+
+
+def test_solver_same_result_when_cached():
+    # the second solve is served from the stage cache
+    for equation in ["x^3=2", "y=x^3+z", "a*x+b=c"]:
+        first = trace(Solver(equation).solve("x"))
+        assert trace(Solver(equation).solve("x")) == first
+    assert trace(Solver("x^3=2").solve("x")) == "x=1.2599210498948732"
+
+
+def test_solver_stale_parent_pointers():
+    def break_parent(parent):
+        def tracer(stage, root):
+            if stage == "postprocess":
+                x = SymbolIndex(root).get("x")[0]
+                x.parent = parent(root)
+        return tracer
+
+    # x claims to be a child of the root, which does not link it
+    s = Solver("x^3=2", break_parent(lambda root: root))
+    with pytest.raises(SolverException, match="not found"):
+        s.solve("x")
+    # x is not connected to the root at all
+    s = Solver("x^3=2", break_parent(lambda root: UnaryOp(Num(root.right.token), root.token)))
+    with pytest.raises(SolverException, match="not found"):
+        s.solve("x")
+
+
+def test_solver_like_terms():
+    stages = []
+    r = Solver("x*sin(z)+y+sin(z)*x=1", lambda stage, root: stages.append(stage), like_terms=True).solve("x")
+    assert trace(r) == "x=((0.5*(1-y))/sin(z))"
+    assert "attract" not in stages
+    with pytest.raises(SolverException):
+        Solver("x*sin(z)+y+sin(z)*x=1").solve("x")
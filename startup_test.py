@@ -0,0 +1,34 @@
+import subprocess
+import sys
+
+# Modules of every entry point, importing them must have no side effects
+entry_modules = ["main", "isolation", "system_solver", "equation_parser", "utils"]
+
+
+def run_python(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, check=True)
+
+
+def test_import_has_no_output():
+    for module in entry_modules:
+        assert run_python(f"import {module}").stdout == ""
+
+
+def test_import_does_not_load_optional_modules():
+    for optional in ["pygraphviz", "concurrent.futures.process"]:
+        code = f"import sys, {', '.join(entry_modules)}; print('{optional}' in sys.modules)"
+        assert run_python(code).stdout.strip() == "False"
+
+
+def test_import_does_not_parse():
+    # Count lexed strings while importing, parsing or solving would lex
+    code = "\n".join([
+        "import lexer",
+        "calls = []",
+        "iter_tokens = lexer.iter_tokens",
+        "lexer.iter_tokens = lambda s: calls.append(s) or iter_tokens(s)",
+        f"import {', '.join(entry_modules)}",
+        "print(len(calls))",
+    ])
+    assert run_python(code).stdout.strip() == "0"
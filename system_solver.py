@@ -2,10 +2,11 @@ from collections import defaultdict
 from copy import deepcopy
 from typing import List
 from attraction import attract
-from equation_parser import AST, BinOp, Num, Parser, UnaryOp
+from equation_parser import AST, BinOp, Num, UnaryOp, parse_many
 from lexer import TokenType
 from isolation import Solver, collect
-from utils import create_graphviz_graph, inorder, trace
+from parse_cache import parse_cached
+from utils import copy_tree, create_graphviz_graph, inorder, replace, structural_hash, structurally_equal, trace
 
 
 class SystemSolverException(Exception):
@@ -43,18 +44,23 @@ def substitute(eq: BinOp, var: str, to: AST):
     for n in nodes:
         if isinstance(n, Num):
             if n.token.type == TokenType.SYM and n.value == var:
-                if isinstance(n.parent, BinOp):
-                    if n.isLeft():
-                        n.parent.left = to
-                    else:
-                        n.parent.right = to
-                    to.parent = n.parent
-                elif isinstance(n.parent, UnaryOp):
-                    n.parent.expr = to
-                    to.parent = n.parent
-                else:
+                if not isinstance(n.parent, (BinOp, UnaryOp)):
                     raise SystemSolverException(
                         "Equation tree in bad state - num node has a child.")
+                # every occurrence gets its own copy, shared subtrees
+                # would have only one parent
+                replace(n, copy_tree(to))
+
+
+def is_duplicate(seen: dict, symbol: str, sub: AST) -> bool:
+    """Checks if structurally equal substitution for symbol was seen before,
+    if not it is recorded in seen"""
+    candidates = seen.setdefault((symbol, structural_hash(sub)), [])
+    for candidate in candidates:
+        if structurally_equal(candidate, sub):
+            return True
+    candidates.append(sub)
+    return False
 
 
 def isSolution(eq: BinOp) -> bool:
@@ -107,8 +113,20 @@ class SystemSolver:
 
     def add_equation(self, eq: str):
         """Add equation to knowledge base"""
+        self._index_equation(eq, parse_cached(eq))
+
+    def add_equations(self, eqs: List[str], workers: int | None = None):
+        """Add many equations to knowledge base, parsing them in one batch.
+        If any of the equations cannot be parsed, none of them is added"""
+        results = parse_many(eqs, workers=workers)
+        for r in results:
+            if r.error != None:
+                raise r.error
+        for r in results:
+            self._index_equation(r.string, r.root)
+
+    def _index_equation(self, eq: str, r: AST):
         self.equations.append(eq)
-        r = Parser(eq).parse()
         tree = inorder(r)
         for n in tree:
             if isinstance(n, Num):
@@ -132,16 +150,20 @@ class SystemSolver:
             root.used_equations.append(target_symbol_equation)
             symbols = self.extract_symbols(eq)
             symbols.remove(target_symbol)
+            seen = {}
             # go through every symbol other than searched symbol
             for s in symbols:
                 # get equation that can be used to substitute symbols found in current equation
                 for sub_eq in self.symbol_eq_lookup[s]:
                     if sub_eq in root.used_equations:
                         continue
-                    cheq = deepcopy(eq)
                     solver = Solver(sub_eq)
                     sub = solver.solve(s)
                     sub = sub.right
+                    # skip substitutions equal to already applied ones
+                    if is_duplicate(seen, s, sub):
+                        continue
+                    cheq = deepcopy(eq)
                     substitute(cheq, s, sub)
                     child = SubstitutionTree(cheq, root)
                     child.used_equations.append(sub_eq)
@@ -161,14 +183,17 @@ class SystemSolver:
             symbols.remove(ssymbol)
         except:
             pass
+        seen = {}
         for s in symbols:
             for sub_eq in self.symbol_eq_lookup[s]:
                 if sub_eq in node.used_equations:
                     continue
-                cheq = deepcopy(eq)
                 solver = Solver(sub_eq)
                 sub = solver.solve(s)
                 sub = sub.right
+                if is_duplicate(seen, s, sub):
+                    continue
+                cheq = deepcopy(eq)
                 substitute(cheq, s, sub)
                 child = SubstitutionTree(cheq, node)
                 child.used_equations.append(sub_eq)
@@ -177,35 +202,36 @@ class SystemSolver:
         return result
 
 
-s = SystemSolver()
-# s.add_equation("x = y + z")
-# s.add_equation("y + z = 2")
-# r = s.solve("x")
-
-# s.add_equation("x = z + y")
-# s.add_equation("y = z")
-# s.add_equation("y = v")
-# s.add_equation("v = 2")
-# r = s.solve("x")
-
-# s.add_equation("ek = (m*v^2) / 2")
-# s.add_equation("p = m*v")
-# s.add_equation("p = 10")
-# s.add_equation("m = 5")
-# r = s.solve("ek")
-
-# s.add_equation("r = 1/2 * a*t^2")
-# s.add_equation("a = 10")
-# s.add_equation("t = 20")
-# r = s.solve("r")
-
-s.add_equation("sin(x) = 2+z")
-s.add_equation("z = sin(y)")
-s.add_equation("y = 1")
-r = s.solve("x")
-sol = getSolution(r)
-
-if sol != None:
-    print(trace(sol))
-else:
-    print("No solution found.")
+if __name__ == "__main__":
+    s = SystemSolver()
+    # s.add_equation("x = y + z")
+    # s.add_equation("y + z = 2")
+    # r = s.solve("x")
+
+    # s.add_equation("x = z + y")
+    # s.add_equation("y = z")
+    # s.add_equation("y = v")
+    # s.add_equation("v = 2")
+    # r = s.solve("x")
+
+    # s.add_equation("ek = (m*v^2) / 2")
+    # s.add_equation("p = m*v")
+    # s.add_equation("p = 10")
+    # s.add_equation("m = 5")
+    # r = s.solve("ek")
+
+    # s.add_equation("r = 1/2 * a*t^2")
+    # s.add_equation("a = 10")
+    # s.add_equation("t = 20")
+    # r = s.solve("r")
+
+    s.add_equation("sin(x) = 2+z")
+    s.add_equation("z = sin(y)")
+    s.add_equation("y = 1")
+    r = s.solve("x")
+    sol = getSolution(r)
+
+    if sol != None:
+        print(trace(sol))
+    else:
+        print("No solution found.")
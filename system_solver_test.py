@@ -1,3 +1,4 @@
+from numeric import use_backend
 from system_solver import SystemSolver, getSolution
 from utils import trace
 
@@ -29,10 +30,28 @@ def test_physics():
     r = s.solve("ek")
     assert trace(getSolution(r)) == "ek=10.0"
 
+
+def test_physics_exact():
+    with use_backend("exact"):
+        s = SystemSolver()
+        s.add_equation("ek = (m*v^2) / 2")
+        s.add_equation("p = m*v")
+        s.add_equation("p = 10")
+        s.add_equation("m = 5")
+        r = s.solve("ek")
+    assert trace(getSolution(r)) == "ek=10"
+
 def test_trig():
     s = SystemSolver()
     s.add_equation("sin(x) = 2+z")
     s.add_equation("z = sin(y)")
     s.add_equation("y = 1")
     r = s.solve("x")
-    assert trace(getSolution(r)) == "x=asin((2+sin(1)))"
+    assert trace(getSolution(r)) == "x=asin(2.8414709848078967)"
+
+
+def test_add_equations():
+    s = SystemSolver()
+    s.add_equations(["x = z + y", "y = z", "y = v", "v = 2"])
+    r = s.solve("x")
+    assert trace(getSolution(r)) == "x=4"
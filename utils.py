@@ -1,8 +1,9 @@
+import threading
+from contextlib import contextmanager
 from functools import reduce
-from typing import List
-from lexer import Token, TokenType
+from typing import Iterator, List
+from lexer import DIV_TOKEN, MINUS_TOKEN, MUL_TOKEN, PLUS_TOKEN, POW_TOKEN, Token, TokenType
 from equation_parser import AST, BinOp, Num, UnaryOp
-import pygraphviz
 
 
 def inorder(tree: AST) -> List[AST]:
@@ -23,11 +24,41 @@ def preorder(tree: AST):
     pass
 
 
+def copy_tree(tree: AST) -> AST:
+    """Creates a structural copy of the tree, tokens are immutable and shared
+    between the copies. Works iteratively, so deep trees are supported"""
+    stack = [(tree, False)]
+    copies = []
+    while stack:
+        node, children_copied = stack.pop()
+        if isinstance(node, BinOp):
+            if children_copied:
+                right = copies.pop()
+                left = copies.pop()
+                copies.append(BinOp(left, node.token, right))
+            else:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+        elif isinstance(node, UnaryOp):
+            if children_copied:
+                copies.append(UnaryOp(copies.pop(), node.token))
+            else:
+                stack.append((node, True))
+                stack.append((node.expr, False))
+        else:
+            copies.append(Num(node.token))
+    return copies[0]
+
+
 def postorder(tree: AST):
     pass
 
 
 def create_graphviz_graph(root: AST, path: str):
+    # Imported here, so that the native library is only loaded when a graph
+    # is actually drawn
+    import pygraphviz
     G = pygraphviz.AGraph(directed=True)
 
     counter = 0
@@ -85,23 +116,23 @@ def _trace(root: AST) -> str:
 
 
 def create_plus_op(left: AST, right: AST, parent: AST | None = None) -> BinOp:
-    return BinOp(left, Token('+', TokenType.PLUS), right, parent)
+    return BinOp(left, PLUS_TOKEN, right, parent)
 
 
 def create_minus_op(left: AST, right: AST, parent: AST | None = None) -> BinOp:
-    return BinOp(left, Token('-', TokenType.MINUS), right, parent)
+    return BinOp(left, MINUS_TOKEN, right, parent)
 
 
 def create_mul_op(left: AST, right: AST, parent: AST | None = None) -> BinOp:
-    return BinOp(left, Token('*', TokenType.MUL), right, parent)
+    return BinOp(left, MUL_TOKEN, right, parent)
 
 
 def create_div_op(left: AST, right: AST, parent: AST | None = None) -> BinOp:
-    return BinOp(left, Token('/', TokenType.DIV), right, parent)
+    return BinOp(left, DIV_TOKEN, right, parent)
 
 
 def create_pow_op(left: AST, right: AST, parent: AST | None = None) -> BinOp:
-    result = BinOp(left, Token('^', TokenType.POW), right, parent)
+    result = BinOp(left, POW_TOKEN, right, parent)
     return result
 
 
@@ -114,7 +145,7 @@ def create_sym(sym: int | float | str = "", parent: AST | None = None) -> Num:
 
 
 def create_minus_unary(expr: AST, parent: AST | None = None):
-    return UnaryOp(expr, Token('-', TokenType.MINUS), parent)
+    return UnaryOp(expr, MINUS_TOKEN, parent)
 
 def create_func_unary(expr: AST, func: str, parent: AST | None = None):
     return UnaryOp(expr, Token(func, TokenType.FUNC), parent)
@@ -122,6 +153,7 @@ def create_func_unary(expr: AST, func: str, parent: AST | None = None):
 def add_unary_minus(node: AST):
     """Adds unary minus to target node, placing unary minus node in-between
     parent node and target node"""
+    invalidate_hash(node.parent)
     parent = node.parent
     op = create_minus_unary(node, node.parent)
     if isinstance(parent, UnaryOp):
@@ -135,6 +167,7 @@ def add_unary_minus(node: AST):
 
 def replace(original_op, new_op):
     """Replaces original_op with new_op and updateds parent references"""
+    invalidate_hash(original_op.parent)
     if isinstance(original_op.parent, UnaryOp):
         original_op.parent.expr = new_op
     elif isinstance(original_op.parent, BinOp):
@@ -154,6 +187,8 @@ def swap(a: AST, b: AST):
     # replace parent references
     a_parent = a.parent
     b_parent = b.parent
+    invalidate_hash(a_parent)
+    invalidate_hash(b_parent)
     if isinstance(a_parent, UnaryOp):
         a_parent.expr = b
     elif isinstance(a_parent, BinOp):
@@ -215,3 +250,99 @@ def distance(a: AST, b: AST) -> int | None:
     # paths to the earliest intersection parent. We add +2 to account for python
     # 0-based indexing
     return a_idx + b_idx + 2
+
+
+# Structural hashing
+# Every node caches the hash of its subtree in _hash. A node can only have
+# a cached hash if all of its descendants have one, so invalidation can stop
+# at the first ancestor without a cached hash.
+
+
+class _Recordings(threading.local):
+    """Change logs recording on the current thread, innermost last"""
+
+    def __init__(self):
+        self.logs: List[List[AST]] = []
+
+
+_recordings = _Recordings()
+
+
+@contextmanager
+def track_changes(changes: List[AST]) -> Iterator[List[AST]]:
+    """Records nodes passed to invalidate_hash() on this thread into changes
+    while the block runs, so that only the changed parts of a tree are
+    visited again. Recordings nest, every active one gets the node"""
+    logs = _recordings.logs
+    logs.append(changes)
+    try:
+        yield changes
+    finally:
+        logs.pop()
+
+
+def invalidate_hash(node: AST | None):
+    """Drops cached structural hash of node and all of its ancestors,
+    has to be called whenever children or token of node change"""
+    if node != None:
+        for changes in _recordings.logs:
+            changes.append(node)
+    while node != None and node._hash != None:
+        node._hash = None
+        node = node.parent
+
+
+def structural_hash(tree: AST) -> int:
+    """Returns hash of the subtree structure: node classes, token types and
+    values. Hashes are cached on the nodes, so after a replace() or swap()
+    only the nodes on the path to the root are hashed again"""
+    stack = [tree]
+    while stack:
+        node = stack[-1]
+        if node._hash != None:
+            stack.pop()
+            continue
+        token = node.token
+        if isinstance(node, BinOp):
+            left = node.left._hash
+            right = node.right._hash
+            if left == None:
+                stack.append(node.left)
+                continue
+            if right == None:
+                stack.append(node.right)
+                continue
+            node._hash = hash((BinOp, token.type, type(token.value), token.value, left, right))
+        elif isinstance(node, UnaryOp):
+            expr = node.expr._hash
+            if expr == None:
+                stack.append(node.expr)
+                continue
+            node._hash = hash((UnaryOp, token.type, type(token.value), token.value, expr))
+        else:
+            node._hash = hash((type(node), token.type, type(token.value), token.value))
+        stack.pop()
+    return tree._hash
+
+
+def structurally_equal(a: AST, b: AST) -> bool:
+    """Returns True if both subtrees have the same shape, token types and values.
+    Unlike ==, which compares node identity"""
+    if a is b:
+        return True
+    if structural_hash(a) != structural_hash(b):
+        return False
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if (type(a) != type(b)
+                or a.token.type != b.token.type
+                or type(a.token.value) != type(b.token.value)
+                or a.token.value != b.token.value):
+            return False
+        if isinstance(a, BinOp):
+            stack.append((a.left, b.left))
+            stack.append((a.right, b.right))
+        elif isinstance(a, UnaryOp):
+            stack.append((a.expr, b.expr))
+    return True
@@ -44,3 +44,55 @@ def test_trace():
     tree = BinOp(BinOp(Num(Token(2, None)), Token("+", None), Num(Token("a", None))),
                  Token("=", None), BinOp(Num(Token("b", None)), Token("*", None), Num(Token("c", None))))
     assert test_str == utils.trace(tree)
+
+
+def test_copy_tree():
+    tree = BinOp(BinOp(Num(Token(2, None)), Token("+", None), Num(Token("a", None))),
+                 Token("=", None), Num(Token("b", None)))
+    result = utils.copy_tree(tree)
+    assert utils.trace(result) == utils.trace(tree)
+    assert result is not tree and result.left is not tree.left
+    assert result.left.parent is result and result.parent == None
+
+
+def test_structural_hash():
+    from equation_parser import parse
+    a = parse("x^2 + 1 = y")
+    b = parse("x^2+1=y")
+    assert utils.structural_hash(a) == utils.structural_hash(b)
+    assert utils.structurally_equal(a, b)
+    assert a != b  # == still compares identity
+    c = parse("x^2+1=y")
+    utils.replace(c.left.right, utils.create_num(1.0))
+    assert not utils.structurally_equal(a, c)
+    assert not utils.structurally_equal(a, parse("x^2-1=y"))
+
+
+def test_structural_hash_invalidation():
+    from equation_parser import parse
+    a = parse("x^2 + 1 = y")
+    b = parse("x^2 + 1 = y")
+    utils.structural_hash(a)
+    utils.replace(a.left.right, utils.create_num(2))
+    assert not utils.structurally_equal(a, b)
+    assert utils.structurally_equal(a, parse("x^2 + 2 = y"))
+    utils.swap(a.left.right, a.right)
+    assert utils.structurally_equal(a, parse("x^2 + y = 2"))
+
+
+def test_track_changes_nested_and_per_thread():
+    import threading
+    from equation_parser import parse
+    a = parse("x + 1 = y")
+    b = parse("z + 1 = y")
+    outer, inner = [], []
+    with utils.track_changes(outer):
+        with utils.track_changes(inner):
+            utils.replace(a.left.right, utils.create_num(2))
+        # changes made by another thread are not recorded here
+        thread = threading.Thread(target=lambda: utils.replace(b.left.right, utils.create_num(2)))
+        thread.start()
+        thread.join()
+    utils.replace(a.left.left, utils.create_num(3))
+    assert inner == [a.left]
+    assert outer == [a.left]